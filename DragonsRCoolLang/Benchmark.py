@@ -0,0 +1,250 @@
+"""
+Throughput benchmarks for the DragonsRCool front end.
+
+Builds synthetic programs of a configurable size, plus scaled up copies
+of the bundled samples, and times lexing and parsing separately for
+each lexer. Results are printed as a table and can be saved as JSON so
+runs can be compared across commits:
+
+    python Benchmark.py --scale 2 --output bench.json
+"""
+import io
+import os
+import re
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+from Lexer import Token, LEXERS, ReplayLexer
+from Parser import Parser
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLES = ('BubbleSort', 'Quicksort', 'Hanoi', 'Matrix')
+
+
+def gen_functions(count):
+  """
+    A program made of many small dragon functions.
+    """
+  src = ['dragon main fire\n  < shoot "start" $ >\nextinguish\n']
+  for i in range(count):
+    src.append(f'''
+dragon f{i} a, b fire
+  < small x : a + b * 2 $ >
+  < path x spits 10 here < x : x - 1 $ > here there < x : x + 1 $ > there >
+  < burn x eats 100 fire < x : x * 2 $ > extinguish >
+  < hatch f{i}[x, b] >
+  < return x >
+extinguish
+''')
+  src.append('end\n')
+  return ''.join(src)
+
+
+def gen_nesting(depth):
+  """
+    One function with burn and path blocks nested depth levels deep.
+    """
+  head = ['dragon main fire\n  < small i : 0 $ >\n']
+  tail = ['extinguish\nend\n']
+  for level in range(depth):
+    indent = '  ' * (level + 1)
+    if level % 2:
+      head.append(f'{indent}< path i is 0 here\n')
+      tail.append(f'{indent}here >\n')
+    else:
+      head.append(f'{indent}< burn i eats 1 fire\n')
+      tail.append(f'{indent}extinguish >\n')
+  head.append('  ' * (depth + 1) + '< i : i + 1 $ >\n')
+  return ''.join(head) + ''.join(reversed(tail))
+
+
+def gen_chain(length, count=10):
+  """
+    Statements with long chains of additions and subtractions.
+    """
+  src = ['dragon main fire\n  < small x : 1 $ >\n']
+  for _ in range(count):
+    terms = ' + '.join('x - 1' for _ in range(length // 2 + 1))
+    src.append(f'  < x : {terms} $ >\n')
+  src.append('extinguish\nend\n')
+  return ''.join(src)
+
+
+def gen_strings(count, size):
+  """
+    Writes of big string literals.
+    """
+  text = ('dragons are cool ' * (size // 17 + 1))[:size]
+  src = ['dragon main fire\n']
+  for _ in range(count):
+    src.append(f'  < shoot "{text}" $ >\n')
+  src.append('extinguish\nend\n')
+  return ''.join(src)
+
+
+def gen_sample(name, copies):
+  """
+    A bundled sample with its functions copied and renamed.
+    """
+  with open(os.path.join(SAMPLE_DIR, name)) as f:
+    src = f.read()
+  src = re.sub(r'\bend\s*$', '', src)
+  names = re.findall(r'\bdragon\s+(\w+)', src)
+  pattern = re.compile(r'\b(' + '|'.join(names) + r')\b')
+
+  out = [src]
+  for i in range(1, copies):
+    out.append(pattern.sub(lambda m: f'{m.group(1)}_{i}', src))
+  out.append('\nend\n')
+  return ''.join(out)
+
+
+def build_cases(scale):
+  """
+    Return the list of (name, source) pairs to benchmark.
+    """
+  def n(x):
+    return max(1, int(x * scale))
+
+  cases = [
+    ('functions', gen_functions(n(2000))),
+    ('nesting', gen_nesting(n(60))),
+    ('chain', gen_chain(n(150))),
+    ('strings', gen_strings(n(2000), 2000)),
+  ]
+  for name in SAMPLES:
+    cases.append((name, gen_sample(name, n(300))))
+  return cases
+
+
+def lex_all(lexer_cls, src):
+  """
+    Run a lexer over src and return the list of tokens.
+    """
+  lex = lexer_cls(io.StringIO(src))
+  tokens = []
+  while lex.next().token != Token.EOF:
+    tokens.append(lex.get_tok())
+  tokens.append(lex.get_tok())
+  return tokens
+
+
+def best_time(fun, repeat):
+  """
+    Return the best wall time of repeat calls to fun, and its result.
+    """
+  best = None
+  result = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fun()
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best, result
+
+
+def peak_memory(fun):
+  """
+    Return the peak traced memory in bytes used while calling fun.
+    """
+  tracemalloc.start()
+  try:
+    fun()
+    return tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+
+def run_case(name, src, lexer_name, repeat):
+  """
+    Benchmark lexing and parsing of one source with one lexer.
+    """
+  lexer_cls = LEXERS[lexer_name]
+  size = len(src.encode())
+  result = {'case': name, 'lexer': lexer_name, 'bytes': size}
+
+  lex_time, tokens = best_time(lambda: lex_all(lexer_cls, src), repeat)
+  result['tokens'] = len(tokens)
+  result['lex_seconds'] = lex_time
+  result['lex_mb_per_s'] = size / lex_time / 1e6
+  result['lex_peak_bytes'] = peak_memory(lambda: lex_all(lexer_cls, src))
+
+  def parse():
+    return Parser(ReplayLexer(tokens)).parse()
+
+  try:
+    parse_time, _ = best_time(parse, repeat)
+  except RecursionError:
+    result['parse_error'] = 'RecursionError'
+    return result
+  result['parse_seconds'] = parse_time
+  result['parse_tokens_per_s'] = len(tokens) / parse_time
+  result['parse_peak_bytes'] = peak_memory(parse)
+  return result
+
+
+def git_commit():
+  """
+    Return the commit the benchmark is running on, if there is one.
+    """
+  try:
+    out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                         cwd=SAMPLE_DIR,
+                         capture_output=True,
+                         text=True)
+  except OSError:
+    return None
+  return out.stdout.strip() or None
+
+
+def print_report(results):
+  print(f"{'case':<12}{'lexer':<10}{'KB':>9}{'tokens':>10}"
+        f"{'lex MB/s':>10}{'parse tok/s':>13}{'peak KB':>10}")
+  for r in results:
+    if 'parse_error' in r:
+      parse = r['parse_error']
+      peak = r['lex_peak_bytes']
+    else:
+      parse = f"{r['parse_tokens_per_s']:.0f}"
+      peak = max(r['lex_peak_bytes'], r['parse_peak_bytes'])
+    print(f"{r['case']:<12}{r['lexer']:<10}{r['bytes'] // 1024:>9}"
+          f"{r['tokens']:>10}{r['lex_mb_per_s']:>10.2f}{parse:>13}"
+          f"{peak // 1024:>10}")
+
+
+if __name__ == "__main__":
+  arg_parser = argparse.ArgumentParser(
+    description="Benchmark the DragonsRCool lexers and parser.")
+  arg_parser.add_argument("--scale", type=float, default=1.0,
+                          help="multiplier for the size of every case")
+  arg_parser.add_argument("--repeat", type=int, default=3,
+                          help="runs per measurement, the best is kept")
+  arg_parser.add_argument("--lexer", action="append", choices=LEXERS,
+                          help="lexer to benchmark (default: all)")
+  arg_parser.add_argument("--case", action="append",
+                          help="only run the named case")
+  arg_parser.add_argument("--output", help="write the results as JSON")
+  args = arg_parser.parse_args()
+
+  results = []
+  for name, src in build_cases(args.scale):
+    if args.case and name not in args.case:
+      continue
+    for lexer_name in args.lexer or LEXERS:
+      results.append(run_case(name, src, lexer_name, args.repeat))
+  print_report(results)
+
+  if args.output:
+    report = {
+      'commit': git_commit(),
+      'python': platform.python_version(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'scale': args.scale,
+      'results': results
+    }
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
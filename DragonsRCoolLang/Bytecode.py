@@ -0,0 +1,575 @@
+"""
+A bytecode compiler and stack based virtual machine for DragonsRCool.
+
+Each function is compiled, on its first call, into a flat list of
+integers: an opcode followed by its argument. Literals come from a
+constant pool. Names are resolved to the frame and global slots of
+Resolver: every name the function writes with small, consume or
+reassignment gets a local slot, and a slot which has not been written
+yet holds UNSET and reads fall back to the global slot of the same
+name, just as RefEnv looks names up.
+
+Calls push a frame onto the VM's own call stack instead of recursing
+in Python. A function's value is the value of a return statement
+which ran, or else the last value of one of its top level call
+statements, which the frame keeps as its last value. A call in tail
+position replaces the caller's frame instead, and the frame remembers
+what the caller's value would have been should the callee have none.
+A call to a function memoized with --memo which is not in tail
+position pushes a frame which keeps where its value goes once it
+returns.
+"""
+import sys
+import operator
+from Lexer import Token
+from Parser import ParseType, LazyBody
+from Runtime import read_value, new_array, is_zero, find_builtin, Builtin
+from Runtime import write_item, end_line
+from Resolver import Scope, GlobalTable, UNSET, UNDEFINED, tail_calls
+from Memo import MISS, memo_key
+
+# opcodes, numbered in this order
+OPNAMES = ('CONST', 'LOAD_LOCAL', 'LOAD_GLOBAL', 'STORE_LOCAL', 'STORE_GLOBAL',
+           'CHECK_LOCAL', 'SAVE_LOCAL', 'ADD', 'SUB', 'MUL', 'DIV', 'POW',
+           'NEG', 'COMPARE', 'JUMP', 'JUMP_IF_FALSE', 'JUMP_IF_FALSE_OR_POP',
+           'JUMP_IF_TRUE_OR_POP', 'INDEX', 'STORE_INDEX', 'NEW_ARRAY', 'READ',
+           'PRINT', 'PRINT_END', 'FIND_FUNCTION', 'CALL', 'TAIL_CALL',
+           'TAIL_CALL_DROP', 'SET_LAST', 'POP', 'RETURN', 'RETURN_LAST',
+           'MISSING')
+(CONST, LOAD_LOCAL, LOAD_GLOBAL, STORE_LOCAL, STORE_GLOBAL, CHECK_LOCAL,
+ SAVE_LOCAL, ADD, SUB, MUL, DIV, POW, NEG, COMPARE, JUMP, JUMP_IF_FALSE,
+ JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, INDEX, STORE_INDEX, NEW_ARRAY, READ, PRINT, PRINT_END,
+ FIND_FUNCTION, CALL, TAIL_CALL, TAIL_CALL_DROP, SET_LAST, POP, RETURN,
+ RETURN_LAST, MISSING) = range(len(OPNAMES))
+
+COMPARISONS = (('is', operator.eq), ('not', operator.ne), ('eats', operator.lt),
+               ('eats_more', operator.le), ('spits', operator.gt),
+               ('spits_more', operator.ge))
+COMPARE_OPS = tuple(c[1] for c in COMPARISONS)
+COMPARE_IDS = {c[0]: i for i, c in enumerate(COMPARISONS)}
+
+ARITHMETIC = {
+  ParseType.ADD: ADD,
+  ParseType.SUB: SUB,
+  ParseType.MUL: MUL,
+  ParseType.DIV: DIV,
+  ParseType.POW: POW
+}
+
+# the deepest the call stack may grow
+MAX_CALL_DEPTH = 100000
+
+
+class Code:
+  """
+    The bytecode of one function. Its locals are the slots of scope
+    and its global names those of table.
+    """
+
+  def __init__(self, name, scope, table):
+    self.name = name
+    self.code = []
+    self.lines = []
+    self.consts = []
+    self.locals = scope.names
+    self.names = table.names
+    self.calls = []
+    self.__const_ids = {}
+    self.__scope = scope
+    self.__table = table
+
+  def emit(self, op, arg=0, line=0):
+    """
+      Append an instruction and return its position.
+      """
+    self.code.append(op)
+    self.code.append(arg)
+    self.lines.append(line)
+    self.lines.append(line)
+    return len(self.code) - 2
+
+  def patch(self, pos, target=None):
+    """
+      Point the jump at pos to target, by default the next
+      instruction.
+      """
+    self.code[pos + 1] = len(self.code) if target is None else target
+
+  def const(self, value):
+    key = (type(value), value)
+    if key not in self.__const_ids:
+      self.__const_ids[key] = len(self.consts)
+      self.consts.append(value)
+    return self.__const_ids[key]
+
+  def local(self, name):
+    return self.__scope.slot(name)
+
+  def has_local(self, name):
+    return self.__scope.has(name)
+
+  def glob(self, name):
+    return self.__table.slot(name)
+
+
+class Function:
+  """
+    A function of the program, compiled on its first call.
+    """
+
+  def __init__(self, node):
+    self.node = node
+    self.name = node.token.lexeme
+    params = node.children[0]
+    self.params = None
+    if params is not None:
+      self.params = [p.token.lexeme for p in params.children]
+    self.nparams = None if self.params is None else len(self.params)
+    self.code = None
+
+    # the values of a pure function, see Memo
+    self.cache = None
+
+  def compile(self, table):
+    """
+      Compile the body, parsing it first if it was parsed lazily.
+      """
+    if type(self.node.children[1]) is LazyBody:
+      self.node.children[1] = self.node.children[1].parse()
+    body = self.node.children[1]
+
+    scope = Scope(self.params, body)
+    self.param_slots = scope.param_slots
+    code = Code(self.name, scope, table)
+    Compiler(code, self.params, tail_calls(body)).function(body)
+    self.code = code
+    return code
+
+
+class Compiler:
+  """
+    Emits the bytecode for the body of one function.
+    """
+
+  def __init__(self, code, params=None, tails=None):
+    self.code = code
+
+    # the calls in tail position, see Resolver.tail_calls
+    self.tails = tails or {}
+
+    # names which are surely bound in the call by the time the
+    # current statement runs: the parameters, and whatever the top
+    # level statements before it bound
+    self.bound = set(params or ())
+
+  def function(self, body):
+    for c in body.children:
+      self.statement(c, True)
+      if c.node_type in (ParseType.REASSIGN, ParseType.READ) \
+         and c.children[0].node_type == ParseType.ATOMIC:
+        self.bound.add(c.children[0].token.lexeme)
+      elif c.node_type in (ParseType.CREATEVAR, ParseType.CREATEARRAY) \
+         and c.token.lexeme == "small":
+        self.bound.add(c.children[0].token.lexeme)
+    self.code.emit(RETURN_LAST)
+
+  def body(self, t):
+    for c in t.children:
+      self.statement(c, False)
+
+  def statement(self, t, top):
+    """
+      Emit a statement. Call values at the top level of the function
+      are kept as its last value, elsewhere they are dropped.
+      """
+    code = self.code
+    nt = t.node_type
+    line = t.token.line if t.token is not None else 0
+    if nt == ParseType.CREATEVAR or nt == ParseType.CREATEARRAY:
+      name = t.children[0].token.lexeme
+      if nt == ParseType.CREATEARRAY:
+        self.expr(t.children[1])
+        code.emit(NEW_ARRAY, 0, line)
+      elif t.children[1] is not None:
+        self.expr(t.children[1])
+      else:
+        code.emit(CONST, code.const(None), line)
+      if t.token.lexeme == "big":
+        code.emit(STORE_GLOBAL, code.glob(name), line)
+      else:
+        code.emit(STORE_LOCAL, code.local(name), line)
+    elif nt == ParseType.REASSIGN:
+      target = t.children[0]
+      if target.node_type == ParseType.INDEX:
+        self.expr(target.children[0])
+        self.expr(t.children[1])
+        self.expr(target.children[1])
+        code.emit(STORE_INDEX, 0, line)
+      else:
+        # the name must already be bound, the new value is always local
+        slot = code.local(target.token.lexeme)
+        if target.token.lexeme not in self.bound:
+          code.emit(CHECK_LOCAL, slot, target.token.line)
+        self.expr(t.children[1])
+        code.emit(STORE_LOCAL, slot, line)
+    elif nt == ParseType.READ:
+      target = t.children[0]
+      if target.node_type == ParseType.INDEX:
+        self.expr(target.children[0])
+        code.emit(READ, 0, line)
+        self.expr(target.children[1])
+        code.emit(STORE_INDEX, 0, line)
+      else:
+        code.emit(READ, 0, line)
+        code.emit(STORE_LOCAL, code.local(target.token.lexeme), line)
+    elif nt == ParseType.WRITE:
+      for c in t.children[0].children:
+        self.expr(c)
+        code.emit(PRINT, 0, line)
+      code.emit(PRINT_END, 0, line)
+    elif nt == ParseType.PATH:
+      self.expr(t.children[0])
+      skip = code.emit(JUMP_IF_FALSE, 0, line)
+      self.body(t.children[1])
+      if t.children[2] is not None:
+        done = code.emit(JUMP, 0, line)
+        code.patch(skip)
+        self.body(t.children[2])
+        code.patch(done)
+      else:
+        code.patch(skip)
+    elif nt == ParseType.LOOP:
+      top = len(code.code)
+      self.expr(t.children[0])
+      done = code.emit(JUMP_IF_FALSE, 0, line)
+      self.body(t.children[1])
+      code.emit(JUMP, top, line)
+      code.patch(done)
+    elif nt == ParseType.CALL:
+      self.expr(t)
+      code.emit(SET_LAST if top else POP, 0, line)
+    elif nt == ParseType.RETURN:
+      self.expr(t.children[0])
+      code.emit(RETURN, 0, line)
+
+  def expr(self, t):
+    code = self.code
+    if t is None:
+      code.emit(MISSING)
+      return
+    nt = t.node_type
+    if nt == ParseType.ATOMIC:
+      tok = t.token
+      if tok.token in (Token.NUMBER, Token.STRING):
+        code.emit(CONST, code.const(tok.value), tok.line)
+      elif code.has_local(tok.lexeme):
+        code.emit(LOAD_LOCAL, code.local(tok.lexeme), tok.line)
+      else:
+        code.emit(LOAD_GLOBAL, code.glob(tok.lexeme), tok.line)
+    elif nt in ARITHMETIC:
+      self.expr(t.children[0])
+      self.expr(t.children[1])
+      code.emit(ARITHMETIC[nt], 0, t.token.line)
+    elif nt == ParseType.NEGATION:
+      self.expr(t.children[0])
+      code.emit(NEG, 0, t.token.line)
+    elif nt == ParseType.INDEX:
+      self.expr(t.children[0])
+      self.expr(t.children[1])
+      code.emit(INDEX, 0, t.token.line)
+    elif nt == ParseType.COMPARABLE:
+      self.expr(t.children[0])
+      self.expr(t.children[1])
+      code.emit(COMPARE, COMPARE_IDS[t.token.lexeme], t.token.line)
+    elif nt == ParseType.CONDITION:
+      self.expr(t.children[0])
+      if t.token.lexeme == "also":
+        skip = code.emit(JUMP_IF_FALSE_OR_POP, 0, t.token.line)
+      else:
+        skip = code.emit(JUMP_IF_TRUE_OR_POP, 0, t.token.line)
+      self.expr(t.children[1])
+      code.patch(skip)
+    elif nt == ParseType.CALL:
+      name = t.token.lexeme
+      args = t.children[0].children if t.children[0] is not None else None
+      slot = code.local(name) if code.has_local(name) else -1
+      call = len(code.calls)
+      code.calls.append((name, None if args is None else len(args), slot,
+                         code.glob(name)))
+      code.emit(FIND_FUNCTION, call, t.token.line)
+      for c in args or ():
+        self.expr(c)
+      if t not in self.tails:
+        code.emit(CALL, call, t.token.line)
+      elif self.tails[t]:
+        code.emit(TAIL_CALL, call, t.token.line)
+      else:
+        code.emit(TAIL_CALL_DROP, call, t.token.line)
+    elif nt == ParseType.SAVE:
+      self.expr(t.children[0])
+      code.emit(SAVE_LOCAL, code.local(t.token.lexeme), t.token.line)
+    elif nt == ParseType.LOAD:
+      # always saved before it is loaded
+      code.emit(LOAD_LOCAL, code.local(t.token.lexeme), t.token.line)
+
+
+def disassemble(code, out=sys.stdout):
+  """
+    Print a readable listing of the bytecode in code.
+    """
+  print(f"function {code.name}", file=out)
+  for pc in range(0, len(code.code), 2):
+    op = code.code[pc]
+    arg = code.code[pc + 1]
+    note = ''
+    if op == CONST:
+      note = repr(code.consts[arg])
+    elif op in (LOAD_LOCAL, STORE_LOCAL, CHECK_LOCAL, SAVE_LOCAL):
+      note = code.locals[arg]
+    elif op in (LOAD_GLOBAL, STORE_GLOBAL):
+      note = code.names[arg]
+    elif op == COMPARE:
+      note = COMPARISONS[arg][0]
+    elif op in (JUMP, JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP):
+      note = f'to {arg}'
+    elif op in (FIND_FUNCTION, CALL, TAIL_CALL, TAIL_CALL_DROP):
+      name, nargs = code.calls[arg][:2]
+      note = f'{name}, {nargs or 0} args'
+    print(f"{code.lines[pc]:5} {pc:6}  {OPNAMES[op]:<22}{arg:<6}{note}".rstrip(),
+          file=out)
+  print(file=out)
+
+
+def find_global(values, slot, name, line):
+  """
+    Read a global variable, reporting the errors eval_atomic does.
+    """
+  v = values[slot]
+  if v is UNDEFINED:
+    print(f"Undefined variable {name} on line {line}")
+    sys.exit(-1)
+  elif type(v) is Function:
+    print(f"{name} on line {line} is not a variable.")
+    sys.exit(-1)
+  return v
+
+
+class VM:
+  """
+    Runs the bytecode of a program.
+    """
+
+  def __init__(self, program, memo=None):
+    self.table = GlobalTable()
+    for c in program.children:
+      self.table[c.token.lexeme] = Function(c)
+    if memo is not None:
+      for name, cache in memo.caches.items():
+        self.table.get(name).cache = cache
+    self.main = Function(program.children[0])
+
+  def run(self):
+    """
+      Run the program from its first function and return that
+      function's value.
+      """
+    table = self.table
+    glob = table.values
+    fun = self.main
+    code = fun.code or fun.compile(table)
+    ops, consts = code.code, code.consts
+    local = [UNSET] * len(code.locals)
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    frames = []
+    last = None
+    pc = 0
+
+    # the value the frame's tail calls leave if the last callee has
+    # none, and whether it is the value whatever the callee returns
+    default = None
+    fixed = False
+
+    # the cache and key the frame's value is kept under, if any
+    memo = None
+
+    while True:
+      op = ops[pc]
+      arg = ops[pc + 1]
+      pc += 2
+
+      if op == LOAD_LOCAL:
+        v = local[arg]
+        if v is UNSET:
+          name = code.locals[arg]
+          v = find_global(glob, table.slot(name), name, code.lines[pc - 2])
+        push(v)
+      elif op == CONST:
+        push(consts[arg])
+      elif op == STORE_LOCAL:
+        local[arg] = pop()
+      elif op == LOAD_GLOBAL:
+        v = glob[arg]
+        if v is UNDEFINED or type(v) is Function:
+          v = find_global(glob, arg, code.names[arg], code.lines[pc - 2])
+        push(v)
+      elif op == COMPARE:
+        right = pop()
+        stack[-1] = COMPARE_OPS[arg](stack[-1], right)
+      elif op == JUMP_IF_FALSE:
+        if not pop():
+          pc = arg
+      elif op == JUMP:
+        pc = arg
+      elif op == ADD:
+        right = pop()
+        stack[-1] = stack[-1] + right
+      elif op == SUB:
+        right = pop()
+        stack[-1] = stack[-1] - right
+      elif op == MUL:
+        right = pop()
+        stack[-1] = stack[-1] * right
+      elif op == DIV:
+        right = pop()
+        if is_zero(right):
+          print(f"Division by 0 on line {code.lines[pc - 2]}")
+          sys.exit(-1)
+        stack[-1] = stack[-1] / right
+      elif op == POW:
+        right = pop()
+        stack[-1] = stack[-1]**right
+      elif op == NEG:
+        stack[-1] = -stack[-1]
+      elif op == INDEX:
+        idx = pop()
+        stack[-1] = stack[-1][idx]
+      elif op == STORE_INDEX:
+        idx = pop()
+        value = pop()
+        pop()[idx] = value
+      elif op == CHECK_LOCAL:
+        if local[arg] is UNSET:
+          name = code.locals[arg]
+          find_global(glob, table.slot(name), name, code.lines[pc - 2])
+      elif op == JUMP_IF_FALSE_OR_POP:
+        if not stack[-1]:
+          pc = arg
+        else:
+          pop()
+      elif op == JUMP_IF_TRUE_OR_POP:
+        if stack[-1]:
+          pc = arg
+        else:
+          pop()
+      elif op == SAVE_LOCAL:
+        local[arg] = stack[-1]
+      elif op == STORE_GLOBAL:
+        glob[arg] = pop()
+      elif op == FIND_FUNCTION:
+        name, nargs, slot, g = code.calls[arg]
+        line = code.lines[pc - 2]
+
+        # retrieve the function, locals are never functions
+        if slot >= 0 and local[slot] is not UNSET:
+          callee = local[slot]
+        else:
+          callee = glob[g]
+        if callee is UNDEFINED:
+          callee = find_builtin(name, nargs, line)
+        elif type(callee) is not Function:
+          print(f"Call to non-function {name} on line {line}")
+          sys.exit(-1)
+        elif callee.nparams != nargs:
+          print(f"Wrong number of parameters to function {name} on line {line}")
+          sys.exit(-1)
+        push(callee)
+      elif op == CALL or op == TAIL_CALL or op == TAIL_CALL_DROP:
+        nargs = code.calls[arg][1] or 0
+        if nargs:
+          args = stack[-nargs:]
+          del stack[-nargs:]
+        callee = pop()
+        if type(callee) is Builtin:
+          push(callee.call(args if nargs else [], code.lines[pc - 2]))
+          continue
+        key = None
+        if callee.cache is not None:
+          key = memo_key(args if nargs else ())
+          if key is not None:
+            v = callee.cache.get(key)
+            if v is not MISS:
+              push(v)
+              continue
+            # the value of a call in tail position is not kept
+            if op != CALL:
+              key = None
+        if op == CALL:
+          if len(frames) >= MAX_CALL_DEPTH:
+            raise RecursionError("maximum recursion depth exceeded")
+          frames.append((code, pc, local, last, default, fixed, memo))
+          default = None
+          fixed = False
+          memo = (callee.cache, key) if key is not None else None
+        elif not fixed:
+          # a callee without a value leaves the innermost caller's value
+          if last is not None:
+            default = last
+          fixed = op == TAIL_CALL_DROP
+
+        # all parameters are local (by design)
+        code = callee.code or callee.compile(table)
+        ops, consts = code.code, code.consts
+        local = [UNSET] * len(code.locals)
+        if nargs:
+          for slot, value in zip(callee.param_slots, args):
+            local[slot] = value
+        last = None
+        pc = 0
+      elif op == SET_LAST:
+        v = pop()
+        if v is not None:
+          last = v
+      elif op == POP:
+        pop()
+      elif op == RETURN or op == RETURN_LAST:
+        v = pop() if op == RETURN else last
+        if v is None and op == RETURN:
+          continue
+        if fixed or v is None:
+          v = default
+        if memo is not None:
+          memo[0].put(memo[1], v)
+        if not frames:
+          return v
+        code, pc, local, last, default, fixed, memo = frames.pop()
+        ops, consts = code.code, code.consts
+        push(v)
+      elif op == READ:
+        push(read_value())
+      elif op == PRINT:
+        write_item(pop())
+      elif op == PRINT_END:
+        end_line()
+      elif op == NEW_ARRAY:
+        stack[-1] = new_array(stack[-1])
+      elif op == MISSING:
+        # a node the parser left out
+        None.node_type
+
+
+def compile_program(program):
+  """
+    Compile every function of the program and return their code.
+    """
+  table = GlobalTable()
+  return [Function(c).compile(table) for c in program.children]
+
+
+def run_program(program, memo=None):
+  """
+    Run the program on the virtual machine, memoizing the pure
+    functions in memo if it is given.
+    """
+  return VM(program, memo).run()
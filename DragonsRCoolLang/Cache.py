@@ -0,0 +1,221 @@
+"""
+An on-disk cache of parsed DragonsRCool programs.
+
+Parse trees are flattened into nested tuples of plain values and
+written with marshal, which loads several times faster than pickling
+the node objects. They go into a cache directory, by default
+__dragoncache__ next to the program. Each entry is named by a hash of
+the source text, the front end options and the interpreter version, so
+an edited program or a newer interpreter simply misses the cache.
+Entries carry a checksum of their contents, and one that does not
+check out or fails to load is deleted and treated as a miss. Every hit
+refreshes the entry's modification time, and the oldest entries are
+evicted once the directory grows past its size limit.
+"""
+import os
+import sys
+import marshal
+import hashlib
+import tempfile
+from Lexer import Token, TokenDetail, BufferedLexer, TableLexer
+from Parser import ParseTree, ParseType, CompactNode, CompactLeaf, LazyBody
+from Parser import Parser, IterativeParser
+
+# bump this whenever the shape of the parse tree changes
+CACHE_VERSION = 2
+
+MAGIC = b'DRC\x01'
+DIGEST_SIZE = 32
+SUFFIX = '.drcc'
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+FRONT_END = ('Lexer.py', 'Parser.py')
+
+NODE_CLASSES = (ParseTree, CompactNode, CompactLeaf)
+NODE_CLASS_IDS = {cls: i for i, cls in enumerate(NODE_CLASSES)}
+LAZY_ID = len(NODE_CLASSES)
+PARSER_CLASSES = (Parser, IterativeParser)
+LEXER_CLASSES = (None, BufferedLexer, TableLexer)
+PARSE_TYPES = {t.value: t for t in ParseType}
+TOKENS = {t.value: t for t in Token}
+
+
+def interpreter_version():
+  """
+    A string which changes whenever the front end could build a
+    different tree: the cache format, the Python version and the
+    contents of the lexer and parser.
+    """
+  h = hashlib.sha256(f'{CACHE_VERSION} {sys.version}'.encode())
+  here = os.path.dirname(os.path.abspath(__file__))
+  for name in FRONT_END:
+    with open(os.path.join(here, name), 'rb') as f:
+      h.update(f.read())
+  return h.hexdigest()
+
+
+def encode_token(tok):
+  return (tok.token.value, tok.lexeme, tok.value, tok.line, tok.col)
+
+
+def decode_token(e):
+  return TokenDetail(TOKENS[e[0]], e[1], e[2], e[3], e[4])
+
+
+def encode_tree(t):
+  """
+    Flatten a parse tree into nested tuples which marshal can write.
+    """
+  if t is None:
+    return None
+  if type(t) is LazyBody:
+    tokens = t.tokens
+    if tokens is not None:
+      tokens = [encode_token(tok) for tok in tokens]
+    return (LAZY_ID, PARSER_CLASSES.index(t.parser), t.compact, tokens,
+            LEXER_CLASSES.index(t.lexer), t.text, t.line, t.col)
+  tok = t.token
+  if tok is not None and not isinstance(tok, str):
+    tok = encode_token(tok)
+  return (NODE_CLASS_IDS[type(t)], t.node_type.value, tok,
+          [encode_tree(c) for c in t.children])
+
+
+def decode_tree(e):
+  """
+    Rebuild a parse tree from the output of encode_tree.
+    """
+  if e is None:
+    return None
+  if e[0] == LAZY_ID:
+    tokens = e[3]
+    if tokens is not None:
+      tokens = [decode_token(tok) for tok in tokens]
+    return LazyBody(PARSER_CLASSES[e[1]], e[2], tokens, LEXER_CLASSES[e[4]],
+                    e[5], e[6], e[7])
+  node = NODE_CLASSES[e[0]](PARSE_TYPES[e[1]], None)
+  tok = e[2]
+  if type(tok) is tuple:
+    tok = decode_token(tok)
+  node.token = tok
+  if e[3]:
+    node.children = [decode_tree(c) for c in e[3]]
+  return node
+
+
+def default_cache_dir(path):
+  """
+    The cache directory used for the program at path.
+    """
+  return os.path.join(os.path.dirname(os.path.abspath(path)),
+                      '__dragoncache__')
+
+
+class ProgramCache:
+  """
+    A directory of cached parse trees with LRU eviction.
+    """
+
+  def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.version = interpreter_version()
+
+  def key(self, src, options=''):
+    """
+      Return the cache key for a source text and front end options.
+      """
+    h = hashlib.sha256(self.version.encode())
+    h.update(options.encode())
+    h.update(b'\0')
+    h.update(src.encode('utf-8', 'surrogatepass'))
+    return h.hexdigest()
+
+  def __path(self, key):
+    return os.path.join(self.directory, key + SUFFIX)
+
+  def load(self, key):
+    """
+      Return the tree stored under key, or None if there is no usable
+      entry.
+      """
+    path = self.__path(key)
+    try:
+      with open(path, 'rb') as f:
+        data = f.read()
+    except OSError:
+      return None
+
+    header = len(MAGIC) + DIGEST_SIZE
+    payload = data[header:]
+    if data[:len(MAGIC)] != MAGIC \
+       or data[len(MAGIC):header] != hashlib.sha256(payload).digest():
+      self.__discard(path)
+      return None
+    try:
+      stored_key, tree = marshal.loads(payload)
+      tree = decode_tree(tree)
+    except Exception:
+      self.__discard(path)
+      return None
+    if stored_key != key:
+      self.__discard(path)
+      return None
+
+    # mark the entry as recently used
+    try:
+      os.utime(path)
+    except OSError:
+      pass
+    return tree
+
+  def store(self, key, tree):
+    """
+      Save tree under key, then evict old entries if the cache is over
+      its size limit. Failures to write are ignored.
+      """
+    try:
+      payload = marshal.dumps((key, encode_tree(tree)))
+    except (RecursionError, ValueError):
+      # trees too deep to write out are simply not cached
+      return
+
+    try:
+      os.makedirs(self.directory, exist_ok=True)
+      fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+      with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC)
+        f.write(hashlib.sha256(payload).digest())
+        f.write(payload)
+      os.replace(tmp, self.__path(key))
+    except OSError:
+      return
+    self.evict()
+
+  def evict(self):
+    """
+      Remove the least recently used entries until the cache fits in
+      max_bytes.
+      """
+    entries = []
+    try:
+      with os.scandir(self.directory) as it:
+        for entry in it:
+          if entry.name.endswith(SUFFIX):
+            info = entry.stat()
+            entries.append((info.st_mtime, info.st_size, entry.path))
+    except OSError:
+      return
+
+    total = sum(e[1] for e in entries)
+    entries.sort()
+    for _, size, path in entries:
+      if total <= self.max_bytes:
+        break
+      self.__discard(path)
+      total -= size
+
+  def __discard(self, path):
+    try:
+      os.remove(path)
+    except OSError:
+      pass
@@ -0,0 +1,664 @@
+"""
+A closure compiling engine for DragonsRCool.
+
+Rather than walking the parse tree on every step, each node is turned
+into a Python closure once. The node's operator, scope and children
+are looked at while compiling and bound into the closure, so running
+the program is only a matter of calling the closure for the first
+function. Functions are compiled the first time they are called.
+
+Variables are resolved to slots: each call has a list holding its
+frame slots followed by the value of a return statement once one has
+run, and the GlobalTable holds the functions and every big variable.
+A frame slot which is still UNSET falls back to the global slot of
+the same name, just as RefEnv chains the call's names onto the
+globals.
+
+A call in tail position builds the callee's frame and hands both back
+as a TailCall instead of running it, so the nearest call which is not
+in tail position runs a chain of them in a loop.
+
+A function memoized with --memo holds its cache. A call to it in tail
+position only looks its value up, and otherwise runs as any other.
+With --profile the closures of function bodies and statements are
+wrapped to report to the profiler when they are compiled. Swarm loops
+run over the process pool of the Swarm they are given, see Swarm.
+"""
+import sys
+import operator
+from Lexer import Token
+from Parser import ParseType, LazyBody
+from Runtime import read_value, new_array, is_zero, find_builtin
+from Runtime import write_item, end_line
+from Runtime import TailCall, tail_value
+from Resolver import Scope, GlobalTable, UNSET, UNDEFINED, tail_calls
+from Memo import MISS, memo_key
+
+COMPARISONS = {
+  'is': operator.eq,
+  'not': operator.ne,
+  'eats': operator.lt,
+  'eats_more': operator.le,
+  'spits': operator.gt,
+  'spits_more': operator.ge
+}
+
+ARITHMETIC = {
+  ParseType.ADD: operator.add,
+  ParseType.SUB: operator.sub,
+  ParseType.MUL: operator.mul,
+  ParseType.POW: operator.pow
+}
+
+
+class Function:
+  """
+    A function of the program, compiled on its first call.
+    """
+
+  def __init__(self, node):
+    self.node = node
+    self.name = node.token.lexeme
+    params = node.children[0]
+    self.params = None
+    if params is not None:
+      self.params = [p.token.lexeme for p in params.children]
+    self.nparams = None if self.params is None else len(self.params)
+    self.code = None
+
+    # the values of a pure function, see Memo
+    self.cache = None
+    self.profiler = None
+    self.swarm = None
+
+  def compile(self, table):
+    """
+      Compile the body, parsing it first if it was parsed lazily.
+      """
+    if type(self.node.children[1]) is LazyBody:
+      self.node.children[1] = self.node.children[1].parse()
+    body = self.node.children[1]
+    scope = Scope(self.params, body)
+    self.param_slots = scope.param_slots
+
+    # the frame slots, then the return value
+    self.frame = scope.new_frame() + [None]
+    self.code = Compiler(table, scope, self.params, tail_calls(body),
+                         self.profiler, self.swarm).compile(body)
+    if self.profiler is not None:
+      self.code = self.profiler.function(self.name, self.code)
+    return self.code
+
+  def call_memoized(self, argv, table, keep=None):
+    """
+      Call the function with the arguments argv, or return the value
+      its cache keeps for them. A call in tail position, whose keep
+      is not None, is handed back as a TailCall and not kept.
+      """
+    key = memo_key(argv)
+    if key is not None:
+      v = self.cache.get(key)
+      if v is not MISS:
+        return v
+    code = self.code or self.compile(table)
+    local = self.frame[:]
+    for slot, v in zip(self.param_slots, argv):
+      local[slot] = v
+    if keep is not None:
+      return TailCall(code, local, keep)
+    result = code(local)
+    if type(result) is TailCall:
+      result = tail_value(result, run_tail_call)
+    if key is not None:
+      self.cache.put(key, result)
+    return result
+
+
+def run_tail_call(c):
+  return c.fun(c.frame)
+
+
+def has_return(t):
+  """
+    Return true if a return statement appears anywhere in t.
+    """
+  if t is None or isinstance(t, str):
+    return False
+  if t.node_type == ParseType.RETURN:
+    return True
+  return any(has_return(c) for c in t.children)
+
+
+class Compiler:
+  """
+    Turns the parse tree nodes of one function into closures. Each
+    closure takes the list of the current call's slots and returns
+    the node's value.
+    """
+
+  def __init__(self, table, scope, params=None, tails=None, profiler=None,
+               swarm=None):
+    self.table = table
+    self.scope = scope
+    self.ret_slot = len(scope.names)
+    self.profiler = profiler
+    self.swarm = swarm
+
+    # the calls in tail position, see Resolver.tail_calls
+    self.tails = tails or {}
+
+    # the locals which are surely written by the time the code being
+    # compiled runs, whose reads need no check
+    self.bound = set(params or ())
+
+    # a method for every node type
+    self.rules = {
+      ParseType.BODY: self.body,
+      ParseType.ATOMIC: self.atomic,
+      ParseType.INDEX: self.index,
+      ParseType.READ: self.read,
+      ParseType.WRITE: self.write,
+      ParseType.CREATEVAR: self.create_var,
+      ParseType.CREATEARRAY: self.create_array,
+      ParseType.REASSIGN: self.reassign,
+      ParseType.ADD: self.arithmetic,
+      ParseType.SUB: self.arithmetic,
+      ParseType.MUL: self.arithmetic,
+      ParseType.POW: self.arithmetic,
+      ParseType.DIV: self.div,
+      ParseType.NEGATION: self.negation,
+      ParseType.PATH: self.path,
+      ParseType.LOOP: self.loop,
+      ParseType.CONDITION: self.condition,
+      ParseType.COMPARABLE: self.comparable,
+      ParseType.CALL: self.call,
+      ParseType.RETURN: self.ret,
+      ParseType.SAVE: self.save,
+      ParseType.LOAD: self.load
+    }
+
+  def compile(self, t):
+    """
+      Return the closure for the node t.
+      """
+    if t is None:
+      return self.missing(t)
+    return self.rules[t.node_type](t)
+
+  def missing(self, t):
+    """
+      A node the parser left out, which fails if it is ever run.
+      """
+    def missing(f):
+      return t.node_type
+    return missing
+
+  def nested(self, t):
+    """
+      Compile a body which may not run, whose writes leave the
+      locals bound afterwards as they were.
+      """
+    bound = set(self.bound)
+    code = self.compile(t)
+    self.bound = bound
+    return code
+
+  def statement(self, t):
+    """
+      Return the closure for the statement t, which reports to the
+      profiler if there is one.
+      """
+    code = self.compile(t)
+    if self.profiler is None or t is None:
+      return code
+    return self.profiler.statement(t.token.line if t.token is not None else 0,
+                                   code)
+
+  def body(self, t):
+    stmts = [self.statement(c) for c in t.children]
+    if not has_return(t):
+      def body(f):
+        result = None
+        for s in stmts:
+          r = s(f)
+          if r is not None:
+            # a call in tail position falls back on the value so far
+            if type(r) is TailCall:
+              r.default = result
+              return r
+            result = r
+        return result
+      return body
+
+    ret = self.ret_slot
+    def body(f):
+      result = None
+      for s in stmts:
+        r = s(f)
+        if r is not None:
+          if type(r) is TailCall:
+            r.default = result
+            return r
+          result = r
+        # check to see if we have returned
+        if f[ret] is not None:
+          return f[ret]
+      return result
+    return body
+
+  def atomic(self, t):
+    # literals
+    if t.token.token in (Token.NUMBER, Token.STRING):
+      value = t.token.value
+      def constant(f):
+        return value
+      return constant
+
+    # variables, local first and then global
+    name = t.token.lexeme
+    line = t.token.line
+    values = self.table.values
+    g = self.table.slot(name)
+    def global_variable(f):
+      v = values[g]
+      if v is UNDEFINED:
+        print(f"Undefined variable {name} on line {line}")
+        sys.exit(-1)
+      elif type(v) is Function:
+        print(f"{name} on line {line} is not a variable.")
+        sys.exit(-1)
+      return v
+    if not self.scope.has(name):
+      return global_variable
+
+    k = self.scope.slot(name)
+    if name in self.bound:
+      def bound_variable(f):
+        return f[k]
+      return bound_variable
+
+    def variable(f):
+      v = f[k]
+      if v is UNSET:
+        return global_variable(f)
+      return v
+    return variable
+
+  def index(self, t):
+    array = self.compile(t.children[0])
+    idx = self.compile(t.children[1])
+    def index(f):
+      l = array(f)
+      return l[idx(f)]
+    return index
+
+  def read(self, t):
+    target = t.children[0]
+    if target.node_type == ParseType.INDEX:
+      array = self.compile(target.children[0])
+      idx = self.compile(target.children[1])
+      def read_index(f):
+        l = array(f)
+        value = read_value()
+        l[idx(f)] = value
+      return read_index
+
+    k = self.scope.slot(target.token.lexeme)
+    self.bound.add(target.token.lexeme)
+    def read(f):
+      f[k] = read_value()
+    return read
+
+  def write(self, t):
+    items = [self.compile(c) for c in t.children[0].children]
+    def write(f):
+      for item in items:
+        write_item(item(f))
+      end_line()
+    return write
+
+  def create_var(self, t):
+    name = t.children[0].token.lexeme
+    value = None
+    if t.children[1] is not None:
+      value = self.compile(t.children[1])
+    if t.token.lexeme == "big":
+      values = self.table.values
+      k = self.table.slot(name)
+    else:
+      values = None
+      k = self.scope.slot(name)
+      self.bound.add(name)
+
+    if value is None:
+      if values is not None:
+        def create_big(f):
+          values[k] = None
+        return create_big
+      def create_small(f):
+        f[k] = None
+      return create_small
+
+    if values is not None:
+      def assign_big(f):
+        values[k] = value(f)
+      return assign_big
+    def assign_small(f):
+      f[k] = value(f)
+    return assign_small
+
+  def create_array(self, t):
+    name = t.children[0].token.lexeme
+    size = self.compile(t.children[1])
+    if t.token.lexeme == "big":
+      values = self.table.values
+      k = self.table.slot(name)
+      def create_big(f):
+        values[k] = new_array(size(f))
+      return create_big
+
+    k = self.scope.slot(name)
+    self.bound.add(name)
+    def create_small(f):
+      f[k] = new_array(size(f))
+    return create_small
+
+  def reassign(self, t):
+    target = t.children[0]
+    value = self.compile(t.children[1])
+    if target.node_type == ParseType.INDEX:
+      array = self.compile(target.children[0])
+      idx = self.compile(target.children[1])
+      def assign_index(f):
+        l = array(f)
+        val = value(f)
+        l[idx(f)] = val
+      return assign_index
+
+    # the name must already be bound, the new value is always local
+    name = target.token.lexeme
+    k = self.scope.slot(name)
+    if name in self.bound:
+      def assign_bound(f):
+        f[k] = value(f)
+      return assign_bound
+
+    check = self.compile(target)
+    self.bound.add(name)
+    def assign(f):
+      if f[k] is UNSET:
+        check(f)
+      f[k] = value(f)
+    return assign
+
+  def arithmetic(self, t):
+    op = ARITHMETIC[t.node_type]
+    left = self.compile(t.children[0])
+    right = t.children[1]
+    if right.node_type == ParseType.ATOMIC and right.token.token == Token.NUMBER:
+      value = right.token.value
+      def arithmetic_constant(f):
+        return op(left(f), value)
+      return arithmetic_constant
+
+    right = self.compile(right)
+    def arithmetic(f):
+      return op(left(f), right(f))
+    return arithmetic
+
+  def div(self, t):
+    left = self.compile(t.children[0])
+    right = self.compile(t.children[1])
+    line = t.token.line
+    def div(f):
+      l = left(f)
+      r = right(f)
+      if is_zero(r):
+        print(f"Division by 0 on line {line}")
+        sys.exit(-1)
+      return l / r
+    return div
+
+  def negation(self, t):
+    operand = self.compile(t.children[0])
+    def negation(f):
+      return -operand(f)
+    return negation
+
+  def ends_in_tail_call(self, t):
+    """
+      Whether running the body t may hand back a call in tail position.
+      """
+    if t is None or not t.children:
+      return False
+    last = t.children[-1]
+    if last.node_type == ParseType.RETURN:
+      return last.children[0] in self.tails
+    elif last.node_type == ParseType.PATH:
+      return any(self.ends_in_tail_call(c) for c in last.children[1:])
+    return last in self.tails
+
+  def path(self, t):
+    cond = self.compile(t.children[0])
+    then = self.nested(t.children[1])
+    if any(self.ends_in_tail_call(c) for c in t.children[1:]):
+      otherwise = None
+      if t.children[2] is not None:
+        otherwise = self.nested(t.children[2])
+      def path_tail(f):
+        # pass on a call in tail position, other values are dropped
+        if cond(f):
+          r = then(f)
+        elif otherwise is not None:
+          r = otherwise(f)
+        else:
+          return None
+        if type(r) is TailCall:
+          return r
+      return path_tail
+
+    if t.children[2] is None:
+      def path(f):
+        if cond(f):
+          then(f)
+      return path
+
+    otherwise = self.nested(t.children[2])
+    def path_else(f):
+      if cond(f):
+        then(f)
+      else:
+        otherwise(f)
+    return path_else
+
+  def loop(self, t):
+    if self.swarm is not None and t.token.lexeme == "swarm":
+      return self.swarm_loop(t)
+    cond = self.compile(t.children[0])
+    body = self.nested(t.children[1])
+    if not has_return(t.children[1]):
+      def loop(f):
+        while cond(f):
+          body(f)
+      return loop
+
+    ret = self.ret_slot
+    def loop_return(f):
+      while cond(f):
+        body(f)
+        # a return ends the loop
+        if f[ret] is not None:
+          break
+    return loop_return
+
+  def swarm_loop(self, t):
+    """
+      A swarm loop, run over the process pool. The names its body reads
+      are looked up locally and then globally, and those it leaves set
+      are written to the call's slots.
+      """
+    loop = self.swarm.loop(t)
+    run = self.swarm.run
+    start = self.compile(t.children[0].children[0])
+    bound = self.compile(t.children[0].children[1])
+    values = self.table.values
+    reads = []
+    for name in loop.reads:
+      k = self.scope.slot(name) if self.scope.has(name) else None
+      reads.append((name, k, self.table.slot(name)))
+    slots = {name: self.scope.slot(name) for name in [loop.index] + loop.temps}
+
+    def swarm(f):
+      s = start(f)
+      b = bound(f)
+      given = {}
+      for name, k, g in reads:
+        v = f[k] if k is not None else UNSET
+        if v is UNSET:
+          v = values[g]
+        if v is not UNDEFINED:
+          given[name] = v
+      for name, v in run(loop, s, b, given).items():
+        f[slots[name]] = v
+    return swarm
+
+  def condition(self, t):
+    left = self.compile(t.children[0])
+    right = self.compile(t.children[1])
+    if t.token.lexeme == "also":
+      def also(f):
+        return left(f) and right(f)
+      return also
+
+    def either(f):
+      return left(f) or right(f)
+    return either
+
+  def comparable(self, t):
+    op = COMPARISONS[t.token.lexeme]
+    left = self.compile(t.children[0])
+    right = t.children[1]
+    if right.node_type == ParseType.ATOMIC and right.token.token == Token.NUMBER:
+      value = right.token.value
+      def compare_constant(f):
+        return op(left(f), value)
+      return compare_constant
+
+    right = self.compile(right)
+    def compare(f):
+      return op(left(f), right(f))
+    return compare
+
+  def call(self, t):
+    name = t.token.lexeme
+    line = t.token.line
+    table = self.table
+    values = table.values
+    g = table.slot(name)
+    k = self.scope.slot(name) if self.scope.has(name) else None
+    args = []
+    if t.children[0] is not None:
+      args = [self.compile(c) for c in t.children[0].children]
+    nargs = len(args) if t.children[0] is not None else None
+    keep = self.tails.get(t)
+
+    def call(f):
+      # retrieve the function, locals are never functions
+      if k is not None and f[k] is not UNSET:
+        fun = f[k]
+      else:
+        fun = values[g]
+      if fun is UNDEFINED:
+        builtin = find_builtin(name, nargs, line)
+        return builtin.call([a(f) for a in args], line)
+      elif type(fun) is not Function:
+        print(f"Call to non-function {name} on line {line}")
+        sys.exit(-1)
+
+      if fun.nparams != nargs:
+        print(f"Wrong number of parameters to function {name} on line {line}")
+        sys.exit(-1)
+
+      if fun.cache is not None:
+        return fun.call_memoized([a(f) for a in args], table, keep)
+
+      # all parameters are local (by design)
+      code = fun.code
+      if code is None:
+        # the arguments are evaluated before the body is compiled
+        argv = [a(f) for a in args]
+        code = fun.compile(table)
+        local = fun.frame[:]
+        for slot, v in zip(fun.param_slots, argv):
+          local[slot] = v
+      else:
+        local = fun.frame[:]
+        for slot, a in zip(fun.param_slots, args):
+          local[slot] = a(f)
+
+      # a call in tail position is run by the caller's caller
+      if keep is not None:
+        return TailCall(code, local, keep)
+      result = code(local)
+      if type(result) is TailCall:
+        result = tail_value(result, run_tail_call)
+      return result
+    return call
+
+  def ret(self, t):
+    value = self.compile(t.children[0])
+    k = self.ret_slot
+    if t.children[0] in self.tails:
+      def ret_tail(f):
+        v = value(f)
+        if type(v) is TailCall:
+          return v
+        f[k] = v
+        return v
+      return ret_tail
+
+    def ret(f):
+      f[k] = value(f)
+      return f[k]
+    return ret
+
+
+  def save(self, t):
+    value = self.compile(t.children[0])
+    k = self.scope.slot(t.token.lexeme)
+    def save(f):
+      v = f[k] = value(f)
+      return v
+    return save
+
+  def load(self, t):
+    k = self.scope.slot(t.token.lexeme)
+    def load(f):
+      return f[k]
+    return load
+
+
+def run_program(t, memo=None, profiler=None, swarm=None):
+  """
+    Run the program t, starting with its first function, memoizing
+    the pure functions in memo, reporting to profiler and running
+    swarm loops over the process pool of swarm if they are given.
+    """
+  table = GlobalTable()
+  for c in t.children:
+    fun = Function(c)
+    fun.profiler = profiler
+    fun.swarm = swarm
+    table[c.token.lexeme] = fun
+  if memo is not None:
+    for name, cache in memo.caches.items():
+      table.get(name).cache = cache
+
+  main = Function(t.children[0])
+  main.profiler = profiler
+  main.swarm = swarm
+  code = main.compile(table)
+  result = code(main.frame[:])
+  if type(result) is TailCall:
+    result = tail_value(result, run_tail_call)
+  return result
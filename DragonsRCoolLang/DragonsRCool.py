@@ -18,12 +18,38 @@ Errors
     - identify context sensitive errors
     - Variables must be assigned before they are read.
 """
-from Parser import Parser, ParseType
-from Lexer import Token, Lexer
+from Parser import Parser, IterativeParser, ParseType, LazyBody
+from Lexer import Token, LEXERS, read_source
+from ParallelParser import parallel_parse
+from Cache import ProgramCache, default_cache_dir
+from Runtime import read_value, new_array, is_zero, find_builtin
+from Runtime import write_item, end_line, buffer_output, OUTPUT_BLOCK
+from Runtime import TailCall, tail_value
+from Resolver import tail_calls
+from Memo import Memo, MISS, memo_key, DEFAULT_SIZE
+from Profiler import Profiler
+from Sampler import Sampler, DEFAULT_INTERVAL, DEFAULT_SIZE as SAMPLE_SIZE
+from Swarm import Swarm, has_swarm
+import Closures
+import Bytecode
+import Transpiler
+import Optimizer
+import io
 import sys
+import atexit
+import argparse
 from enum import Enum, auto
 from collections import ChainMap
-import numpy as np
+
+
+# the calls in tail position of every function body run so far
+tail_sites = {}
+
+# the caches of the pure functions, with --memo
+memo = None
+
+# the swarm loops of the program, see Swarm
+swarm = None
 
 
 class RefType(Enum):
@@ -119,6 +145,14 @@ def eval_parse_tree(t, env, glob):
     return eval_call(t, env, glob)
   elif t.node_type == ParseType.RETURN:
     return eval_return(t, env, glob)
+  elif t.node_type == ParseType.SAVE:
+    return eval_save(t, env, glob)
+  elif t.node_type == ParseType.LOAD:
+    return eval_load(t, env, glob)
+
+
+# the statements of a body run through this, see profile
+eval_statement = eval_parse_tree
 
 
 def eval_program(t, env, glob):
@@ -128,9 +162,11 @@ def eval_program(t, env, glob):
   for c in t.children:
     name = c.token.lexeme
     env.insert(name, Ref(RefType.FUNCTION, c))
+    if type(c.children[1]) is not LazyBody:
+      tail_sites.update(tail_calls(c.children[1]))
   fun_result = None
   main = RefEnv(env)
-  result = eval_parse_tree(t.children[0], main, env)
+  result = run_function(t.children[0], main, env)
 
   # remember any non-none result
   if result is not None:
@@ -148,6 +184,11 @@ def eval_function(t, env, glob):
     Evaluate the program
   """
 
+  # a lazily parsed body is parsed on the first call
+  if type(t.children[1]) is LazyBody:
+    t.children[1] = t.children[1].parse()
+    tail_sites.update(tail_calls(t.children[1]))
+
   fun_result = None
   if t.children[0] != None:
     eval_parse_tree(t.children[0], env, glob)
@@ -156,6 +197,8 @@ def eval_function(t, env, glob):
   for c in t.children:
     if flip == True:
       result = eval_parse_tree(c, env, glob)
+      if type(result) is TailCall:
+        return result
       # remember any non-none result
       if result is not None:
         fun_result = result
@@ -178,7 +221,12 @@ def eval_body(t, env, glob):
 
   fun_result = None
   for c in t.children:
-    result = eval_parse_tree(c, env, glob)
+    result = eval_statement(c, env, glob)
+
+    # a call in tail position falls back on the value so far
+    if type(result) is TailCall:
+      result.default = fun_result
+      return result
 
     # remember any non-none result
     if result is not None:
@@ -246,21 +294,13 @@ def eval_read(t, env, glob):
   #Catch to see if the item is an array
   if t.children[0].node_type == ParseType.INDEX:
     l = eval_parse_tree(t.children[0].children[0], env, glob)
-    value = input("")
+    value = read_value()
     idx = eval_parse_tree(t.children[0].children[1], env, glob)
-    try:
-      l[idx] = eval(value)
-    except:
-      l[idx] = value
+    l[idx] = value
   else:
     # get the variable we are going to write
     v = t.children[0].token.lexeme
-    value = input("")
-    try:
-        bindSmall(env, v, Ref(RefType.VARIABLE, eval(value)))
-        b = True
-    except:
-      bindSmall(env, v, Ref(RefType.VARIABLE, value))
+    bindSmall(env, v, Ref(RefType.VARIABLE, read_value()))
 
 
 def eval_write(t, env, glob):
@@ -268,8 +308,8 @@ def eval_write(t, env, glob):
   Evaluate a print statement
   """
   for c in t.children[0].children:
-    print(eval_parse_tree(c, env, glob), end=" ")
-  print("")
+    write_item(eval_parse_tree(c, env, glob))
+  end_line()
 
 
 def eval_create_var(t, env, glob):
@@ -298,8 +338,7 @@ def eval_create_array(t, env, glob):
   v = t.children[0].token.lexeme
   # evaluate the expression and assign the result, env
   size = eval_parse_tree(t.children[1], env, glob)
-  l = [None] * size
-  a = np.array(l)
+  a = new_array(size)
   if t.token.lexeme == "small":
     bindSmall(env, v, Ref(RefType.VARIABLE, a))
   elif t.token.lexeme == "big":
@@ -360,7 +399,7 @@ def eval_div(t, env, glob):
     """
   left = eval_parse_tree(t.children[0], env, glob)
   right = eval_parse_tree(t.children[1], env, glob)
-  if right == 0:
+  if is_zero(right):
     print(f"Division by 0 on line {t.token.line}")
     sys.exit(-1)
   return left / right
@@ -385,16 +424,43 @@ def eval_path(t, env, glob):
     Evaluate a branch
     """
   if eval_parse_tree(t.children[0], env, glob):
-    eval_parse_tree(t.children[1], env, glob)
+    result = eval_parse_tree(t.children[1], env, glob)
   else:
+    result = None
     if t.children[2] != None:
-      eval_parse_tree(t.children[2], env, glob)
+      result = eval_parse_tree(t.children[2], env, glob)
+
+  # pass on a call in tail position, other values are dropped
+  if type(result) is TailCall:
+    return result
 
 
 def eval_loop(t, env, glob):
+  if swarm is not None and t.token.lexeme == "swarm":
+    return eval_swarm(t, env, glob)
   while eval_parse_tree(t.children[0], env, glob):
     eval_parse_tree(t.children[1], env, glob)
 
+    # a return ends the loop
+    if env.return_value is not None:
+      break
+
+
+def eval_swarm(t, env, glob):
+  """
+    Evaluate a swarm loop over the process pool
+    """
+  loop = swarm.loop(t)
+  start = eval_parse_tree(t.children[0].children[0], env, glob)
+  bound = eval_parse_tree(t.children[0].children[1], env, glob)
+  values = {}
+  for name in loop.reads:
+    v = env.lookup(name)
+    if v and v.ref_type == RefType.VARIABLE:
+      values[name] = v.ref_value
+  for name, value in swarm.run(loop, start, bound, values).items():
+    bindSmall(env, name, Ref(RefType.VARIABLE, value))
+
 
 def eval_condition(t, env, glob):
   """
@@ -451,8 +517,10 @@ def eval_call(t, env, glob):
   # retrieve the function
   fun = env.lookup(name)
   if not fun:
-    print(f"Call to undefined function {name} on line {t.token.line}")
-    sys.exit(-1)
+    nargs = None if arglist is None else len(arglist.children)
+    builtin = find_builtin(name, nargs, t.token.line)
+    args = [eval_parse_tree(c, env, glob) for c in arglist.children]
+    return builtin.call(args, t.token.line)
   elif fun.ref_type != RefType.FUNCTION:
     print(f"Call to non-function {name} on line {t.token.line}")
     sys.exit(-1)
@@ -473,28 +541,254 @@ def eval_call(t, env, glob):
   local = RefEnv(glob)
 
   # all parameters are local (by design)
+  argv = []
   if paramlist != None and arglist != None:
     for i in range(len(paramlist.children)):
-      local.insert(paramlist.children[i].token.lexeme, Ref(RefType.VARIABLE, eval_parse_tree(arglist.children[i], env, glob)))
-  
+      argv.append(eval_parse_tree(arglist.children[i], env, glob))
+      local.insert(paramlist.children[i].token.lexeme, Ref(RefType.VARIABLE, argv[i]))
+
+  # a pure function may have been called with these arguments before
+  cache = memo.cache(name) if memo is not None else None
+  key = memo_key(argv) if cache is not None else None
+  if key is not None:
+    result = cache.get(key)
+    if result is not MISS:
+      return result
+    # the value of a call in tail position is not kept
+    if t not in tail_sites:
+      result = run_function(fun, local, glob)
+      cache.put(key, result)
+      return result
+
+  # a call in tail position is run by the caller's caller
+  if t in tail_sites:
+    return TailCall(fun, local, tail_sites[t])
+
   # call the function
-  return eval_parse_tree(fun, local, glob)
+  return run_function(fun, local, glob)
+
+
+def run_function(fun, env, glob):
+  """
+    Run a function, then the calls in tail position it hands back one
+    after the other, and return its value.
+    """
+  result = eval_parse_tree(fun, env, glob)
+  if type(result) is TailCall:
+    result = tail_value(result,
+                        lambda c: eval_parse_tree(c.fun, c.frame, glob))
+  return result
+
+
+def profile(profiler):
+  """
+    Count every function call and every statement with profiler.
+    """
+  global eval_function, eval_statement
+  run_function_body = eval_function
+  run_statement = eval_statement
+
+  def profiled_function(t, env, glob):
+    profiler.enter(t.token.lexeme)
+    try:
+      return run_function_body(t, env, glob)
+    finally:
+      profiler.leave()
+
+  def profiled_statement(t, env, glob):
+    profiler.start(t.token.line if t.token is not None else 0)
+    try:
+      return run_statement(t, env, glob)
+    finally:
+      profiler.stop()
+
+  eval_function = profiled_function
+  eval_statement = profiled_statement
+
+
+def dragon_stack(frame):
+  """
+    Read the functions being run from the Python frame and its callers,
+    for the sampler: a tuple of their names, outermost first, each with
+    the line of the statement it is running and the id of its
+    environment, which is the same for as long as the call runs.
+    """
+  stack = []
+  line = 0
+  while frame is not None:
+    code = frame.f_code
+    if code is BODY_CODE:
+      # the innermost body holds the statement being run
+      c = frame.f_locals.get('c')
+      if not line and c is not None and c.token is not None:
+        line = c.token.line
+    elif code is FUNCTION_CODE:
+      f = frame.f_locals
+      stack.append((f['t'].token.lexeme, line, id(f['env'])))
+      line = 0
+    frame = frame.f_back
+  stack.reverse()
+  return tuple(stack)
+
+
+# the code of the frames dragon_stack looks for
+BODY_CODE = eval_body.__code__
+FUNCTION_CODE = eval_function.__code__
 
 
 def eval_return(t, env, glob):
   """
     Evaluate Return
     """
-  env.return_value = eval_parse_tree(t.children[0], env, glob)
+  value = eval_parse_tree(t.children[0], env, glob)
+  if type(value) is TailCall:
+    return value
+  env.return_value = value
   return env.return_value
 
 
+def eval_save(t, env, glob):
+  """
+    Evaluate a repeated subexpression and keep it in its temporary
+    """
+  val = eval_parse_tree(t.children[0], env, glob)
+  env.insert(t.token.lexeme, Ref(RefType.VARIABLE, val))
+  return val
+
+
+def eval_load(t, env, glob):
+  """
+    Read back a repeated subexpression
+    """
+  return env.lookup(t.token.lexeme).ref_value
+
+
 if __name__ == "__main__":
-  if len(sys.argv) == 2:
-    f = open(sys.argv[1])
-    l = Lexer(f)
+  arg_parser = argparse.ArgumentParser(description="Run a DragonsRCool program.")
+  arg_parser.add_argument("file", nargs="?", help="program to run (default: stdin)")
+  arg_parser.add_argument("--lexer", choices=LEXERS, default="char",
+                          help="lexer used to scan the program")
+  arg_parser.add_argument("--compact", action="store_true",
+                          help="build the parse tree from slotted nodes")
+  arg_parser.add_argument("--iterative", action="store_true",
+                          help="parse with an explicit stack, for deeply nested programs")
+  arg_parser.add_argument("--lazy", action="store_true",
+                          help="parse function bodies when they are first called")
+  arg_parser.add_argument("--parallel", action="store_true",
+                          help="lex and parse functions in a process pool")
+  arg_parser.add_argument("--workers", type=int,
+                          help="size of the process pools parsing with --parallel "
+                          "and running swarm loops (default: cores)")
+  arg_parser.add_argument("--engine", choices=("tree", "closure", "vm", "python"),
+                          default="tree", help="how the program is run")
+  arg_parser.add_argument("--disassemble", action="store_true",
+                          help="print the bytecode of every function instead of running")
+  arg_parser.add_argument("--emit-py", metavar="FILE",
+                          help="write the program transpiled to Python instead of running")
+  arg_parser.add_argument("--no-optimize", action="store_true",
+                          help="run the program as parsed, without the optimizer")
+  arg_parser.add_argument("--opt-report", action="store_true",
+                          help="describe each change the optimizer makes on stderr")
+  arg_parser.add_argument("--memo", action="store_true",
+                          help="remember the values of pure functions")
+  arg_parser.add_argument("--memo-size", type=int, default=DEFAULT_SIZE,
+                          help="values remembered for each pure function")
+  arg_parser.add_argument("--memo-stats", action="store_true",
+                          help="with --memo, print cache hits and misses on stderr at exit")
+  arg_parser.add_argument("--profile", action="store_true",
+                          help="print the time spent in each function and line on stderr at exit")
+  arg_parser.add_argument("--profile-json", metavar="FILE",
+                          help="write the profile as JSON to FILE at exit")
+  arg_parser.add_argument("--sample-folded", metavar="FILE",
+                          help="sample the call stack and write folded stacks to FILE at exit")
+  arg_parser.add_argument("--sample-trace", metavar="FILE",
+                          help="sample the call stack and write a Chrome trace to FILE at exit")
+  arg_parser.add_argument("--sample-interval", type=float, default=DEFAULT_INTERVAL * 1000,
+                          help="milliseconds between samples")
+  arg_parser.add_argument("--sample-size", type=int, default=SAMPLE_SIZE,
+                          help="samples kept, the oldest are dropped")
+  arg_parser.add_argument("--output-buffer", choices=("auto", "line", "block"),
+                          default="auto", help="when shoot output is written out "
+                          "(default: line for a terminal, block otherwise)")
+  arg_parser.add_argument("--output-block-size", type=int, default=OUTPUT_BLOCK,
+                          help="characters of output kept before writing a block")
+  arg_parser.add_argument("--no-cache", action="store_true",
+                          help="always parse, ignoring the parse cache")
+  arg_parser.add_argument("--cache-dir",
+                          help="parse cache directory (default: __dragoncache__)")
+  arg_parser.add_argument("--cache-size", type=int, default=64,
+                          help="parse cache size limit in MB")
+  args = arg_parser.parse_args()
+  if (args.profile or args.profile_json) and args.engine not in ("tree", "closure"):
+    arg_parser.error("profiling needs the tree or closure engine")
+  if (args.sample_folded or args.sample_trace) and args.engine != "tree":
+    arg_parser.error("sampling needs the tree engine")
+
+  if args.file:
+    f = open(args.file)
+  else:
+    f = sys.stdin
+  src = read_source(f)
+
+  # programs read from a file are cached by their contents
+  cache = None
+  pt = None
+  if args.file and not args.no_cache:
+    cache = ProgramCache(args.cache_dir or default_cache_dir(args.file),
+                         args.cache_size * 1024 * 1024)
+    key = cache.key(src, f"lexer={args.lexer} compact={args.compact} lazy={args.lazy}")
+    pt = cache.load(key)
+
+  if pt is None:
+    if args.parallel:
+      pt = parallel_parse(src, args.workers, args.compact, args.iterative,
+                          args.lazy, LEXERS[args.lexer])
+    else:
+      l = LEXERS[args.lexer](io.StringIO(src))
+      if args.iterative:
+        parser = IterativeParser(l, args.compact, args.lazy)
+      else:
+        parser = Parser(l, args.compact, args.lazy)
+      pt = parser.parse()
+    if cache:
+      cache.store(key, pt)
+  if not args.no_optimize:
+    Optimizer.optimize(pt, sys.stderr if args.opt_report else None)
+  if args.memo:
+    memo = Memo(pt, args.memo_size)
+    if args.memo_stats:
+      atexit.register(memo.report, sys.stderr)
+  # vm and python run swarms in order, but check them all the same
+  if has_swarm(src) and not (args.disassemble or args.emit_py):
+    swarm = Swarm(pt, args.workers)
+  buffer_output(args.output_buffer, args.output_block_size)
+  profiler = None
+  if args.profile or args.profile_json:
+    profiler = Profiler()
+    if args.profile:
+      atexit.register(profiler.report, sys.stderr, src)
+    if args.profile_json:
+      atexit.register(profiler.write_json, args.profile_json)
+    if args.engine == "tree":
+      profile(profiler)
+  if args.sample_folded or args.sample_trace:
+    sampler = Sampler(dragon_stack, args.sample_interval / 1000, args.sample_size)
+    if args.sample_folded:
+      atexit.register(sampler.write_folded, args.sample_folded)
+    if args.sample_trace:
+      atexit.register(sampler.write_trace, args.sample_trace)
+    sampler.start()
+  if args.disassemble:
+    for code in Bytecode.compile_program(pt):
+      Bytecode.disassemble(code)
+  elif args.emit_py:
+    with open(args.emit_py, "w") as out:
+      out.write(Transpiler.transpile(pt, args.file))
+  elif args.engine == "closure":
+    Closures.run_program(pt, memo, profiler, swarm)
+  elif args.engine == "vm":
+    Bytecode.run_program(pt, memo)
+  elif args.engine == "python":
+    Transpiler.run_program(pt, args.file, memo)
   else:
-    l = Lexer()
-  parser = Parser(l)
-  pt = parser.parse()
-  eval_parse_tree(pt, RefEnv(), None)
+    eval_parse_tree(pt, RefEnv(), None)
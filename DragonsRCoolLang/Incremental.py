@@ -0,0 +1,172 @@
+"""
+An incremental front end for editors and watch mode runners.
+
+An IncrementalParser holds a program's source, the offset and line of
+every top level dragon keyword, and the FUNCTION subtree parsed from
+each. An edit replaces a range of the source. Lexing restarts at the
+function before the edit, which is always a safe point because the
+text before it is unchanged. The keyword scan of ParallelParser then
+runs forward until it reaches a dragon keyword which was already
+there before the edit and lies past the end of the edited line. Only
+the functions in between are parsed again. Those after it keep their
+subtrees and tokens; if the edit added or removed lines, their line
+numbers are shifted the next time the tree is asked for.
+"""
+from bisect import bisect_left
+from Lexer import SKIP_RE
+from Parser import ParseTree, CompactNode, ParseType
+from ParallelParser import PRESCAN_RE, find_functions, parse_batch
+
+
+def shift_lines(node, delta):
+  """
+    Move every token in the subtree at node down by delta lines.
+    """
+  stack = [node]
+  while stack:
+    t = stack.pop()
+    if t is None or isinstance(t, str):
+      continue
+    tok = t.token
+    if tok is not None and not isinstance(tok, str):
+      t.token = tok._replace(line=tok.line + delta)
+    stack.extend(t.children)
+
+
+class IncrementalParser:
+  """
+    Keeps a program parsed as its source is edited.
+
+    src is the program text. tree may be a tree already parsed from
+    src, whose FUNCTION subtrees are then reused.
+    """
+
+  def __init__(self, src, tree=None, compact=False):
+    self.src = src
+    self.compact = compact
+    self.error = None
+
+    # per function: offset of its dragon keyword, line of that
+    # keyword, subtree (None if it failed to parse) and how many lines
+    # its tokens still have to move
+    self.__starts = []
+    self.__lines = []
+    self.__functions = []
+    self.__shifts = []
+
+    # offset and line where the text left unparsed by an error begins,
+    # and the index of the first function after it
+    self.__bad = None
+
+    starts = find_functions(src)
+    if tree is not None and len(tree.children) == len(starts) \
+       and (not starts or SKIP_RE.match(src).end() == starts[0]):
+      self.__starts = starts
+      self.__lines = self.__count_lines(starts, 0, 1)
+      self.__functions = list(tree.children)
+      self.__shifts = [0] * len(starts)
+    else:
+      self.edit(0, len(src), src)
+
+  def __count_lines(self, starts, pos, line):
+    """
+      Return the line of each offset in starts, counting on from line
+      at offset pos.
+      """
+    lines = []
+    for p in starts:
+      line += self.src.count('\n', pos, p)
+      lines.append(line)
+      pos = p
+    return lines
+
+  def edit(self, start, end, text):
+    """
+      Replace src[start:end] with text and parse the functions it
+      touched again. Returns the parser error message, or None if the
+      program parsed.
+      """
+    old = self.src
+    new = old[:start] + text + old[end:]
+    delta = len(text) - (end - start)
+    starts = self.__starts
+
+    # the functions to parse again run from the one before the edit,
+    # or the start of the source, up to one which starts after it
+    lo = bisect_left(starts, start) - 1
+    hi = bisect_left(starts, end)
+    if lo < 0:
+      pos, line = 0, 1
+    else:
+      pos, line = starts[lo], self.__lines[lo]
+    if self.__bad:
+      if self.__bad[0] < pos:
+        pos, line = self.__bad[:2]
+      hi = max(hi, self.__bad[2])
+    first = bisect_left(starts, pos)
+    col = pos - new.rfind('\n', 0, pos)
+
+    # scan for dragon keywords until one lines up with an old function
+    # past the end of the edited line
+    new_starts = []
+    stop = len(starts)
+    resync = new.find('\n', start + len(text))
+    for m in PRESCAN_RE.finditer(new, pos):
+      if not m.group(1):
+        continue
+      p = m.start()
+      if 0 <= resync < p:
+        k = bisect_left(starts, p - delta, hi)
+        if k < len(starts) and starts[k] == p - delta:
+          stop = k
+          break
+      new_starts.append(p)
+    end_pos = starts[stop] + delta if stop < len(starts) else len(new)
+
+    functions, _, error = parse_batch(new[pos:end_pos], line, col,
+                                      stop == len(starts), self.compact)
+    if functions is not None and len(functions) != len(new_starts):
+      # the scan and the parser disagree, so start over
+      functions, _, error = parse_batch(new, 1, 1, True, self.compact)
+      first, stop = 0, len(starts)
+      pos, line = 0, 1
+      new_starts = find_functions(new)
+      if functions is not None:
+        # a serial parse stops at end and ignores anything after it
+        if len(functions) <= len(new_starts):
+          new_starts = new_starts[:len(functions)]
+        else:
+          functions, error = None, 'Could not match functions to the source\n'
+
+    self.src = new
+    lines = self.__count_lines(new_starts, pos, line)
+    dl = text.count('\n') - old.count('\n', start, end)
+    count = len(new_starts)
+    starts[first:stop] = new_starts
+    self.__lines[first:stop] = lines
+    self.__functions[first:stop] = functions or [None] * count
+    self.__shifts[first:stop] = [0] * count
+    for k in range(first + count, len(starts)):
+      starts[k] += delta
+      self.__lines[k] += dl
+      self.__shifts[k] += dl
+
+    self.error = error
+    self.__bad = (pos, line, first + count) if error is not None else None
+    return error
+
+  def tree(self):
+    """
+      Return the PROGRAM tree for the current source, or None if it
+      has a parser error.
+      """
+    if self.error is not None:
+      return None
+    shifts = self.__shifts
+    for k, d in enumerate(shifts):
+      if d:
+        shift_lines(self.__functions[k], d)
+        shifts[k] = 0
+    node = (CompactNode if self.compact else ParseTree)(ParseType.PROGRAM, None)
+    node.children = list(self.__functions)
+    return node
@@ -42,8 +42,16 @@ To Write a Lexer
         - Match any fixed tokens
         - Implementing a finite state machine
 """
+import io
+import os
+import re
 import sys
+import mmap
+import stat
+from array import array
+from bisect import bisect_left
 from enum import Enum, auto
+from types import MappingProxyType
 from collections import namedtuple
 
 
@@ -102,18 +110,76 @@ class Token(Enum):
 TokenDetail = namedtuple('TokenDetail',
                          ('token', 'lexeme', 'value', 'line', 'col'))
 
+# group 1 tokens and keywords, shared by the buffered lexers
+SINGLE_TOKENS = ((':', Token.ASSIGN), ('+', Token.PLUS), ('-', Token.MINUS),
+                 ('*', Token.TIMES), ('/', Token.DIVIDE), ('(', Token.LPAREN),
+                 (')', Token.RPAREN), ('^', Token.POW), ('[', Token.LBRACKET),
+                 ('{', Token.LCURLY), ('}', Token.RCURLY), ('<', Token.LTHANS),
+                 ('>', Token.GTHANS), ('$', Token.DOLLAR), (',', Token.COMMA),
+                 (']', Token.RBRACKET))
+
+KEYWORDS = (('is', Token.EQ), ('not', Token.NOT), ('eats', Token.LT),
+            ('eats_more', Token.LTEQ), ('spits', Token.GT),
+            ('spits_more', Token.GTEQ), ('also', Token.ALSO),
+            ('either', Token.EITHER), ('fire', Token.FIRE),
+            ('burn', Token.BURN), ('swarm', Token.BURN), ('path', Token.PATH),
+            ('extinguish', Token.EXTINGUISH), ('big', Token.BIG),
+            ('small', Token.SMALL), ('here', Token.HERE),
+            ('there', Token.THERE), ('dragon', Token.DRAGON),
+            ('shoot', Token.SHOOT), ('consume', Token.CONSUME),
+            ('return', Token.RETURN), ('end', Token.END),
+            ('hatch', Token.HATCH))
+
+# files at least this big are mapped into memory instead of read
+MMAP_THRESHOLD = 1 << 20
+
+# finds fire and extinguish keywords, stepping over comments, strings
+# and char literals. A keyword may follow digits, which lex as a
+# separate number.
+BLOCK_RE = re.compile(
+  r'''#[^\n]*|"[^"]*"?|'(?:[^\W\d_]|\\)*.?|(?<!\w)\d*(?:(fire)|(extinguish))(?!\w)''',
+  re.S)
+
+
+def read_source(lex_file):
+  """
+    Read the whole source text of lex_file. Large regular files are
+    mapped into memory rather than pulled through the stream.
+    """
+  try:
+    fd = lex_file.fileno()
+    info = os.fstat(fd)
+  except (AttributeError, OSError, io.UnsupportedOperation):
+    return lex_file.read()
+
+  if not stat.S_ISREG(info.st_mode) or info.st_size < MMAP_THRESHOLD \
+     or lex_file.tell() != 0:
+    return lex_file.read()
+
+  encoding = getattr(lex_file, 'encoding', None) or 'utf-8'
+  with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as m:
+    src = str(m, encoding)
+
+  # match the universal newline translation of a text stream
+  if '\r' in src:
+    src = src.replace('\r\n', '\n').replace('\r', '\n')
+  return src
+
 
 class Lexer:
   '''
     The lexer class for the calc language. Converts a text stream
     into a token stream.
+
+    line and col give the position of the first character, for when
+    the source is a piece cut out of a bigger file.
     '''
 
-  def __init__(self, lex_file=sys.stdin):
+  def __init__(self, lex_file=sys.stdin, line=1, col=1):
     # set up scanning in our lexer
     self.__lex_file = lex_file
-    self.__line = 1
-    self.__col = 0
+    self.__line = line
+    self.__col = col - 1
     self.__cur_char = None
 
     # scan the first character
@@ -343,7 +409,7 @@ class Lexer:
           ('eats_more', Token.LTEQ), ('spits', Token.GT),
           ('spits_more', Token.GTEQ), ('also', Token.ALSO),
           ('either', Token.EITHER), ('fire', Token.FIRE), ('burn', Token.BURN),
-          ('path', Token.PATH), ('extinguish', Token.EXTINGUISH),
+          ('swarm', Token.BURN), ('path', Token.PATH), ('extinguish', Token.EXTINGUISH),
           ('big', Token.BIG), ('small', Token.SMALL), ('here', Token.HERE),
           ('there', Token.THERE), ('dragon', Token.DRAGON),
           ('shoot', Token.SHOOT), ('consume', Token.CONSUME),
@@ -399,6 +465,464 @@ class Lexer:
     return self.__tok
 
 
+class BufferedLexer:
+  '''
+    A lexer which reads the whole source up front and scans it by
+    index. Lexemes are sliced out of the buffer and line/column are
+    worked out from newline positions, so the token stream is the
+    same as the one produced by Lexer.
+
+    line and col give the position of the first character, for when
+    the source is a piece cut out of a bigger file.
+    '''
+
+  def __init__(self, lex_file=sys.stdin, line=1, col=1):
+    self.__src = read_source(lex_file)
+    self.__pos = 0
+
+    # line of the current position and offset of the last newline
+    # before it
+    self.__line = line
+    self.__nl = -col
+
+    # store the current token
+    self.__tok = TokenDetail(Token.INVALID, '', None, 0, 0)
+
+  def __advance(self, pos):
+    """
+        Move the scan position forward to pos, keeping track of the
+        lines we pass over.
+        """
+    n = self.__src.count('\n', self.__pos, pos)
+    if n:
+      self.__line += n
+      self.__nl = self.__src.rfind('\n', self.__pos, pos)
+    self.__pos = pos
+
+  def get_char(self):
+    """
+        Return the current character
+        """
+    return self.__src[self.__pos:self.__pos + 1]
+
+  def get_line(self):
+    """
+        Return the current line number
+        """
+    if self.get_char() == '\n':
+      return self.__line + 1
+    return self.__line
+
+  def get_col(self):
+    """
+        Return the current col number
+        """
+    if self.get_char() == '\n':
+      return 0
+    return self.__pos - self.__nl
+
+  def get_tok(self):
+    return self.__tok
+
+  def _skip(self, src, pos):
+    """
+        Return the position of the first character at or after pos
+        which is not whitespace or part of a comment.
+        """
+    n = len(src)
+    while pos < n:
+      c = src[pos]
+      if c.isspace():
+        pos += 1
+      elif c == '#':
+        # skip to the end of the line
+        pos = src.find('\n', pos)
+        if pos < 0:
+          pos = n
+      else:
+        break
+    return pos
+
+  def _scan(self, src, pos):
+    """
+        Match the token starting at pos. Returns the token, lexeme,
+        value, and the position just past the token.
+        """
+    c = src[pos]
+
+    # group 1 tokens
+    for tok in SINGLE_TOKENS:
+      if c == tok[0]:
+        return tok[1], c, None, pos + 1
+
+    # numbers
+    n = len(src)
+    if c.isdigit() or c == '.':
+      end = pos
+      while end < n and src[end].isdigit():
+        end += 1
+      t = Token.INTLIT
+      if end < n and src[end] == '.':
+        t = Token.FLOATLIT
+        end += 1
+        while end < n and src[end].isdigit():
+          end += 1
+      lexeme = src[pos:end]
+      if lexeme[-1] == '.':
+        return Token.INVALID, lexeme, None, end
+      if t == Token.INTLIT:
+        return Token.NUMBER, lexeme, int(lexeme), end
+      return Token.NUMBER, lexeme, float(lexeme), end
+
+    # keywords and identifiers
+    if c.isalpha() or c == '_':
+      end = pos + 1
+      while end < n and (src[end].isalpha() or src[end].isdigit()
+                         or src[end] == '_'):
+        end += 1
+      lexeme = src[pos:end]
+      for kw in KEYWORDS:
+        if kw[0] == lexeme:
+          return kw[1], lexeme, None, end
+      return Token.ID, lexeme, None, end
+
+    # strings
+    if c == '"':
+      end = src.find('"', pos + 1)
+      if end < 0:
+        # unterminated string
+        return Token.INVALID, src[pos:], None, n
+      value = src[pos + 1:end]
+      # like Lexer, an empty string takes the following character as
+      # its lexeme
+      lexeme = value or src[end + 1:end + 2]
+      return Token.STRING, lexeme, value, end + 1
+    if c == "'":
+      end = pos + 1
+      while end < n and (src[end].isalpha() or src[end] == '\\'):
+        end += 1
+      # the closing character is always taken, even past the end
+      lexeme = src[pos:end + 1]
+      return Token.CHARLIT, lexeme, lexeme, end + 1
+
+    # Catch all
+    return Token.INVALID, c, None, pos + 1
+
+  def next(self):
+    """
+        Advance the lexer to the next token and return
+        that token.
+        """
+    src = self.__src
+    start = self._skip(src, self.__pos)
+    self.__advance(start)
+    line = self.__line
+    col = start - self.__nl
+
+    # detect end of file
+    if start >= len(src):
+      self.__tok = TokenDetail(Token.EOF, '', None, line, col)
+      return self.__tok
+
+    token, lexeme, value, end = self._scan(src, start)
+    self.__tok = TokenDetail(token, lexeme, value, line, col)
+    self.__advance(end)
+    return self.__tok
+
+  def skip_block(self):
+    """
+        Jump over the block opened by the current fire token without
+        lexing it. The matching extinguish becomes the current token.
+        Returns the skipped text, up to and including the extinguish,
+        with the line and column it starts at, or None if the block
+        is never closed.
+        """
+    src = self.__src
+    depth = 1
+    for m in BLOCK_RE.finditer(src, self.__pos):
+      if m.group(1):
+        depth += 1
+      elif m.group(2):
+        depth -= 1
+        if not depth:
+          break
+    else:
+      return None
+
+    span = (src[self.__pos:m.end()], self.__line, self.__pos - self.__nl)
+    self.__advance(m.start(2))
+    self.__tok = TokenDetail(Token.EXTINGUISH, m.group(2), None, self.__line,
+                             self.__pos - self.__nl)
+    self.__advance(m.end())
+    return span
+
+
+# precompiled tables for TableLexer
+SINGLE_TABLE = MappingProxyType(dict(SINGLE_TOKENS))
+KEYWORD_TABLE = MappingProxyType(dict(KEYWORDS))
+SKIP_RE = re.compile(r'(?:\s+|#[^\n]*)*')
+TOKEN_RE = re.compile(r'''
+    (?P<number> \d+(?:\.\d*)? | \.\d* )
+  | (?P<word>   [^\W\d]\w* )
+  | (?P<string> "[^"]*" )
+  | (?P<char>   '(?:[^\W\d_]|\\)* )
+''', re.VERBOSE)
+
+
+class TableLexer(BufferedLexer):
+  '''
+    A buffered lexer which does one dispatch per token. Single
+    character tokens come from a lookup table, and everything else is
+    matched by one compiled regular expression, with keywords picked
+    out of identifiers by a dictionary.
+    '''
+
+  def _skip(self, src, pos):
+    return table_skip(src, pos)
+
+  def _scan(self, src, pos):
+    return table_scan(src, pos)
+
+
+def table_skip(src, pos):
+  """
+    Return the position of the first character at or after pos which
+    is not whitespace or part of a comment. A char literal closed by
+    the end of the source ends past it, and so does the EOF token
+    after it, as in Lexer.
+    """
+  if pos >= len(src):
+    return pos
+  return SKIP_RE.match(src, pos).end()
+
+
+def table_scan(src, pos):
+  """
+    Match the token starting at pos using the precompiled tables.
+    Returns the token, lexeme, value, and the position just past the
+    token.
+    """
+  c = src[pos]
+  t = SINGLE_TABLE.get(c)
+  if t:
+    return t, c, None, pos + 1
+
+  m = TOKEN_RE.match(src, pos)
+  if not m:
+    # unterminated strings and stray characters
+    if c == '"':
+      return Token.INVALID, src[pos:], None, len(src)
+    return Token.INVALID, c, None, pos + 1
+
+  kind = m.lastgroup
+  end = m.end()
+  lexeme = m.group()
+  if kind == 'word':
+    # identifiers repeat a lot, so keep one copy of each name
+    lexeme = sys.intern(lexeme)
+    return KEYWORD_TABLE.get(lexeme, Token.ID), lexeme, None, end
+  elif kind == 'number':
+    if lexeme[-1] == '.':
+      return Token.INVALID, lexeme, None, end
+    elif '.' in lexeme:
+      return Token.NUMBER, lexeme, float(lexeme), end
+    return Token.NUMBER, lexeme, int(lexeme), end
+  elif kind == 'string':
+    value = lexeme[1:-1]
+    return Token.STRING, value or src[end:end + 1], value, end
+  else:
+    # the closing character is always taken, even past the end
+    lexeme = src[pos:end + 1]
+    return Token.CHARLIT, lexeme, lexeme, end + 1
+
+
+# tokens by their numeric value, for decoding a TokenStore
+TOKENS_BY_VALUE = {t.value: t for t in Token}
+
+
+class TokenStore:
+  '''
+    Struct-of-arrays storage for the whole token stream of a source.
+    Only the token kind and the start/end offsets into the source are
+    kept for each token, plus the value of literals. Lexemes are
+    sliced from the source and line/column are looked up from an index
+    of newline offsets when they are asked for. line and col give the
+    position of the first character of the source.
+    '''
+
+  def __init__(self, src, line=1, col=1):
+    self.src = src
+    self.line = line
+    self.col = col
+    self.kinds = array('B')
+    self.starts = array('q')
+    self.ends = array('q')
+    self.values = {}
+    self.__newlines = None
+
+    # scan the whole source
+    n = len(src)
+    pos = 0
+    while True:
+      pos = table_skip(src, pos)
+      if pos >= n:
+        self.__append(Token.EOF, pos, pos)
+        break
+      token, lexeme, value, end = table_scan(src, pos)
+      if value is not None:
+        self.values[len(self.kinds)] = value
+      self.__append(token, pos, end)
+      pos = end
+
+  def __append(self, token, start, end):
+    self.kinds.append(token.value)
+    self.starts.append(start)
+    self.ends.append(end)
+
+  def __len__(self):
+    return len(self.kinds)
+
+  def token(self, i):
+    return TOKENS_BY_VALUE[self.kinds[i]]
+
+  def lexeme(self, i):
+    end = self.ends[i]
+    if i in self.values and self.kinds[i] == Token.STRING.value:
+      # strings are stored without their quotes
+      return self.values[i] or self.src[end:end + 1]
+    return self.src[self.starts[i]:end]
+
+  def value(self, i):
+    return self.values.get(i)
+
+  def position(self, i):
+    """
+        Return the line and column where token i begins.
+        """
+    if self.__newlines is None:
+      self.__newlines = array('q')
+      nl = self.src.find('\n')
+      while nl >= 0:
+        self.__newlines.append(nl)
+        nl = self.src.find('\n', nl + 1)
+
+    start = self.starts[i]
+    k = bisect_left(self.__newlines, start)
+    if k:
+      return self.line + k, start - self.__newlines[k - 1]
+    return self.line, self.col + start
+
+  def detail(self, i):
+    """
+        Return token i as a TokenDetail.
+        """
+    line, col = self.position(i)
+    return TokenDetail(self.token(i), self.lexeme(i), self.value(i), line,
+                       col)
+
+
+class StoredToken:
+  '''
+    A view of one token in a TokenStore with the same fields as
+    TokenDetail. Every field is read from the store when it is used.
+    '''
+  __slots__ = ('store', 'index')
+
+  def __init__(self, store, index):
+    self.store = store
+    self.index = index
+
+  @property
+  def token(self):
+    return self.store.token(self.index)
+
+  @property
+  def lexeme(self):
+    return self.store.lexeme(self.index)
+
+  @property
+  def value(self):
+    return self.store.value(self.index)
+
+  @property
+  def line(self):
+    return self.store.position(self.index)[0]
+
+  @property
+  def col(self):
+    return self.store.position(self.index)[1]
+
+  def __repr__(self):
+    return repr(self.store.detail(self.index))
+
+
+class CompactLexer:
+  '''
+    A lexer which scans the whole source into a TokenStore up front and
+    then hands out views of the stored tokens. line and col give the
+    position of the first character, as for BufferedLexer.
+    '''
+
+  def __init__(self, lex_file=sys.stdin, line=1, col=1):
+    self.__store = TokenStore(read_source(lex_file), line, col)
+    self.__index = -1
+
+    # store the current token
+    self.__tok = TokenDetail(Token.INVALID, '', None, 0, 0)
+
+  def get_store(self):
+    return self.__store
+
+  def get_tok(self):
+    return self.__tok
+
+  def next(self):
+    """
+        Advance the lexer to the next token and return
+        that token.
+        """
+    # stay on the EOF token once we reach it
+    if self.__index < len(self.__store) - 1:
+      self.__index += 1
+      self.__tok = StoredToken(self.__store, self.__index)
+    return self.__tok
+
+
+class ReplayLexer:
+  '''
+    Replays a list of tokens which were lexed earlier. Once the list
+    runs out, the last token is returned again.
+    '''
+
+  def __init__(self, tokens):
+    self.__tokens = tokens
+    self.__index = -1
+
+    # store the current token
+    self.__tok = TokenDetail(Token.INVALID, '', None, 0, 0)
+
+  def get_tok(self):
+    return self.__tok
+
+  def next(self):
+    """
+        Advance the lexer to the next token and return
+        that token.
+        """
+    if self.__index < len(self.__tokens) - 1:
+      self.__index += 1
+      self.__tok = self.__tokens[self.__index]
+    return self.__tok
+
+
+# lexers which can be selected from the command line
+LEXERS = {
+  'char': Lexer,
+  'buffered': BufferedLexer,
+  'table': TableLexer,
+  'compact': CompactLexer
+}
+
 if __name__ == '__main__':
   lex = Lexer()
 
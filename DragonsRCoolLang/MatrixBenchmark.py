@@ -0,0 +1,200 @@
+"""
+Benchmarks of matrix multiplication in DragonsRCool programs.
+
+Times the triple nested burn loop the Matrix sample used to multiply
+with against hatch matmul[A, B], on square matrices of a few sizes and
+on each engine. Every program is run by the interpreter in its own
+process, so the times include startup. A program which only fills the
+matrices is timed too and taken off both, which leaves the time of
+the multiplication itself. The speedup is a dash where matmul took no
+time that could be told apart from filling the matrices.
+
+    python MatrixBenchmark.py --size 20 --size 40 --engine closure
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from Benchmark import best_time, git_commit
+
+SAMPLE_DIR = os.path.dirname(os.path.abspath(__file__))
+INTERPRETER = os.path.join(SAMPLE_DIR, 'DragonsRCool.py')
+ENGINES = ('tree', 'closure', 'vm', 'python')
+
+# the Matrix sample's multiply before matmul, with vectZ read from B
+LOOP_MULTIPLY = '''
+dragon multiply A B C r1 c1 r2 c2 fire
+  < small i : 0 $ >
+  < burn i eats r1 fire
+    < small j : 0 $ >
+    < burn j eats c2 fire
+      < small k : 0 $ >
+      < burn k eats r2 fire
+        < small x : 0 $ >
+        < small y : 0 $ >
+        < small z : 0 $ >
+        < small result : 0 $ >
+
+        < small vectX(c2) $ >
+        < vectX : C(i) $ >
+        < x : vectX(j) $ >
+
+        < small vectY(c1) $ >
+        < vectY : A(i) $ >
+        < y : vectY(k) $ >
+
+        < small vectZ(c1) $ >
+        < vectZ : B(k) $ >
+        < z : vectZ(j) $ >
+
+        < small prod : y * z $ >
+        < result : x + prod $ >
+        < vectX(j) : result $ >
+        < C(i) : vectX $ >
+        < k : k + 1 $ >
+      extinguish >
+      < j : j + 1 $ >
+    extinguish >
+    < i : i + 1 $ >
+  extinguish >
+extinguish
+'''
+
+MATMUL_MULTIPLY = '''
+dragon multiply A B C r1 c1 r2 c2 fire
+  < small P : hatch matmul[A, B] $ >
+  < small i : 0 $ >
+  < burn i eats r1 fire
+    < C(i) : P(i) $ >
+    < i : i + 1 $ >
+  extinguish >
+extinguish
+'''
+
+# fills M with quarters times s, so every sum of products is exact in
+# floats and both ways of multiplying print the same digits, and C
+# starts out as zeros for the loop to add to
+PROGRAM = '''
+dragon main fire
+  < small n : {size} $ >
+  < small A(n) $ >
+  < small B(n) $ >
+  < small C(n) $ >
+  < hatch fill[A, n, 1] >
+  < hatch fill[B, n, 2] >
+  < hatch fill[C, n, 0] >
+  {multiply}
+  < small last : C(n - 1) $ >
+  < shoot last $ >
+extinguish
+
+dragon fill M n s fire
+  < small i : 0 $ >
+  < burn i eats n fire
+    < small row(n) $ >
+    < small j : 0 $ >
+    < burn j eats n fire
+      < row(j) : {{i * s + j - n}} * s / 4 $ >
+      < j : j + 1 $ >
+    extinguish >
+    < M(i) : row $ >
+    < i : i + 1 $ >
+  extinguish >
+extinguish
+{functions}
+end
+'''
+
+CASES = {
+  'setup': ('', ''),
+  'loop': ('< hatch multiply[A, B, C, n, n, n, n] >', LOOP_MULTIPLY),
+  'matmul': ('< hatch multiply[A, B, C, n, n, n, n] >', MATMUL_MULTIPLY),
+}
+
+
+def gen_program(case, size):
+  multiply, functions = CASES[case]
+  return PROGRAM.format(size=size, multiply=multiply, functions=functions)
+
+
+def run_program(path, engine):
+  """
+    Run the program in path and return its output. A program which
+    fails stops the benchmark.
+    """
+  out = subprocess.run([sys.executable, INTERPRETER, path, '--engine', engine,
+                        '--no-cache'],
+                       capture_output=True,
+                       text=True)
+  if out.returncode:
+    raise RuntimeError(f'{path} failed on the {engine} engine:\n'
+                       f'{out.stdout}{out.stderr}')
+  return out.stdout
+
+
+def run_size(size, engine, repeat, workdir):
+  """
+    Time the three programs for one size on one engine.
+    """
+  result = {'size': size, 'engine': engine}
+  outputs = {}
+  for case in CASES:
+    path = os.path.join(workdir, f'matrix_{case}_{size}.drc')
+    with open(path, 'w') as f:
+      f.write(gen_program(case, size))
+    seconds, outputs[case] = best_time(lambda: run_program(path, engine), repeat)
+    result[f'{case}_seconds'] = seconds
+  if outputs['loop'] != outputs['matmul']:
+    raise RuntimeError(f'loop and matmul disagree for size {size} on the '
+                       f'{engine} engine:\n{outputs["loop"]}{outputs["matmul"]}')
+
+  setup = result['setup_seconds']
+  result['loop_multiply_seconds'] = max(result['loop_seconds'] - setup, 0.0)
+  result['matmul_multiply_seconds'] = max(result['matmul_seconds'] - setup, 0.0)
+  return result
+
+
+def print_report(results):
+  print(f"{'engine':<10}{'size':>6}{'setup s':>10}{'loop s':>10}"
+        f"{'matmul s':>10}{'speedup':>10}")
+  for r in results:
+    loop = r['loop_multiply_seconds']
+    fast = r['matmul_multiply_seconds']
+    speedup = f'{loop / fast:.1f}x' if fast > 0 else '-'
+    print(f"{r['engine']:<10}{r['size']:>6}{r['setup_seconds']:>10.3f}"
+          f"{loop:>10.3f}{fast:>10.3f}{speedup:>10}")
+
+
+if __name__ == "__main__":
+  arg_parser = argparse.ArgumentParser(
+    description="Benchmark burn loop matrix multiplication against matmul.")
+  arg_parser.add_argument("--size", type=int, action="append",
+                          help="rows and columns of the matrices "
+                          "(default: 10 and 30)")
+  arg_parser.add_argument("--engine", action="append", choices=ENGINES,
+                          help="engine to benchmark (default: all)")
+  arg_parser.add_argument("--repeat", type=int, default=3,
+                          help="runs per measurement, the best is kept")
+  arg_parser.add_argument("--output", help="write the results as JSON")
+  args = arg_parser.parse_args()
+
+  results = []
+  with tempfile.TemporaryDirectory() as workdir:
+    for size in args.size or (10, 30):
+      for engine in args.engine or ENGINES:
+        results.append(run_size(size, engine, args.repeat, workdir))
+  print_report(results)
+
+  if args.output:
+    report = {
+      'commit': git_commit(),
+      'python': platform.python_version(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'results': results
+    }
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2)
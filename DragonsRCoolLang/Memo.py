@@ -0,0 +1,230 @@
+"""
+Memoization of pure DragonsRCool functions.
+
+A dragon is pure when its value depends on nothing but its arguments
+and calling it changes nothing the rest of the program can see: it
+does not shoot or consume, creates no big variable, reads only its
+parameters and its own small variables, writes only into arrays it
+created itself, and calls only builtins and other pure dragons. A
+dragon whose body has not been parsed yet, with --lazy, is never
+taken to be pure.
+
+With --memo every engine keeps an LRU cache of bounded size for each
+pure dragon. A call whose arguments are all numbers, strings or None
+looks its value up there before running the body, and a value which
+is not one of those, an array the caller may change, is never kept.
+"""
+from collections import OrderedDict
+from Lexer import Token
+from Parser import ParseType, LazyBody
+from Resolver import local_names
+
+# the builtins which change nothing
+PURE_BUILTINS = ('matmul',)
+
+# statements a pure dragon may not contain
+IMPURE = (ParseType.READ, ParseType.WRITE, ParseType.DEF)
+
+# arguments and values which may be kept
+VALUE_TYPES = (int, float, str, type(None))
+
+# the default number of values kept for each dragon
+DEFAULT_SIZE = 1024
+
+# what MemoCache.get returns for arguments it has no value for
+MISS = object()
+
+
+def big_names(program):
+  """
+    Collect every name the program creates with big.
+    """
+  names = set()
+  stack = [program]
+  while stack:
+    t = stack.pop()
+    if t is None or isinstance(t, (str, LazyBody)):
+      continue
+    if t.node_type in (ParseType.CREATEVAR, ParseType.CREATEARRAY) \
+       and t.token.lexeme == "big":
+      names.add(t.children[0].token.lexeme)
+    stack.extend(t.children)
+  return names
+
+
+def impure_body(t, params, bigs, callees):
+  """
+    Return true if the body t of a dragon with parameters params does
+    anything a pure dragon may not, other than calling another dragon.
+    The names of the dragons it calls are added to callees.
+    """
+  names = set(local_names(t, list(params)))
+  # a small variable read before it is written reads the big one
+  if (names - set(params)) & bigs:
+    return True
+
+  # the arrays the call creates, which it may write into
+  arrays = set()
+  bound = set(params)
+  stack = [t]
+  while stack:
+    n = stack.pop()
+    if n is None or isinstance(n, str):
+      continue
+    if n.node_type == ParseType.CREATEARRAY:
+      arrays.add(n.children[0].token.lexeme)
+    elif n.node_type == ParseType.CREATEVAR:
+      bound.add(n.children[0].token.lexeme)
+    elif n.node_type == ParseType.REASSIGN and n.children[0] is not None \
+       and n.children[0].node_type == ParseType.ATOMIC:
+      bound.add(n.children[0].token.lexeme)
+    stack.extend(n.children)
+  arrays -= bound
+
+  stack = [t]
+  while stack:
+    n = stack.pop()
+    if n is None or isinstance(n, str):
+      continue
+    nt = n.node_type
+    if nt in IMPURE:
+      return True
+    elif nt in (ParseType.CREATEVAR, ParseType.CREATEARRAY):
+      if n.token.lexeme == "big":
+        return True
+      # the name written is not read
+      stack.extend(n.children[1:])
+      continue
+    elif nt == ParseType.REASSIGN and n.children[0] is not None \
+       and n.children[0].node_type == ParseType.INDEX:
+      target = n.children[0].children[0]
+      if target is None or target.token.lexeme not in arrays:
+        return True
+    elif nt == ParseType.ATOMIC and n.token.token == Token.ID:
+      if n.token.lexeme not in names:
+        return True
+    elif nt == ParseType.CALL:
+      callees.add(n.token.lexeme)
+    stack.extend(n.children)
+  return False
+
+
+def pure_functions(program):
+  """
+    Return the names of the pure dragons of the program. A dragon is
+    pure if its own body is and every dragon it calls is, so the
+    dragons calling an impure one are struck off until none is left.
+    """
+  bigs = big_names(program)
+
+  # the last dragon of a name is the one which is called
+  funcs = {c.token.lexeme: c for c in program.children}
+  calls = {}
+  pure = set()
+  for name, fn in funcs.items():
+    body = fn.children[1]
+    params = [p.token.lexeme for p in fn.children[0].children] \
+      if fn.children[0] is not None else []
+    callees = set()
+    if name in bigs or type(body) is LazyBody or \
+       impure_body(body, params, bigs, callees):
+      continue
+    calls[name] = callees
+    pure.add(name)
+
+  changed = True
+  while changed:
+    changed = False
+    for name in list(pure):
+      for callee in calls[name]:
+        if callee not in pure and (callee in funcs or
+                                   callee not in PURE_BUILTINS):
+          pure.discard(name)
+          changed = True
+          break
+  return pure
+
+
+def memo_key(args):
+  """
+    The key of a call with the arguments args, or None if one of them
+    may not be kept. Floats are kept by their bits, so 0.0 and -0.0
+    stay apart and nan finds itself.
+    """
+  key = []
+  for a in args:
+    t = type(a)
+    if t is float:
+      key.append(a.hex())
+    elif t in VALUE_TYPES:
+      key.append((t, a))
+    else:
+      return None
+  return tuple(key)
+
+
+class MemoCache:
+  """
+    The values of the calls of one dragon, keeping the size most
+    recently used ones.
+    """
+
+  def __init__(self, size=DEFAULT_SIZE):
+    self.size = size
+    self.values = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key):
+    """
+      The value kept for key, or MISS.
+      """
+    v = self.values.get(key, MISS)
+    if v is MISS:
+      self.misses += 1
+    else:
+      self.hits += 1
+      self.values.move_to_end(key)
+    return v
+
+  def put(self, key, value):
+    if self.size <= 0 or type(value) not in VALUE_TYPES:
+      return
+    self.values[key] = value
+    if len(self.values) > self.size:
+      self.values.popitem(last=False)
+
+  def keep(self, key, value):
+    """
+      Put value for key unless key is None, and return value.
+      """
+    if key is not None:
+      self.put(key, value)
+    return value
+
+
+class Memo:
+  """
+    The caches of the pure dragons of a program.
+    """
+
+  def __init__(self, program, size=DEFAULT_SIZE):
+    self.caches = {name: MemoCache(size) for name in
+                   sorted(pure_functions(program))}
+
+  def cache(self, name):
+    """
+      The cache of the dragon name, or None if it is not memoized.
+      """
+    return self.caches.get(name)
+
+  def report(self, out):
+    """
+      Print the hits and misses of every cache.
+      """
+    if not self.caches:
+      print("memo: no pure dragons", file=out)
+    for name, cache in self.caches.items():
+      print(f"memo: {name} {cache.hits} hits, {cache.misses} misses, "
+            f"{len(cache.values)} kept", file=out)
+
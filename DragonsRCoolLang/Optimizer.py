@@ -0,0 +1,404 @@
+"""
+An optimizer for DragonsRCool parse trees.
+
+It runs between parsing and execution and rewrites the tree in place:
+    - arithmetic, comparisons, also and either on literals are folded
+      into a single literal.
+    - a path whose condition folds to a constant is replaced by the
+      branch which would run, and a burn whose condition is always
+      false is dropped.
+    - a subexpression which appears more than once in a statement is
+      computed where it is first evaluated, kept by a SAVE node in a
+      temporary and read back by LOAD nodes.
+Statements which call a function are not searched for repeated
+subexpressions, since the call may change a big variable or an array
+in between. Temporaries are named with a leading digit so they never
+clash with a variable of the program.
+"""
+import operator
+from Lexer import Token, TokenDetail
+from Parser import ParseTree, ParseType, CompactNode, CompactLeaf, LazyBody
+
+FOLDS = {
+  ParseType.ADD: operator.add,
+  ParseType.SUB: operator.sub,
+  ParseType.MUL: operator.mul,
+  ParseType.DIV: operator.truediv,
+  ParseType.POW: operator.pow
+}
+
+SYMBOLS = {
+  ParseType.ADD: '+',
+  ParseType.SUB: '-',
+  ParseType.MUL: '*',
+  ParseType.DIV: '/',
+  ParseType.POW: '^'
+}
+
+COMPARISONS = {
+  'is': operator.eq,
+  'not': operator.ne,
+  'eats': operator.lt,
+  'eats_more': operator.le,
+  'spits': operator.gt,
+  'spits_more': operator.ge
+}
+
+# subexpressions which may be computed once and reused
+REUSABLE = (ParseType.ADD, ParseType.SUB, ParseType.MUL, ParseType.DIV,
+            ParseType.POW, ParseType.NEGATION, ParseType.INDEX,
+            ParseType.COMPARABLE)
+
+# the largest folded power and repeated string
+MAX_EXPONENT = 1024
+MAX_BASE = 2**64
+MAX_REPEAT = 4096
+
+
+def is_literal(t):
+  return t is not None and t.node_type == ParseType.ATOMIC \
+    and t.token.token in (Token.NUMBER, Token.STRING)
+
+
+def source(t):
+  """
+    Return the text of an expression, for the report.
+    """
+  if t is None:
+    return '?'
+  nt = t.node_type
+  if nt == ParseType.ATOMIC:
+    if t.token.token == Token.STRING:
+      return f'"{t.token.value}"'
+    elif t.token.token == Token.NUMBER:
+      return str(t.token.value)
+    return t.token.lexeme
+  elif nt in SYMBOLS or nt in (ParseType.COMPARABLE, ParseType.CONDITION):
+    op = SYMBOLS.get(nt) or t.token.lexeme
+    parts = []
+    for c in t.children:
+      text = source(c)
+      if c is not None and (c.node_type in SYMBOLS or c.node_type == ParseType.CONDITION):
+        text = '{ ' + text + ' }'
+      parts.append(text)
+    return f' {op} '.join(parts)
+  elif nt == ParseType.NEGATION:
+    return '-' + source(t.children[0])
+  elif nt == ParseType.INDEX:
+    return f'{source(t.children[0])}({source(t.children[1])})'
+  elif nt == ParseType.CALL:
+    args = t.children[0].children if t.children[0] is not None else ()
+    return f"hatch {t.token.lexeme}[{', '.join(source(c) for c in args)}]"
+  elif nt == ParseType.SAVE:
+    return source(t.children[0])
+  return t.token.lexeme
+
+
+def key(t):
+  """
+    A value which is equal for equal expressions, wherever they are.
+    """
+  if t is None or isinstance(t, str):
+    return t
+  tok = t.token
+  if t.node_type == ParseType.ATOMIC:
+    if tok.token in (Token.NUMBER, Token.STRING):
+      return (t.node_type, type(tok.value), tok.value)
+    return (t.node_type, tok.lexeme)
+  lexeme = tok if tok is None or isinstance(tok, str) else tok.lexeme
+  return (t.node_type, lexeme) + tuple(key(c) for c in t.children)
+
+
+def fold_value(t, values):
+  """
+    Compute the operator node t on the literal values of its
+    children. Raises ValueError if it should be left to run time.
+    """
+  nt = t.node_type
+  if nt == ParseType.NEGATION:
+    return -values[0]
+  elif nt == ParseType.COMPARABLE:
+    return COMPARISONS[t.token.lexeme](*values)
+
+  left, right = values
+  if nt == ParseType.DIV and right == 0:
+    # reported when it runs
+    raise ValueError
+  elif nt == ParseType.POW:
+    if type(right) not in (int, float) or abs(right) > MAX_EXPONENT \
+       or type(left) not in (int, float) or abs(left) > MAX_BASE:
+      raise ValueError
+  elif nt == ParseType.MUL:
+    for count, other in ((left, right), (right, left)):
+      if isinstance(other, str) and isinstance(count, int) and count > MAX_REPEAT:
+        raise ValueError
+  value = FOLDS[nt](left, right)
+  if type(value) not in (int, float, str, bool):
+    # a complex power, which has no literal
+    raise ValueError
+  return value
+
+
+class Optimizer:
+  """
+    Optimizes programs. Every change is described on report, if one
+    is given.
+    """
+
+  def __init__(self, report=None):
+    self.report = report
+    self.changes = 0
+    self.__temps = 0
+
+  def note(self, line, message):
+    self.changes += 1
+    if self.report is not None:
+      print(f"line {line}: {message}", file=self.report)
+
+  def program(self, t):
+    for c in t.children:
+      self.function(c)
+
+  def function(self, t):
+    """
+      Optimize a FUNCTION node. A lazily parsed body is optimized once
+      it is parsed.
+      """
+    if type(t.children[1]) is LazyBody:
+      t.children[1].transform = self.top_body
+    else:
+      t.children[1] = self.top_body(t.children[1])
+
+  def top_body(self, t):
+    """
+      Optimize the body of a function and return it.
+      """
+    self.__temps = 0
+    try:
+      self.body(t, True)
+    except RecursionError:
+      # what was rewritten so far is kept, the rest runs as parsed
+      self.note(0, "nested too deeply, left the rest unoptimized")
+    return t
+
+  def body(self, t, top):
+    """
+      Optimize the statements of a BODY node. Calls on the top level
+      of a function give it its value, so branches holding such calls
+      are not moved there.
+      """
+    stmts = []
+    for c in t.children:
+      stmts.extend(self.statement(c, top))
+    t.children[:] = stmts
+
+  def statement(self, t, top):
+    """
+      Optimize one statement and return the statements replacing it.
+      """
+    nt = t.node_type
+    line = t.token.line if t.token is not None else 0
+    if nt == ParseType.PATH:
+      t.children[0] = self.fold(t.children[0])
+      cond = t.children[0]
+      if is_literal(cond):
+        branch = t.children[1] if cond.token.value else t.children[2]
+        if branch is None:
+          self.note(line, f"removed path, {source(cond)} is always false")
+          return []
+        self.body(branch, False)
+        if top and any(c.node_type == ParseType.CALL for c in branch.children):
+          # keep the branch nested, without the one which never runs
+          if cond.token.value and t.children[2] is None:
+            return [t]
+          t.children[1] = branch
+          t.children[2] = None
+          if cond.token.value:
+            self.note(line, f"removed there branch, {source(cond)} is always true")
+          else:
+            t.children[0] = self.literal(True, cond)
+            self.note(line, f"removed here branch, {source(cond)} is always false")
+          return [t]
+        which = "here" if cond.token.value else "there"
+        self.note(line, f"kept only the {which} branch, {source(cond)} is constant")
+        return branch.children
+      self.body(t.children[1], False)
+      if t.children[2] is not None:
+        self.body(t.children[2], False)
+    elif nt == ParseType.LOOP:
+      t.children[0] = self.fold(t.children[0])
+      cond = t.children[0]
+      if is_literal(cond) and not cond.token.value:
+        self.note(line, f"removed {t.token.lexeme}, {source(cond)} is always false")
+        return []
+      self.body(t.children[1], False)
+    else:
+      for parent, i in self.roots(t):
+        parent.children[i] = self.fold(parent.children[i])
+    self.reuse(t)
+    return [t]
+
+  def roots(self, t):
+    """
+      The expressions of a statement as (parent, index) pairs, in the
+      order they are evaluated.
+      """
+    nt = t.node_type
+    if nt in (ParseType.CREATEVAR, ParseType.CREATEARRAY, ParseType.RETURN,
+              ParseType.PATH, ParseType.LOOP):
+      i = 0 if nt in (ParseType.RETURN, ParseType.PATH, ParseType.LOOP) else 1
+      return [(t, i)] if t.children[i] is not None else []
+    elif nt == ParseType.REASSIGN:
+      target = t.children[0]
+      if target.node_type == ParseType.INDEX:
+        return [(target, 0), (t, 1), (target, 1)]
+      return [(t, 1)]
+    elif nt == ParseType.WRITE:
+      items = t.children[0]
+      return [(items, i) for i in range(len(items.children))]
+    elif nt == ParseType.READ:
+      target = t.children[0]
+      if target.node_type == ParseType.INDEX:
+        return [(target, 0), (target, 1)]
+    return []
+
+  def literal(self, value, t):
+    """
+      A literal node for value, in place of the node t.
+      """
+    tok = t.token
+    kind = Token.STRING if isinstance(value, str) else Token.NUMBER
+    lexeme = value if isinstance(value, str) else str(value)
+    tok = TokenDetail(kind, lexeme, value, tok.line, tok.col)
+    if type(t) is ParseTree:
+      return ParseTree(ParseType.ATOMIC, tok)
+    return CompactLeaf(ParseType.ATOMIC, tok)
+
+  def fold(self, t):
+    """
+      Fold the literal operations in the expression t and return it.
+      """
+    if t is None or t.node_type == ParseType.ATOMIC:
+      return t
+    nt = t.node_type
+    if nt == ParseType.CALL:
+      if t.children[0] is not None:
+        args = t.children[0].children
+        for i, c in enumerate(args):
+          args[i] = self.fold(c)
+      return t
+    for i, c in enumerate(t.children):
+      t.children[i] = self.fold(c)
+
+    if nt == ParseType.CONDITION:
+      left = t.children[0]
+      if not is_literal(left):
+        return t
+      if (t.token.lexeme == "also") == bool(left.token.value):
+        result = t.children[1]
+      else:
+        result = left
+      self.note(t.token.line, f"folded {source(t)} to {source(result)}")
+      return result
+
+    if (nt in FOLDS or nt in (ParseType.NEGATION, ParseType.COMPARABLE)) \
+       and all(is_literal(c) for c in t.children):
+      try:
+        value = fold_value(t, [c.token.value for c in t.children])
+      except (ValueError, TypeError, ArithmeticError):
+        return t
+      result = self.literal(value, t)
+      self.note(t.token.line, f"folded {source(t)} to {source(result)}")
+      return result
+    return t
+
+  def reuse(self, t):
+    """
+      Compute each repeated subexpression of the statement t once.
+      """
+    roots = self.roots(t)
+    counts = {}
+    stack = [parent.children[i] for parent, i in roots]
+    while stack:
+      c = stack.pop()
+      if c is None or isinstance(c, str):
+        continue
+      if c.node_type == ParseType.CALL:
+        # the call may change what the expressions read
+        return
+      if c.node_type in REUSABLE:
+        k = key(c)
+        counts[k] = counts.get(k, 0) + 1
+      stack.extend(c.children)
+    if not any(n > 1 for n in counts.values()):
+      return
+
+    # find where each repeated expression is evaluated first, and
+    # where it is surely evaluated already
+    marks = {}
+    loads = {}
+
+    def walk(c, available):
+      if c is None:
+        return
+      if c.node_type in REUSABLE and counts[key(c)] > 1:
+        k = key(c)
+        if k in available:
+          marks[id(c)] = (k, ParseType.LOAD)
+          loads[k] = loads.get(k, 0) + 1
+          return
+        for child in c.children:
+          walk(child, available)
+        marks[id(c)] = (k, ParseType.SAVE)
+        available.add(k)
+      elif c.node_type == ParseType.CONDITION:
+        # the right side may not run
+        walk(c.children[0], available)
+        walk(c.children[1], set(available))
+      else:
+        for child in c.children:
+          walk(child, available)
+
+    available = set()
+    for parent, i in roots:
+      walk(parent.children[i], available)
+    if not loads:
+      return
+
+    names = {}
+
+    def rewrite(c):
+      if c is None or isinstance(c, str):
+        return c
+      k, role = marks.get(id(c), (None, None))
+      if k in loads and role == ParseType.LOAD:
+        tok = TokenDetail(Token.ID, names[k], None, c.token.line, c.token.col)
+        if type(c) is ParseTree:
+          return ParseTree(ParseType.LOAD, tok)
+        return CompactLeaf(ParseType.LOAD, tok)
+
+      for i, child in enumerate(c.children):
+        c.children[i] = rewrite(child)
+      if k in loads:
+        if k not in names:
+          names[k] = f"{self.__temps}t"
+          self.__temps += 1
+          self.note(c.token.line, f"reused {source(c)} {loads[k]} more times")
+        tok = TokenDetail(Token.ID, names[k], None, c.token.line, c.token.col)
+        save = (ParseTree if type(c) is ParseTree else CompactNode)(ParseType.SAVE, tok)
+        save.children.append(c)
+        return save
+      return c
+
+    for parent, i in roots:
+      parent.children[i] = rewrite(parent.children[i])
+
+
+def optimize(program, report=None):
+  """
+    Optimize the program in place and return the number of changes
+    made to the bodies parsed so far.
+    """
+  optimizer = Optimizer(report)
+  optimizer.program(program)
+  return optimizer.changes
@@ -0,0 +1,119 @@
+"""
+A parallel front end for large DragonsRCool programs.
+
+A program is a flat run of dragon ... extinguish functions ending in
+end, so it can be cut up at the top level dragon keywords. A quick
+regular expression pass finds those keywords outside of strings and
+comments, the functions are grouped into batches, and each batch is
+lexed and parsed in a process pool. The FUNCTION subtrees are put back
+together under one PROGRAM node. Every batch is lexed by the chosen
+lexer with its real starting line and column, so the tokens carry the
+same positions as a serial parse would give them. As in a serial
+parse, the program stops at its first end, and the batches after it
+are dropped.
+"""
+import io
+import os
+import re
+import sys
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from Lexer import TableLexer, SKIP_RE
+from Parser import Parser, IterativeParser, ParseTree, CompactNode, ParseType
+
+# sources smaller than this are parsed in the current process
+PARALLEL_THRESHOLD = 256 * 1024
+
+# batches handed out per worker, to even out uneven function sizes
+BATCHES_PER_WORKER = 4
+
+# comments, strings and char literals are matched so that a dragon
+# inside them is skipped over
+PRESCAN_RE = re.compile(
+  r'''#[^\n]*|"[^"]*"?|'(?:[^\W\d_]|\\)*.?|(?<!\w)(dragon)(?!\w)''', re.S)
+
+
+def find_functions(src):
+  """
+    Return the offsets of every top level dragon keyword in src.
+    """
+  return [m.start() for m in PRESCAN_RE.finditer(src) if m.group(1)]
+
+
+def parse_serial(src, compact=False, iterative=False, lazy=False,
+                 lexer=TableLexer):
+  """
+    Parse src in the current process.
+    """
+  parser = IterativeParser if iterative else Parser
+  return parser(lexer(io.StringIO(src)), compact, lazy).parse()
+
+
+def parse_batch(text, line, col, final, compact, iterative=False, lazy=False,
+                lexer=TableLexer):
+  """
+    Lex and parse one batch of functions. Returns the FUNCTION nodes and
+    whether the batch ended the program. Parser errors are captured and
+    handed back instead of exiting the worker.
+    """
+  out = io.StringIO()
+  try:
+    with contextlib.redirect_stdout(out):
+      lexer = lexer(io.StringIO(text), line, col)
+      parser = IterativeParser if iterative else Parser
+      functions, ended = parser(lexer, compact, lazy).parse_functions(final)
+      return functions, ended, None
+  except SystemExit:
+    return None, False, out.getvalue()
+
+
+def split_batches(src, starts, count):
+  """
+    Group the functions beginning at starts into about count batches
+    of similar size. Returns (text, line, col, final) for every batch.
+    """
+  target = len(src) // count + 1
+  bounds = [starts[0]]
+  for start in starts[1:]:
+    if start - bounds[-1] >= target:
+      bounds.append(start)
+  bounds.append(len(src))
+
+  batches = []
+  line = 1 + src.count('\n', 0, bounds[0])
+  for a, b in zip(bounds, bounds[1:]):
+    col = a - src.rfind('\n', 0, a)
+    batches.append((src[a:b], line, col, b == len(src)))
+    line += src.count('\n', a, b)
+  return batches
+
+
+def parallel_parse(src, workers=None, compact=False, iterative=False,
+                   lazy=False, lexer=TableLexer):
+  """
+    Parse the program in src, spreading the work over a process pool.
+    lexer is the class each batch is lexed with.
+    """
+  workers = workers or os.cpu_count() or 1
+  starts = find_functions(src)
+
+  # anything but whitespace before the first function is left to the
+  # serial parser, so it reports the error
+  if len(src) < PARALLEL_THRESHOLD or workers < 2 or len(starts) < 2 \
+     or SKIP_RE.match(src).end() != starts[0]:
+    return parse_serial(src, compact, iterative, lazy, lexer)
+
+  batches = split_batches(src, starts, workers * BATCHES_PER_WORKER)
+  batches = [batch + (compact, iterative, lazy, lexer) for batch in batches]
+  node = (CompactNode if compact else ParseTree)(ParseType.PROGRAM, None)
+  with ProcessPoolExecutor(workers) as pool:
+    for functions, ended, error in pool.map(parse_batch, *zip(*batches)):
+      if error is not None:
+        print(error, end='')
+        sys.exit(-1)
+      node.children.extend(functions)
+
+      # anything after the end of the program is never parsed
+      if ended:
+        break
+  return node
@@ -8,9 +8,11 @@ To write a parser:
     2.) Convert each BNF rule into a mutually recursive function.
     3.) Add data structures to build the parse tree.
 """
+import io
 import sys
-from Lexer import Token, Lexer
+from Lexer import Token, Lexer, ReplayLexer
 from enum import Enum, auto
+from types import GeneratorType
 
 
 class ParseType(Enum):
@@ -50,6 +52,8 @@ class ParseType(Enum):
   READ = auto()
   CALL = auto()
   INDEX = auto()
+  SAVE = auto()
+  LOAD = auto()
 
 
 ariness = {
@@ -67,6 +71,15 @@ ariness = {
 }
 
 
+# binary operators handled by precedence climbing: (precedence, node)
+BINARY_OPS = {
+  Token.PLUS: (1, ParseType.ADD),
+  Token.MINUS: (1, ParseType.SUB),
+  Token.TIMES: (2, ParseType.MUL),
+  Token.DIVIDE: (2, ParseType.DIV)
+}
+
+
 class ParseTree():
 
   def __init__(self, node_type=ParseType.FUNCTION, token=None):
@@ -116,426 +129,828 @@ class ParseTree():
     self.children[0].insert_left_leaf(leaf)
 
 
-class Parser:
+class CompactNode:
   """
-    Parser state will follow the lexer state.
-    We consume the stream token by token.
-    Match our tokens, if no match is possible, 
-    print an error and stop parsing.
+    A parse tree node without an attribute dictionary.
     """
+  __slots__ = ('node_type', 'children', 'token')
 
-  def __init__(self, lexer):
-    self.__lexer = lexer
+  def __init__(self, node_type=ParseType.FUNCTION, token=None):
+    self.node_type = node_type
+    self.children = []
+    self.token = token
 
-  def __next(self):
+  print = ParseTree.print
+  insert_left_leaf = ParseTree.insert_left_leaf
+
+
+class CompactLeaf:
+  """
+    A parse tree leaf. Leaves never have children, so they all share
+    one empty tuple instead of owning a list.
+    """
+  __slots__ = ('node_type', 'token')
+  children = ()
+
+  def __init__(self, node_type=ParseType.ATOMIC, token=None):
+    self.node_type = node_type
+    self.token = token
+
+  print = ParseTree.print
+
+
+class LazyBody:
+  """
+    A function body which has not been parsed yet, up to and including
+    its matching extinguish. Lexers which can skip over a block leave
+    the body's source text and starting position, to be lexed again by
+    the same kind of lexer. Other lexers leave the body's tokens.
+    transform, if set, is applied to the body once it is parsed.
+    """
+  node_type = ParseType.BODY
+  token = None
+  children = ()
+
+  def __init__(self, parser, compact=False, tokens=None, lexer=None,
+               text='', line=1, col=1):
+    self.parser = parser
+    self.compact = compact
+    self.tokens = tokens
+    self.lexer = lexer
+    self.text = text
+    self.line = line
+    self.col = col
+    self.transform = None
+
+  def parse(self):
+    """
+      Parse the body and return the BODY node.
+      """
+    if self.tokens is not None:
+      lexer = ReplayLexer(self.tokens)
+    else:
+      lexer = self.lexer(io.StringIO(self.text), self.line, self.col)
+    body = self.parser(lexer, self.compact).parse_body()
+    if self.transform is not None:
+      body = self.transform(body)
+    return body
+
+  def print(self, level=0):
+    print(level * '|  ' + 'BODY(lazy)')
+
+
+class ParserBase:
+  """
+    The token cursor and the top level rules shared by Parser and
+    IterativeParser. A subclass supplies the rules below the top
+    level, _body and _list among them. A rule may also be a generator
+    which yields the rules it wants to call, or finished nodes, and is
+    sent back their results; _run drives it.
+    """
+
+  def __init__(self, lexer, compact=False, lazy=False):
+    self._lexer = lexer
+    self._compact = compact
+    self._lazy = lazy
+
+    # node classes to build the tree from
+    if compact:
+      self._node = CompactNode
+      self._leaf = CompactLeaf
+    else:
+      self._node = ParseTree
+      self._leaf = ParseTree
+
+  def _next(self):
     """
         Advance the lexer.
         """
-    self.__lexer.next()
+    self._lexer.next()
 
-  def __has(self, t):
+  def _has(self, t):
     """
         Return true if t matches the current token.
         """
-    ct = self.__lexer.get_tok()
+    ct = self._lexer.get_tok()
     return ct.token == t
 
-  def __must_be(self, t):
+  def _must_be(self, t):
     """
         Return true if t matches the current token.
         Otherwise, we print an error message and
         exit.
         """
-    if self.__has(t):
+    if self._has(t):
       return True
 
     # print an error
-    ct = self.__lexer.get_tok()
+    ct = self._lexer.get_tok()
+    if ct.lexeme == "swarm":
+      self._swarm_name(ct)
     print(
       f"Parser error at line {ct.line}, column {ct.col}.\nReceived token {ct.token.name} expected {t.name}"
     )
     sys.exit(-1)
 
-  def __get_tok(self):
-    return self.__lexer.get_tok()
-
-    # print an error
-    ct = self.__lexer.get_tok()
+  def _swarm_name(self, tok):
+    """
+        Report swarm used as a name, which it was before swarm loops
+        made it a keyword.
+        """
     print(
-      f"Parser error at line {ct.line}, column {ct.col}.\nReceived token {ct.token.name} expected {ct.name}"
+      f"Parser error at line {tok.line}, column {tok.col}.\nswarm is a keyword and cannot be used as a name"
     )
     sys.exit(-1)
 
+  def _get_tok(self):
+    return self._lexer.get_tok()
+
+  def _run(self, rule):
+    """
+      Drive a rule generator to completion and return its result. A
+      rule which is not a generator is already its result.
+      """
+    if type(rule) is not GeneratorType:
+      return rule
+    stack = []
+    value = None
+    while True:
+      try:
+        sub = rule.send(value)
+      except StopIteration as done:
+        if not stack:
+          return done.value
+        rule = stack.pop()
+        value = done.value
+        continue
+      if type(sub) is GeneratorType:
+        stack.append(rule)
+        rule = sub
+        value = None
+      else:
+        value = sub
+
   def parse(self):
-    self.__next()
-    node = ParseTree(ParseType.PROGRAM, None)
-    while self.__has(Token.DRAGON):
-      node.children.append(self.__function())
-    self.__must_be(Token.END)
+    self._next()
+    node = self._node(ParseType.PROGRAM, None)
+    while self._has(Token.DRAGON):
+      node.children.append(self._run(self._function()))
+    self._must_be(Token.END)
     return node
 
-  ###########
-  # From here on down, everything is calc specific
-  ###########
+  def parse_functions(self, final=True):
+    """
+      Parse a run of functions cut out of a bigger program. Only the
+      final run is followed by END, though an earlier one may end the
+      program early as it does a serial parse. Returns the list of
+      FUNCTION nodes and whether the run ended at END.
+      """
+    self._next()
+    functions = []
+    while self._has(Token.DRAGON):
+      functions.append(self._run(self._function()))
+    if final or not self._has(Token.EOF):
+      self._must_be(Token.END)
+    return functions, self._has(Token.END)
+
+  def parse_body(self):
+    """
+      Parse a body recorded by a lazy parse, up to its extinguish.
+      """
+    self._next()
+    node = self._run(self._body())
+    self._must_be(Token.EXTINGUISH)
+    return node
 
-  ##print(self.__lexer.get_tok().token.name)
-  # Done
-  def __function(self):
-    self.__must_be(Token.DRAGON)
-    self.__next()
-    self.__must_be(Token.ID)
-    node = ParseTree(ParseType.FUNCTION, self.__get_tok())
-    self.__next()
-    param = self.__param_list()
-    self.__must_be(Token.FIRE)
-    self.__next()
-    body = self.__body()
-    self.__must_be(Token.EXTINGUISH)
-    self.__next()
+  def _skip_body(self):
+    """
+      Skip a body up to the extinguish which closes it, counting fire
+      and extinguish. The lexer jumps over it if it can, otherwise the
+      body's tokens are recorded.
+      """
+    if hasattr(self._lexer, 'skip_block'):
+      span = self._lexer.skip_block()
+      if span:
+        return LazyBody(type(self), self._compact, lexer=type(self._lexer),
+                        text=span[0], line=span[1], col=span[2])
+
+    tokens = []
+    depth = 1
+    while depth:
+      self._next()
+      tok = self._get_tok()
+      if tok.token == Token.FIRE:
+        depth += 1
+      elif tok.token == Token.EXTINGUISH:
+        depth -= 1
+      elif tok.token == Token.EOF:
+        self._must_be(Token.EXTINGUISH)
+      tokens.append(tok)
+    return LazyBody(type(self), self._compact, tokens)
+
+  def _function(self):
+    self._must_be(Token.DRAGON)
+    self._next()
+    self._must_be(Token.ID)
+    node = self._node(ParseType.FUNCTION, self._get_tok())
+    self._next()
+    param = self._param_list()
+    self._must_be(Token.FIRE)
+    if self._lazy:
+      body = self._skip_body()
+    else:
+      self._next()
+      body = yield self._body()
+      self._must_be(Token.EXTINGUISH)
+    self._next()
     node.children.append(param)
     node.children.append(body)
     return node
 
-  #DOne
-  def __param_list(self):
-    if not self.__has(Token.ID):
+  def _param_list(self):
+    if not self._has(Token.ID):
       return None
-    node = ParseTree(ParseType.PARAMS, self.__get_tok())
-    while self.__has(Token.ID):
-      node.children.append(ParseTree(ParseType.ATOMIC, self.__get_tok()))
-      self.__next()
-      if self.__has(Token.COMMA):
-        self.__next()
+    node = self._node(ParseType.PARAMS, self._get_tok())
+    while self._has(Token.ID):
+      node.children.append(self._leaf(ParseType.ATOMIC, self._get_tok()))
+      self._next()
+      if self._has(Token.COMMA):
+        self._next()
     return node
 
+  def _literal(self):
+    if self._has(Token.NUMBER) or self._must_be(Token.STRING):
+      node = self._leaf(ParseType.ATOMIC, self._get_tok())
+      self._next()
+      return node
+
+  def _call(self):
+    self._must_be(Token.HATCH)
+    self._next()
+    self._must_be(Token.ID)
+    node = self._node(ParseType.CALL, self._get_tok())
+    self._next()
+    self._must_be(Token.LBRACKET)
+    self._next()
+    if not self._has(Token.RBRACKET):
+      node.children.append((yield self._list()))
+    else:
+      node.children.append(None)
+    self._must_be(Token.RBRACKET)
+    self._next()
+    return node
+
+
+class Parser(ParserBase):
+  """
+    Parser state will follow the lexer state.
+    We consume the stream token by token.
+    Match our tokens, if no match is possible, 
+    print an error and stop parsing.
+    """
+
+  ###########
+  # From here on down, everything is calc specific
+  ###########
+
   #Done
-  def __body(self):
-    if self.__must_be(Token.LTHANS):
-      node = ParseTree(ParseType.BODY, self.__get_tok())
-      while self.__has(Token.LTHANS):
-        line = self.__line()
+  def _body(self):
+    if self._must_be(Token.LTHANS):
+      node = self._node(ParseType.BODY, self._get_tok())
+      while self._has(Token.LTHANS):
+        line = self._line()
         node.children.append(line)
       return node
 
   #Done
-  def __line(self):
-    self.__must_be(Token.LTHANS)
-    self.__next()
-    node = self.__command()
-    self.__must_be(Token.GTHANS)
-    self.__next()
+  def _line(self):
+    self._must_be(Token.LTHANS)
+    self._next()
+    node = self._command()
+    self._must_be(Token.GTHANS)
+    self._next()
     return node
 
   #Done
-  def __command(self):
-    if self.__has(Token.BIG) or self.__has(Token.SMALL):
-      return self.__create_var()
-    elif self.__has(Token.BURN):
-      return self.__loop()
-    elif self.__has(Token.CONSUME):
-      return self.__read()
-    elif self.__has(Token.SHOOT):
-      return self.__write()
-    elif self.__has(Token.PATH):
-      return self.__path()
-    elif self.__has(Token.HATCH):
-      return self.__call()
-    elif self.__has(Token.RETURN):
-      return self.__return()
+  def _command(self):
+    if self._has(Token.BIG) or self._has(Token.SMALL):
+      return self._create_var()
+    elif self._has(Token.BURN):
+      return self._loop()
+    elif self._has(Token.CONSUME):
+      return self._read()
+    elif self._has(Token.SHOOT):
+      return self._write()
+    elif self._has(Token.PATH):
+      return self._path()
+    elif self._has(Token.HATCH):
+      return self._run(self._call())
+    elif self._has(Token.RETURN):
+      return self._return()
     else:
-      return self.__reassign()
+      return self._reassign()
 
   #Done
-  def __return(self):
-    self.__must_be(Token.RETURN)
-    node = ParseTree(ParseType.RETURN, self.__get_tok())
-    self.__next()
-    node.children.append(self.__expr())
+  def _return(self):
+    self._must_be(Token.RETURN)
+    node = self._node(ParseType.RETURN, self._get_tok())
+    self._next()
+    node.children.append(self._expr())
     return node
 
   #done
-  def __create_var(self):
-    if self.__has(Token.SMALL) or self.__must_be(Token.BIG):
-      scope = self.__get_tok()
-      self.__next()
-      self.__must_be(Token.ID)
-      idNode = ParseTree(ParseType.ATOMIC, self.__get_tok())
-      self.__next()
-      if self.__has(Token.LPAREN):
-        node = ParseTree(ParseType.CREATEARRAY, scope)
+  def _create_var(self):
+    if self._has(Token.SMALL) or self._must_be(Token.BIG):
+      scope = self._get_tok()
+      self._next()
+      self._must_be(Token.ID)
+      idNode = self._leaf(ParseType.ATOMIC, self._get_tok())
+      self._next()
+      if self._has(Token.LPAREN):
+        node = self._node(ParseType.CREATEARRAY, scope)
         node.children.append(idNode)
-        self.__next()
-        node.children.append(self.__expr())
-        self.__must_be(Token.RPAREN)
-        self.__next()
-        self.__must_be(Token.DOLLAR)
-        self.__next()
+        self._next()
+        node.children.append(self._expr())
+        self._must_be(Token.RPAREN)
+        self._next()
+        self._must_be(Token.DOLLAR)
+        self._next()
         return node
       else:
-        node = ParseTree(ParseType.CREATEVAR, scope)
+        node = self._node(ParseType.CREATEVAR, scope)
         node.children.append(idNode)
-        if self.__has(Token.ASSIGN):
-          self.__next()
-          node.children.append(self.__expr())
+        if self._has(Token.ASSIGN):
+          self._next()
+          node.children.append(self._expr())
         else:
           node.children.append(None)
-        self.__must_be(Token.DOLLAR)
-        self.__next()
+        self._must_be(Token.DOLLAR)
+        self._next()
         return node
 
   #Done
-  def __reassign(self):
-    if self.__must_be(Token.ID):
-      node = ParseTree(ParseType.REASSIGN, self.__get_tok())
-      node.children.append(self.__ref())
-      if self.__has(Token.ASSIGN):
-        self.__next()
-        node.children.append(self.__expr())
+  def _reassign(self):
+    if self._must_be(Token.ID):
+      node = self._node(ParseType.REASSIGN, self._get_tok())
+      node.children.append(self._ref())
+      if self._has(Token.ASSIGN):
+        self._next()
+        node.children.append(self._expr())
       else:
         node.children.append(None)
-      self.__must_be(Token.DOLLAR)
-      self.__next()
+      self._must_be(Token.DOLLAR)
+      self._next()
       return node
 
-  def __write(self):
-    self.__must_be(Token.SHOOT)
-    node = ParseTree(ParseType.WRITE, self.__get_tok())
-    self.__next()
-    node.children.append(self.__list())
-    self.__must_be(Token.DOLLAR)
-    self.__next()
+  def _write(self):
+    self._must_be(Token.SHOOT)
+    node = self._node(ParseType.WRITE, self._get_tok())
+    self._next()
+    node.children.append(self._list())
+    self._must_be(Token.DOLLAR)
+    self._next()
     return node
 
   #Return list not a tree
   #Done
-  def __list(self):
-    if not self.__has(Token.ID) and self.__has(Token.STRING) and self.__has(
+  def _list(self):
+    if not self._has(Token.ID) and self._has(Token.STRING) and self._has(
         Token.NUMBER):
       return None
-    node = ParseTree(ParseType.LIST, "People")
-    while self.__has(Token.ID) or self.__has(Token.STRING) or self.__has(Token.NUMBER):
-      if self.__has(Token.ID):
-        node.children.append(self.__ref())
+    node = self._node(ParseType.LIST, "People")
+    while self._has(Token.ID) or self._has(Token.STRING) or self._has(Token.NUMBER):
+      if self._has(Token.ID):
+        node.children.append(self._ref())
       else:
-        node.children.append(ParseTree(ParseType.ATOMIC, self.__get_tok()))
-        self.__next()
-      if self.__has(Token.COMMA):
-        self.__next()
+        node.children.append(self._leaf(ParseType.ATOMIC, self._get_tok()))
+        self._next()
+      if self._has(Token.COMMA):
+        self._next()
     return node
 
   #Done
-  def __read(self):
-    self.__must_be(Token.CONSUME)
-    node = ParseTree(ParseType.READ, self.__get_tok())
-    self.__next()
-    node.children.append(self.__ref())
-    self.__must_be(Token.DOLLAR)
-    self.__next()
+  def _read(self):
+    self._must_be(Token.CONSUME)
+    node = self._node(ParseType.READ, self._get_tok())
+    self._next()
+    node.children.append(self._ref())
+    self._must_be(Token.DOLLAR)
+    self._next()
     return node
 
   #Done
-  def __loop(self):
-    self.__must_be(Token.BURN)
-    node = ParseTree(ParseType.LOOP, self.__get_tok())
-    self.__next()
-    node.children.append(self.__condition())
-    self.__must_be(Token.FIRE)
-    self.__next()
-    node.children.append(self.__body())
-    self.__must_be(Token.EXTINGUISH)
-    self.__next()
+  def _loop(self):
+    self._must_be(Token.BURN)
+    node = self._node(ParseType.LOOP, self._get_tok())
+    self._next()
+    if node.token.lexeme == "swarm" and not self._has(Token.ID):
+      self._swarm_name(node.token)
+    node.children.append(self._condition())
+    self._must_be(Token.FIRE)
+    self._next()
+    node.children.append(self._body())
+    self._must_be(Token.EXTINGUISH)
+    self._next()
     return node
 
   #Done
-  def __path(self):
-    self.__must_be(Token.PATH)
-    node = ParseTree(ParseType.PATH, self.__get_tok())
-
-    self.__next()
-    node.children.append(self.__condition())
-    self.__must_be(Token.HERE)
-    self.__next()
-    node.children.append(self.__body())
-    self.__must_be(Token.HERE)
-    self.__next()
-    if self.__has(Token.THERE):
-      self.__next()
-      node.children.append(self.__body())
-      self.__must_be(Token.THERE)
-      self.__next()
+  def _path(self):
+    self._must_be(Token.PATH)
+    node = self._node(ParseType.PATH, self._get_tok())
+
+    self._next()
+    node.children.append(self._condition())
+    self._must_be(Token.HERE)
+    self._next()
+    node.children.append(self._body())
+    self._must_be(Token.HERE)
+    self._next()
+    if self._has(Token.THERE):
+      self._next()
+      node.children.append(self._body())
+      self._must_be(Token.THERE)
+      self._next()
     else:
       node.children.append(None)
     return node
 
   #Done
-  def __condition(self):
-    node = self.__comparable()
-    if self.__has(Token.ALSO) or self.__has(Token.EITHER):
-      node2 = ParseTree(ParseType.CONDITION, self.__get_tok())
-      self.__next()
+  def _condition(self):
+    node = self._comparable()
+    if self._has(Token.ALSO) or self._has(Token.EITHER):
+      node2 = self._node(ParseType.CONDITION, self._get_tok())
+      self._next()
       node2.children.append(node)
-      node2.children.append(self.__condition())
+      node2.children.append(self._condition())
       node = node2
     return node
 
   #Done
-  def __comparable(self):
-    left = self.__expr()
-    if self.__has(Token.EQ) \
-    or self.__has(Token.NOT) \
-    or self.__has(Token.LT) \
-    or self.__has(Token.LTEQ) \
-    or self.__has(Token.GT)\
-    or self.__must_be(Token.__GTEQ):
-      node = ParseTree(ParseType.COMPARABLE, self.__get_tok())
-      self.__next()
+  def _comparable(self):
+    left = self._expr()
+    if self._has(Token.EQ) \
+    or self._has(Token.NOT) \
+    or self._has(Token.LT) \
+    or self._has(Token.LTEQ) \
+    or self._has(Token.GT)\
+    or self._must_be(Token.GTEQ):
+      node = self._node(ParseType.COMPARABLE, self._get_tok())
+      self._next()
     node.children.append(left)
-    node.children.append(self.__expr())
+    node.children.append(self._expr())
     return node
 
   #Done
-  def __expr(self):
-    node = self.__term()
-    expr2 = self.__expr2()
-    if expr2:
-      expr2.insert_left_leaf(node)
-      node = expr2
+  def _expr(self, min_prec=1):
+    """
+      Precedence climbing over the left associative binary operators.
+      Each operator loops at its own level, so a chain of any length
+      takes one pass and a fixed amount of stack.
+      """
+    node = self._factor()
+    op = BINARY_OPS.get(self._get_tok().token)
+    while op and op[0] >= min_prec:
+      node2 = self._node(op[1], self._get_tok())
+      self._next()
+      node2.children.append(node)
+      node2.children.append(self._expr(op[0] + 1))
+      node = node2
+      op = BINARY_OPS.get(self._get_tok().token)
     return node
 
   #Done
-  def __expr2(self):
-    if self.__has(Token.PLUS):
-      node = ParseTree(ParseType.ADD, self.__get_tok())
-      self.__next()
-      node.children.append(self.__term())
-      expr2 = self.__expr2()
-      if expr2:
-        expr2.insert_left_leaf(node)
-        node = expr2
+  def _factor(self):
+    """
+      Parse a run of right associative powers, folding it from the
+      right.
+      """
+    operands = [self._unary()]
+    ops = []
+    while self._has(Token.POW):
+      ops.append(self._node(ParseType.POW, self._get_tok()))
+      self._next()
+      operands.append(self._unary())
+
+    node = operands.pop()
+    while ops:
+      node2 = ops.pop()
+      node2.children.append(operands.pop())
+      node2.children.append(node)
+      node = node2
+    return node
+
+  #Done
+  def _unary(self):
+    if self._has(Token.MINUS):
+      node = self._node(ParseType.NEGATION, self._get_tok())
+      self._next()
+      node.children.append(self._exponent())
       return node
+    return self._exponent()
 
-    elif self.__has(Token.MINUS):
-      node = ParseTree(ParseType.SUB, self.__get_tok())
-      self.__next()
-      node.children.append(self.__term())
-      expr2 = self.__expr2()
-      if expr2:
-        expr2.insert_left_leaf(node)
-        node = expr2
+  #Done
+  def _exponent(self):
+    if self._has(Token.LCURLY):
+      self._next()
+      node = self._expr()
+      self._must_be(Token.RCURLY)
+      self._next()
       return node
+    elif self._has(Token.ID):
+      return self._ref()
+    elif self._has(Token.HATCH):
+      return self._run(self._call())
+    else:
+      return self._literal()
 
   #Done
-  def __term(self):
-    node = self.__factor()
-    term2 = self.__term2()
-    if term2:
-      term2.insert_left_leaf(node)
-      node = term2
+  def _ref(self):
+    self._must_be(Token.ID)
+    node = self._leaf(ParseType.ATOMIC, self._get_tok())
+    self._next()
+    if self._has(Token.LPAREN):
+      node2 = self._node(ParseType.INDEX, self._get_tok())
+      self._next()
+      node2.children.append(self._expr())
+      if self._must_be(Token.RPAREN):
+        self._next()
+        node2.insert_left_leaf(node)
+        node = node2
     return node
 
-  #Done
-  def __term2(self):
-    if self.__has(Token.TIMES):
-      node = ParseTree(ParseType.MUL, self.__get_tok())
-      self.__next()
-      node.children.append(self.__factor())
-      expr2 = self.__term2()
-      if expr2:
-        expr2.insert_left_leaf(node)
-        node = expr2
-      return node
 
-    #Done
-    elif self.__has(Token.DIVIDE):
-      node = ParseTree(ParseType.DIV, self.__get_tok())
-      self.__next()
-      node.children.append(self.__factor())
-      expr2 = self.__term2()
-      if expr2:
-        expr2.insert_left_leaf(node)
-        node = expr2
-      return node
+class IterativeParser(ParserBase):
+  """
+    Builds the same tree as Parser without using the Python stack for
+    nesting. Each rule that nests is a generator that yields the rule
+    it wants to call and is sent back that rule's result. The driver
+    keeps the suspended rules on a list, so nesting is limited only by
+    memory. Yielding a finished node sends it straight back, which lets
+    plain atoms skip the driver.
+    """
 
-  #Done
-  def __factor(self):
-    if self.__has(Token.MINUS):
-      node = ParseTree(ParseType.NEGATION, self.__get_tok())
-      self.__next()
-      node.children.append(self.__exponent())
-      f2 = self.__factor2()
-      if f2:
-        f2.insert_left_leaf(node)
-        node = f2
-      return node
+  def _body(self):
+    """
+      Parse the lines of a body, with each line's command inlined.
+      """
+    self._must_be(Token.LTHANS)
+    node = self._node(ParseType.BODY, self._get_tok())
+    while self._has(Token.LTHANS):
+      self._next()
+      node.children.append((yield self._command()))
+      self._must_be(Token.GTHANS)
+      self._next()
+    return node
+
+  def _command(self):
+    """
+      Pick the rule for the command. This returns the rule rather
+      than running it, so the body hands it straight to the driver.
+      """
+    if self._has(Token.BIG) or self._has(Token.SMALL):
+      return self._create_var()
+    elif self._has(Token.BURN):
+      return self._loop()
+    elif self._has(Token.CONSUME):
+      return self._read()
+    elif self._has(Token.SHOOT):
+      return self._write()
+    elif self._has(Token.PATH):
+      return self._path()
+    elif self._has(Token.HATCH):
+      return self._call()
+    elif self._has(Token.RETURN):
+      return self._return()
     else:
-      node = self.__exponent()
-      f2 = self.__factor2()
-      if f2:
-        f2.insert_left_leaf(node)
-        node = f2
-      return node
+      return self._reassign()
 
-  #Done
-  def __factor2(self):
-    if self.__has(Token.POW):
-      node = ParseTree(ParseType.POW, self.__get_tok())
-      self.__next()
-      node.children.append(self.__factor())
+  def _return(self):
+    self._must_be(Token.RETURN)
+    node = self._node(ParseType.RETURN, self._get_tok())
+    self._next()
+    node.children.append((yield self._expr()))
+    return node
+
+  def _create_var(self):
+    if self._has(Token.SMALL) or self._must_be(Token.BIG):
+      scope = self._get_tok()
+      self._next()
+      self._must_be(Token.ID)
+      idNode = self._leaf(ParseType.ATOMIC, self._get_tok())
+      self._next()
+      if self._has(Token.LPAREN):
+        node = self._node(ParseType.CREATEARRAY, scope)
+        node.children.append(idNode)
+        self._next()
+        node.children.append((yield self._expr()))
+        self._must_be(Token.RPAREN)
+        self._next()
+        self._must_be(Token.DOLLAR)
+        self._next()
+        return node
+      else:
+        node = self._node(ParseType.CREATEVAR, scope)
+        node.children.append(idNode)
+        if self._has(Token.ASSIGN):
+          self._next()
+          node.children.append((yield self._expr()))
+        else:
+          node.children.append(None)
+        self._must_be(Token.DOLLAR)
+        self._next()
+        return node
+
+  def _reassign(self):
+    if self._must_be(Token.ID):
+      node = self._node(ParseType.REASSIGN, self._get_tok())
+      node.children.append((yield self._ref()))
+      if self._has(Token.ASSIGN):
+        self._next()
+        node.children.append((yield self._expr()))
+      else:
+        node.children.append(None)
+      self._must_be(Token.DOLLAR)
+      self._next()
       return node
-    else:
+
+  def _write(self):
+    self._must_be(Token.SHOOT)
+    node = self._node(ParseType.WRITE, self._get_tok())
+    self._next()
+    node.children.append((yield self._list()))
+    self._must_be(Token.DOLLAR)
+    self._next()
+    return node
+
+  def _list(self):
+    if not self._has(Token.ID) and self._has(Token.STRING) and self._has(
+        Token.NUMBER):
       return None
+    node = self._node(ParseType.LIST, "People")
+    while self._has(Token.ID) or self._has(Token.STRING) or self._has(Token.NUMBER):
+      if self._has(Token.ID):
+        node.children.append((yield self._ref()))
+      else:
+        node.children.append(self._leaf(ParseType.ATOMIC, self._get_tok()))
+        self._next()
+      if self._has(Token.COMMA):
+        self._next()
+    return node
 
-  #Done
-  def __exponent(self):
-    if self.__has(Token.LCURLY):
-      self.__next()
-      node = self.__expr()
-      self.__must_be(Token.RCURLY)
-      self.__next()
-      return node
-    elif self.__has(Token.ID):
-      return self.__ref()
-    elif self.__has(Token.HATCH):
-      return self.__call()
+  def _read(self):
+    self._must_be(Token.CONSUME)
+    node = self._node(ParseType.READ, self._get_tok())
+    self._next()
+    node.children.append((yield self._ref()))
+    self._must_be(Token.DOLLAR)
+    self._next()
+    return node
+
+  def _loop(self):
+    self._must_be(Token.BURN)
+    node = self._node(ParseType.LOOP, self._get_tok())
+    self._next()
+    if node.token.lexeme == "swarm" and not self._has(Token.ID):
+      self._swarm_name(node.token)
+    node.children.append((yield self._condition()))
+    self._must_be(Token.FIRE)
+    self._next()
+    node.children.append((yield self._body()))
+    self._must_be(Token.EXTINGUISH)
+    self._next()
+    return node
+
+  def _path(self):
+    self._must_be(Token.PATH)
+    node = self._node(ParseType.PATH, self._get_tok())
+
+    self._next()
+    node.children.append((yield self._condition()))
+    self._must_be(Token.HERE)
+    self._next()
+    node.children.append((yield self._body()))
+    self._must_be(Token.HERE)
+    self._next()
+    if self._has(Token.THERE):
+      self._next()
+      node.children.append((yield self._body()))
+      self._must_be(Token.THERE)
+      self._next()
     else:
-      return self.__literal()
+      node.children.append(None)
+    return node
 
-  #Done
-  def __ref(self):
-    self.__must_be(Token.ID)
-    node = ParseTree(ParseType.ATOMIC, self.__get_tok())
-    self.__next()
-    if self.__has(Token.LPAREN):
-      node2 = ParseTree(ParseType.INDEX, self.__get_tok())
-      self.__next()
-      node2.children.append(self.__expr())
-      if self.__must_be(Token.RPAREN):
-        self.__next()
-        node2.insert_left_leaf(node)
-        node = node2
+  def _condition(self):
+    """
+      Parse a chain of also/either, linking it from the right as the
+      recursive rule does.
+      """
+    nodes = [(yield self._comparable())]
+    links = []
+    while self._has(Token.ALSO) or self._has(Token.EITHER):
+      links.append(self._node(ParseType.CONDITION, self._get_tok()))
+      self._next()
+      nodes.append((yield self._comparable()))
+
+    node = nodes.pop()
+    while links:
+      node2 = links.pop()
+      node2.children.append(nodes.pop())
+      node2.children.append(node)
+      node = node2
     return node
 
-  #Done
-  def __literal(self):
-    if self.__has(Token.NUMBER) or self.__must_be(Token.STRING):
-      node = ParseTree(ParseType.ATOMIC, self.__get_tok())
-      self.__next()
-      return node
+  def _comparable(self):
+    left = yield self._expr()
+    if self._has(Token.EQ) \
+    or self._has(Token.NOT) \
+    or self._has(Token.LT) \
+    or self._has(Token.LTEQ) \
+    or self._has(Token.GT)\
+    or self._must_be(Token.GTEQ):
+      node = self._node(ParseType.COMPARABLE, self._get_tok())
+      self._next()
+    node.children.append(left)
+    node.children.append((yield self._expr()))
+    return node
+
+  def _expr(self, min_prec=1):
+    node = yield self._unary()
+    if self._has(Token.POW):
+      node = yield self._powers(node)
+    op = BINARY_OPS.get(self._get_tok().token)
+    while op and op[0] >= min_prec:
+      node2 = self._node(op[1], self._get_tok())
+      self._next()
+      node2.children.append(node)
+      node2.children.append((yield self._expr(op[0] + 1)))
+      node = node2
+      op = BINARY_OPS.get(self._get_tok().token)
+    return node
+
+  def _powers(self, first):
+    """
+      Parse the rest of a run of powers after its first operand,
+      folding it from the right.
+      """
+    operands = [first]
+    ops = []
+    while self._has(Token.POW):
+      ops.append(self._node(ParseType.POW, self._get_tok()))
+      self._next()
+      operands.append((yield self._unary()))
+
+    node = operands.pop()
+    while ops:
+      node2 = ops.pop()
+      node2.children.append(operands.pop())
+      node2.children.append(node)
+      node = node2
+    return node
+
+  def _unary(self):
+    if self._has(Token.MINUS):
+      return self._negation()
+    return self._exponent()
 
-  def __call(self):
-    self.__must_be(Token.HATCH)
-    self.__next()
-    self.__must_be(Token.ID)
-    node = ParseTree(ParseType.CALL, self.__get_tok())
-    self.__next()
-    self.__must_be(Token.LBRACKET)
-    self.__next()
-    if not self.__has(Token.RBRACKET):
-      node.children.append(self.__list())
+  def _negation(self):
+    node = self._node(ParseType.NEGATION, self._get_tok())
+    self._next()
+    node.children.append((yield self._exponent()))
+    return node
+
+  def _exponent(self):
+    if self._has(Token.LCURLY):
+      return self._group()
+    elif self._has(Token.ID):
+      return self._ref()
+    elif self._has(Token.HATCH):
+      return self._call()
     else:
-      node.children.append(None)
-    self.__must_be(Token.RBRACKET)
-    self.__next()
+      return self._literal()
+
+  def _group(self):
+    self._next()
+    node = yield self._expr()
+    self._must_be(Token.RCURLY)
+    self._next()
+    return node
+
+  def _ref(self):
+    self._must_be(Token.ID)
+    node = self._leaf(ParseType.ATOMIC, self._get_tok())
+    self._next()
+    if self._has(Token.LPAREN):
+      return self._index(node)
+    return node
+
+  def _index(self, leaf):
+    node = self._node(ParseType.INDEX, self._get_tok())
+    self._next()
+    node.children.append((yield self._expr()))
+    if self._must_be(Token.RPAREN):
+      self._next()
+      node.insert_left_leaf(leaf)
     return node
 
 
@@ -0,0 +1,163 @@
+"""
+A profiler for DragonsRCool programs.
+
+With --profile the tree and closure engines report every dragon call
+and every statement they run to a Profiler. For each dragon it counts
+the calls and the time spent in them, inclusive of the dragons they
+call and exclusive of it. For each source line it counts the
+statements run there and the time they took, inclusive of the
+statements and calls inside them and exclusive of it. The time of a
+recursive dragon or line is counted once, by its outermost run.
+
+Engines only route calls and statements through the profiler when
+one is given, so running without --profile costs nothing. The report
+is printed sorted by exclusive time, or written as JSON.
+"""
+import json
+import time
+
+# the lines printed in the report, the JSON holds them all
+REPORT_LINES = 20
+
+
+class Entry:
+  """
+    The counts of one dragon or one line.
+    """
+  __slots__ = ('count', 'inclusive', 'exclusive', 'active')
+
+  def __init__(self):
+    self.count = 0
+    self.inclusive = 0.0
+    self.exclusive = 0.0
+
+    # the runs of it which have not finished
+    self.active = 0
+
+
+class Profiler:
+  """
+    Counts the calls of dragons and the statements of lines. enter and
+    leave bracket a call, start and stop a statement.
+    """
+
+  def __init__(self, clock=time.perf_counter):
+    self.clock = clock
+    self.functions = {}
+    self.lines = {}
+
+    # the running calls and statements: entry, start, time of the
+    # calls or statements inside them
+    self.calls = []
+    self.statements = []
+
+  def __open(self, entries, key, stack):
+    e = entries.get(key)
+    if e is None:
+      e = entries[key] = Entry()
+    e.count += 1
+    e.active += 1
+    stack.append([e, self.clock(), 0.0])
+
+  def __close(self, stack):
+    e, start, inner = stack.pop()
+    elapsed = self.clock() - start
+    e.exclusive += elapsed - inner
+    e.active -= 1
+    if not e.active:
+      e.inclusive += elapsed
+    if stack:
+      stack[-1][2] += elapsed
+
+  def enter(self, name):
+    self.__open(self.functions, name, self.calls)
+
+  def leave(self):
+    self.__close(self.calls)
+
+  def start(self, line):
+    self.__open(self.lines, line, self.statements)
+
+  def stop(self):
+    self.__close(self.statements)
+
+  def finish(self):
+    """
+      End the calls and statements still running, as when the program
+      stops with an error.
+      """
+    while self.statements:
+      self.stop()
+    while self.calls:
+      self.leave()
+
+  def function(self, name, fn):
+    """
+      Wrap fn, which runs the dragon name, to count its calls.
+      """
+    def call(*args):
+      self.enter(name)
+      try:
+        return fn(*args)
+      finally:
+        self.leave()
+    return call
+
+  def statement(self, line, fn):
+    """
+      Wrap fn, which runs a statement on line, to count its runs.
+      """
+    def run(*args):
+      self.start(line)
+      try:
+        return fn(*args)
+      finally:
+        self.stop()
+    return run
+
+  def to_json(self):
+    """
+      Return the counts as a dict of plain values.
+      """
+    self.finish()
+    functions = [{
+      'name': name,
+      'calls': e.count,
+      'inclusive': e.inclusive,
+      'exclusive': e.exclusive
+    } for name, e in self.functions.items()]
+    lines = [{
+      'line': line,
+      'count': e.count,
+      'inclusive': e.inclusive,
+      'exclusive': e.exclusive
+    } for line, e in self.lines.items()]
+    functions.sort(key=lambda f: -f['exclusive'])
+    lines.sort(key=lambda l: -l['exclusive'])
+    return {'functions': functions, 'lines': lines}
+
+  def write_json(self, path):
+    with open(path, 'w') as f:
+      json.dump(self.to_json(), f, indent=2)
+      f.write('\n')
+
+  def report(self, out, source=None):
+    """
+      Print the dragons, then the slowest lines with their text if the
+      source is given, sorted by exclusive time.
+      """
+    profile = self.to_json()
+    text = source.splitlines() if source is not None else []
+    print(f"{'dragon':<20} {'calls':>10} {'inclusive':>12} {'exclusive':>12}",
+          file=out)
+    for f in profile['functions']:
+      print(f"{f['name']:<20} {f['calls']:>10} {f['inclusive']:>12.6f} "
+            f"{f['exclusive']:>12.6f}", file=out)
+    print(file=out)
+    print(f"{'line':>6} {'runs':>10} {'inclusive':>12} {'exclusive':>12}  source",
+          file=out)
+    for l in profile['lines'][:REPORT_LINES]:
+      line = l['line']
+      src = text[line - 1].strip() if 0 < line <= len(text) else ''
+      print(f"{line:>6} {l['count']:>10} {l['inclusive']:>12.6f} "
+            f"{l['exclusive']:>12.6f}  {src[:40]}", file=out)
@@ -0,0 +1,129 @@
+"""
+Static scope resolution for the DragonsRCool engines.
+
+Every name a function writes with small, consume or reassignment,
+every parameter and every temporary of the optimizer gets a fixed
+slot in that function's frame. Every global name, the functions and
+every big variable, gets a slot in the program's GlobalTable. Engines
+then read and write variables by index.
+
+A frame slot which has not been written yet holds UNSET, and a read
+of it falls back to the global slot of the same name, just as RefEnv
+chains the call's names onto the globals. A global slot which was
+never bound holds UNDEFINED.
+"""
+from Parser import ParseType
+
+# the value of a frame slot which has not been written
+UNSET = object()
+
+# the value of a global slot which is not bound
+UNDEFINED = object()
+
+
+def local_names(t, names):
+  """
+    Collect the names written to the call's variables anywhere in t.
+    """
+  stack = [t]
+  while stack:
+    t = stack.pop()
+    if t is None or isinstance(t, str):
+      continue
+    if t.node_type == ParseType.CREATEVAR or t.node_type == ParseType.CREATEARRAY:
+      if t.token.lexeme == "small":
+        names.append(t.children[0].token.lexeme)
+    elif t.node_type == ParseType.REASSIGN or t.node_type == ParseType.READ:
+      if t.children[0].node_type == ParseType.ATOMIC:
+        names.append(t.children[0].token.lexeme)
+    elif t.node_type == ParseType.SAVE:
+      names.append(t.token.lexeme)
+    stack.extend(reversed(t.children))
+  return names
+
+
+class Scope:
+  """
+    The frame slots of one function. params is its parameter list,
+    None if it has none, and body its parsed body.
+    """
+
+  def __init__(self, params, body):
+    self.names = []
+    self.__ids = {}
+    for name in local_names(body, list(params or [])):
+      self.slot(name)
+    self.param_slots = [self.__ids[p] for p in params or []]
+
+  def slot(self, name):
+    if name not in self.__ids:
+      self.__ids[name] = len(self.names)
+      self.names.append(name)
+    return self.__ids[name]
+
+  def has(self, name):
+    return name in self.__ids
+
+  def new_frame(self):
+    """
+      Return the slots of a new call, all UNSET.
+      """
+    return [UNSET] * len(self.names)
+
+
+class GlobalTable:
+  """
+    The global slots of a program. values grows as slots are handed
+    out, so code compiled later may resolve names nobody has bound.
+    """
+
+  def __init__(self):
+    self.names = []
+    self.values = []
+    self.__ids = {}
+
+  def slot(self, name):
+    if name not in self.__ids:
+      self.__ids[name] = len(self.names)
+      self.names.append(name)
+      self.values.append(UNDEFINED)
+    return self.__ids[name]
+
+  def get(self, name, default=None):
+    """
+      The value bound to name, or default.
+      """
+    if name not in self.__ids:
+      return default
+    v = self.values[self.__ids[name]]
+    return default if v is UNDEFINED else v
+
+  def __setitem__(self, name, value):
+    self.values[self.slot(name)] = value
+
+
+def tail_calls(body):
+  """
+    Find the calls in tail position in a function body: a call
+    statement or a return of a call which is the last statement of the
+    body, or of a branch of a path which is. Nothing the caller does
+    after such a call can change anything but its value. Returns a
+    dict from each call to whether the callee's value becomes the
+    caller's, which is not so for a call statement inside a path.
+    """
+  calls = {}
+  stack = [(body, True)]
+  while stack:
+    t, top = stack.pop()
+    if t is None or not t.children:
+      continue
+    last = t.children[-1]
+    if last.node_type == ParseType.CALL:
+      calls[last] = top
+    elif last.node_type == ParseType.RETURN:
+      if last.children[0] is not None and last.children[0].node_type == ParseType.CALL:
+        calls[last.children[0]] = True
+    elif last.node_type == ParseType.PATH:
+      stack.append((last.children[1], False))
+      stack.append((last.children[2], False))
+  return calls
@@ -0,0 +1,684 @@
+"""
+Runtime support shared by the DragonsRCool engines.
+"""
+import io
+import os
+import re
+import sys
+import stat
+import operator
+import numpy as np
+
+# the range of integers kept in int64 storage
+INT_MIN = -2**63
+INT_MAX = 2**63 - 1
+
+# integers up to this size turn into floats exactly
+FLOAT_INT = 2**53
+
+# the elements of an array turned into Python values at once when it
+# is written, and the most text written at once
+ELEMENT_CHUNK = 4096
+WRITE_CHUNK = 8192
+
+# the size output is written in when it is not line buffered, and
+# input is read in from a file
+OUTPUT_BLOCK = 64 * 1024
+INPUT_BLOCK = 64 * 1024
+
+# the int and float literals of Python, and the signs before a number
+DIGITS = r'\d(?:_?\d)*'
+INT_LITERAL = re.compile(r'0[xX](?:_?[0-9a-fA-F])+|0[oO](?:_?[0-7])+|'
+                         r'0[bB](?:_?[01])+|0(?:_?0)*|[1-9](?:_?\d)*', re.ASCII)
+FLOAT_LITERAL = re.compile(rf'(?:(?:{DIGITS})?\.{DIGITS}|{DIGITS}\.)(?:[eE][+-]?{DIGITS})?|'
+                           rf'{DIGITS}[eE][+-]?{DIGITS}', re.ASCII)
+SIGNS = re.compile(r'[ \t]*((?:[+-][ \t]*)*)')
+
+# the lines consume reads, see read_value
+input_lines = None
+
+
+class LineReader:
+  """
+    The lines of a text stream. A regular file is read a block at a
+    time and split into lines in bulk. A terminal or a pipe, whose
+    writer may be waiting for the program's output, is read a line at
+    a time when one is asked for.
+    """
+
+  def __init__(self, stream):
+    self.stream = stream
+    self.lines = []
+    self.pos = 0
+    self.partial = ''
+    try:
+      self.bulk = stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+      self.bulk = False
+
+  def readline(self):
+    """
+      Return the next line without its newline, raising EOFError at
+      the end just as input() does.
+      """
+    if not self.bulk:
+      line = self.stream.readline()
+      if not line:
+        raise EOFError("EOF when reading a line")
+      return line[:-1] if line[-1] == '\n' else line
+    while self.pos == len(self.lines):
+      text = self.stream.read(INPUT_BLOCK)
+      if not text:
+        if not self.partial:
+          raise EOFError("EOF when reading a line")
+        text = '\n'
+      self.lines = (self.partial + text).split('\n')
+      self.partial = self.lines.pop()
+      self.pos = 0
+    self.pos += 1
+    return self.lines[self.pos - 1]
+
+
+def parse_value(text):
+  """
+    Return the number text is written as, as a Python int or float
+    literal with any signs in front, or else text itself.
+    """
+  try:
+    if text.isdecimal() and text.isascii() and (text[0] != '0' or not text.strip('0')):
+      return int(text)
+    m = SIGNS.match(text)
+    number = text[m.end():].rstrip(' \t\r\f')
+    if INT_LITERAL.fullmatch(number):
+      v = int(number, 0)
+    elif FLOAT_LITERAL.fullmatch(number):
+      v = float(number)
+    else:
+      return text
+  except ValueError:
+    # an int too long to convert
+    return text
+  return -v if m.group(1).count('-') % 2 else v
+
+
+def read_value():
+  """
+    Read one line of input. A number is stored as an int or a float,
+    everything else is kept as a string.
+    """
+  global input_lines
+  # whatever was shot is seen before the program waits
+  sys.stdout.flush()
+  if input_lines is None or input_lines.stream is not sys.stdin:
+    input_lines = LineReader(sys.stdin)
+  return parse_value(input_lines.readline())
+
+
+def unwrap(v):
+  return v.objects() if type(v) is DragonArray else v
+
+
+def binary(op):
+  def method(self, other):
+    return op(self.objects(), unwrap(other))
+  return method
+
+
+def reflected(op):
+  def method(self, other):
+    return op(unwrap(other), self.objects())
+  return method
+
+
+def typed_operand(v, n):
+  """
+    The numbers of v, an operand of an operation on arrays of n
+    elements, if the operation may work on its NumPy storage: an array
+    of ints or floats with every element set, or an int or float.
+    None otherwise.
+    """
+  t = type(v)
+  if t is DragonArray:
+    if (v.kind is int or v.kind is float) and len(v.set) == n and v.set.all():
+      return v.data
+    return None
+  elif t is int:
+    return v if INT_MIN <= v <= INT_MAX else None
+  elif t is float:
+    return v
+  return None
+
+
+def magnitude(x):
+  """
+    The largest absolute value of an int operand.
+    """
+  if type(x) is int:
+    return abs(x)
+  return max(-int(x.min()), int(x.max()))
+
+
+def is_float(x):
+  return type(x) is float or (type(x) is not int and x.dtype == np.float64)
+
+
+def typed_arithmetic(op, a, b):
+  """
+    op applied to the typed operands a and b, as a NumPy array, or None
+    if the result could differ from the one computed element by element
+    on Python numbers.
+    """
+  fa = is_float(a)
+  fb = is_float(b)
+  if op is operator.pow:
+    # only whole powers of ints are sure to be exact and not to fail
+    if fa or fb or (b < 0 if type(b) is int else b.min() < 0):
+      return None
+    base = magnitude(a)
+    exp = magnitude(b)
+    if base > 1 and ((base.bit_length() - 1) * exp >= 63 or base**exp > INT_MAX):
+      return None
+  elif not fa and not fb:
+    # ints stay exact while the result fits in 64 bits
+    ma = magnitude(a)
+    mb = magnitude(b)
+    if op is operator.truediv:
+      if ma > FLOAT_INT or mb > FLOAT_INT:
+        return None
+    elif op is operator.mul:
+      if ma * mb > INT_MAX:
+        return None
+    elif ma + mb > INT_MAX:
+      return None
+  elif (not fa and magnitude(a) > FLOAT_INT) or (not fb and magnitude(b) > FLOAT_INT):
+    return None
+
+  # Python raises where NumPy would divide by zero
+  if op is operator.truediv and np.any(b == 0):
+    return None
+  with np.errstate(all='ignore'):
+    return op(a, b)
+
+
+def arithmetic(op):
+  """
+    The method applying op to an array and other. Arrays of numbers
+    are computed on in their NumPy storage whenever that gives the
+    same numbers, everything else element by element.
+    """
+  def method(self, other):
+    n = len(self)
+    a = typed_operand(self, n)
+    if n and a is not None:
+      b = typed_operand(other, n)
+      if b is not None:
+        result = typed_arithmetic(op, a, b)
+        if result is not None:
+          return typed_array(result)
+    return object_array(op(self.objects(), unwrap(other)))
+  return method
+
+
+def reflected_arithmetic(op):
+  def method(self, other):
+    n = len(self)
+    a = typed_operand(self, n)
+    if n and a is not None:
+      b = typed_operand(other, n)
+      if b is not None:
+        result = typed_arithmetic(op, b, a)
+        if result is not None:
+          return typed_array(result)
+    return object_array(op(unwrap(other), self.objects()))
+  return method
+
+
+class DragonArray:
+  """
+    An array of the program. Its elements start out unset, which reads
+    as None. While only Python ints that fit in 64 bits, or only
+    floats, are stored, they are kept in a typed NumPy array next to a
+    mask of the elements which are set. Storing anything else turns
+    the storage into the object array the interpreter used to create,
+    holding the same values, and it stays that way.
+
+    Elements read back as the Python values stored, and the array
+    prints, compares and computes exactly as the object array would.
+    """
+  __slots__ = ('data', 'set', 'kind')
+
+  # leave binary operators with NumPy arrays to the methods below
+  __array_ufunc__ = None
+
+  def __init__(self, size):
+    try:
+      n = operator.index(size)
+    except TypeError:
+      # fails just as the interpreter's list of Nones did
+      n = len([None] * size)
+    n = max(n, 0)
+    self.kind = None
+    self.data = None
+    self.set = np.zeros(n, dtype=bool)
+
+  def objects(self):
+    """
+      Return the object array holding the elements.
+      """
+    if self.kind is object:
+      return self.data
+    if not len(self.set):
+      # the interpreter's array of no Nones is a float array
+      return np.array([])
+    obj = np.empty(len(self.set), dtype=object)
+    if self.data is not None:
+      values = np.empty(np.count_nonzero(self.set), dtype=object)
+      values[:] = self.data[self.set].tolist()
+      obj[self.set] = values
+    return obj
+
+  def __to_objects(self):
+    self.data = self.objects()
+    self.set = None
+    self.kind = object
+
+  def __getitem__(self, i):
+    if self.kind is object:
+      return self.data[i]
+    if type(i) is int or isinstance(i, np.integer):
+      if self.set[i]:
+        return self.data[i].item()
+      return None
+    # anything but an element may be a view into the array
+    self.__to_objects()
+    return self.data[i]
+
+  def __setitem__(self, i, value):
+    kind = self.kind
+    if kind is not object and (type(i) is int or isinstance(i, np.integer)):
+      t = type(value)
+      if t is int and kind is not float and INT_MIN <= value <= INT_MAX:
+        if kind is None:
+          self.data = np.zeros(len(self.set), dtype=np.int64)
+          self.kind = int
+        self.data[i] = value
+        self.set[i] = True
+        return
+      elif t is float and kind is not int:
+        if kind is None:
+          self.data = np.zeros(len(self.set), dtype=np.float64)
+          self.kind = float
+        self.data[i] = value
+        self.set[i] = True
+        return
+    if kind is not object:
+      self.__to_objects()
+    if type(value) is DragonArray and not (type(i) is int or isinstance(i, np.integer)):
+      # spread over the elements indexed, as the object array would be
+      value = value.objects()
+    self.data[i] = value
+
+  def __len__(self):
+    return len(self.set) if self.kind is not object else len(self.data)
+
+  def __iter__(self):
+    return iter(self.objects())
+
+  def __str__(self):
+    return ''.join(self.text())
+
+  def text(self):
+    """
+      Yield the text of the array in chunks, exactly as NumPy prints
+      the object array, turning only the elements it shows into Python
+      values a chunk at a time.
+      """
+    n = len(self)
+    opts = np.get_printoptions()
+    edge = opts['edgeitems']
+    if n > opts['threshold'] and 2 * edge < n:
+      shown = ((0, edge), (n - edge, n))
+    else:
+      shown = ((0, n),)
+    if not n or opts['legacy'] is not False or opts['formatter'] is not None \
+       or (self.kind is object and any(
+         isinstance(o, (np.ndarray, DragonArray))
+         for i, j in shown for o in self.data[i:j])):
+      # nested arrays print over several lines
+      yield str(self.objects())
+      return
+
+    # wrapped as NumPy wraps, the lines after the first indented by one
+    width = opts['linewidth'] - 1
+    done = []
+    size = 0
+    line = ' '
+    first = True
+    for k, word in enumerate(self.__words(shown)):
+      if k:
+        line += ' '
+      if len(line) + len(word) > width and len(line) > 1:
+        done.append(line.rstrip() + '\n')
+        size += len(done[-1])
+        line = ' '
+      line += word
+      if size >= WRITE_CHUNK:
+        text = ''.join(done)
+        yield '[' + text[1:] if first else text
+        done = []
+        size = 0
+        first = False
+    text = ''.join(done) + line + ']'
+    yield '[' + text[1:] if first else text
+
+  def __words(self, shown):
+    """
+      The text of each element in the ranges shown, with ... between
+      them.
+      """
+    for r, (i, j) in enumerate(shown):
+      if r:
+        yield '...'
+      for k in range(i, j, ELEMENT_CHUNK):
+        end = min(k + ELEMENT_CHUNK, j)
+        if self.kind is object:
+          values = self.data[k:end].tolist()
+        elif self.data is None:
+          values = [None] * (end - k)
+        else:
+          values = [v if m else None for v, m in
+                    zip(self.data[k:end].tolist(), self.set[k:end].tolist())]
+        for v in values:
+          # as NumPy formats an element of an object array
+          yield f'list({v!r})' if type(v) is list else repr(v)
+
+  def __repr__(self):
+    return repr(self.objects())
+
+  def __bool__(self):
+    return bool(self.objects())
+
+  def __neg__(self):
+    a = typed_operand(self, len(self))
+    if len(self) and a is not None and (self.kind is float or a.min() > INT_MIN):
+      return typed_array(-a)
+    return object_array(-self.objects())
+
+  def has_zero(self):
+    """
+      Whether dividing by the array divides by 0.
+      """
+    if self.kind is object:
+      return any(is_zero(v) for v in self.data)
+    if self.data is None:
+      return False
+    return bool(np.any(self.data[self.set] == 0))
+
+  __add__ = arithmetic(operator.add)
+  __radd__ = reflected_arithmetic(operator.add)
+  __sub__ = arithmetic(operator.sub)
+  __rsub__ = reflected_arithmetic(operator.sub)
+  __mul__ = arithmetic(operator.mul)
+  __rmul__ = reflected_arithmetic(operator.mul)
+  __truediv__ = arithmetic(operator.truediv)
+  __rtruediv__ = reflected_arithmetic(operator.truediv)
+  __pow__ = arithmetic(operator.pow)
+  __rpow__ = reflected_arithmetic(operator.pow)
+  __eq__ = binary(operator.eq)
+  __ne__ = binary(operator.ne)
+  __lt__ = binary(operator.lt)
+  __le__ = binary(operator.le)
+  __gt__ = binary(operator.gt)
+  __ge__ = binary(operator.ge)
+  __hash__ = None
+
+
+def new_array(size):
+  """
+    Create an array of size unset elements.
+    """
+  return DragonArray(size)
+
+
+def typed_array(data):
+  """
+    An array holding every element of data, an int64 or float64 array.
+    """
+  a = DragonArray(0)
+  a.data = data
+  a.set = np.ones(len(data), dtype=bool)
+  a.kind = float if data.dtype == np.float64 else int
+  return a
+
+
+def object_array(data):
+  """
+    An array holding the elements of data, the result of an operation
+    on object arrays.
+    """
+  if type(data) is not np.ndarray:
+    return data
+  a = DragonArray(0)
+  a.data = data
+  a.set = None
+  a.kind = object
+  return a
+
+
+def is_zero(v):
+  """
+    Whether dividing by v divides by 0: v is 0 or an array holding 0.
+    """
+  if type(v) is DragonArray:
+    return v.has_zero()
+  return v == 0
+
+
+def matrix(v):
+  """
+    The NumPy array of the numbers in v: a vector for an array of
+    numbers, a matrix for an array of equally long rows.
+    """
+  if type(v) is not DragonArray:
+    raise TypeError(f"Cannot multiply {type(v).__name__} values")
+  if v.kind is not object:
+    if v.kind is not None and v.set.all():
+      return v.data
+    return v.objects()
+  if not any(type(r) is DragonArray for r in v.data):
+    return v.data
+  rows = [matrix(r) for r in v.data]
+  if not rows or any(r.ndim != 1 or len(r) != len(rows[0]) for r in rows):
+    raise ValueError("Matrix rows must be arrays of the same length")
+  if all(r.dtype != object for r in rows):
+    return np.array(rows)
+  m = np.empty((len(rows), len(rows[0])), dtype=object)
+  for i, r in enumerate(rows):
+    m[i] = r
+  return m
+
+
+def result_array(m):
+  """
+    Turn the result of matmul back into a value of the program.
+    """
+  if isinstance(m, np.generic):
+    return m.item()
+  elif type(m) is not np.ndarray:
+    return m
+  elif m.ndim == 1:
+    return typed_array(m) if m.dtype != object else object_array(m)
+  rows = np.empty(len(m), dtype=object)
+  for i, r in enumerate(m):
+    rows[i] = result_array(r)
+  return object_array(rows)
+
+
+def matmul(a, b):
+  """
+    The matrix product of a and b. Either one may be a vector. Ints
+    are multiplied in int64 while the sums fit, and any floats make it
+    a product of floats done by BLAS. Anything else is multiplied
+    element by element on Python numbers.
+    """
+  a = matrix(a)
+  b = matrix(b)
+  if a.shape[-1] != b.shape[0]:
+    raise ValueError(f"Cannot multiply shapes {a.shape} and {b.shape}")
+  if a.dtype == np.int64 and b.dtype == np.int64:
+    if a.size and b.size and magnitude(a) * magnitude(b) * a.shape[-1] > INT_MAX:
+      a = a.astype(object)
+      b = b.astype(object)
+  elif a.dtype == object or b.dtype == object:
+    a = a.astype(object)
+    b = b.astype(object)
+  elif (a.dtype == np.int64 and a.size and magnitude(a) > FLOAT_INT) or \
+       (b.dtype == np.int64 and b.size and magnitude(b) > FLOAT_INT):
+    a = a.astype(object)
+    b = b.astype(object)
+  else:
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+  with np.errstate(all='ignore'):
+    return result_array(np.matmul(a, b))
+
+
+class Output:
+  """
+    The buffer shoot writes through, which stands in for sys.stdout so
+    that everything else printed stays in order with it. Text is kept
+    until a line ends if line is true, as for a terminal, and otherwise
+    until block characters have been written.
+    """
+
+  def __init__(self, stream, line, block=OUTPUT_BLOCK):
+    self.stream = stream
+    self.line = line
+    self.block = block
+    self.parts = []
+    self.size = 0
+
+  def write(self, text):
+    self.parts.append(text)
+    self.size += len(text)
+    if self.size >= self.block or (self.line and '\n' in text):
+      self.flush()
+    return len(text)
+
+  def flush(self):
+    if self.parts:
+      self.stream.write(''.join(self.parts))
+      self.parts = []
+      self.size = 0
+    self.stream.flush()
+
+  def __getattr__(self, name):
+    return getattr(self.stream, name)
+
+
+def buffer_output(policy="auto", block=OUTPUT_BLOCK):
+  """
+    Put an Output in front of sys.stdout. The policy is "line", "block"
+    or "auto", which is line buffered for a terminal.
+    """
+  stream = sys.stdout
+  if policy == "auto":
+    policy = "line" if stream.isatty() else "block"
+  sys.stdout = Output(stream, policy == "line", block)
+  return sys.stdout
+
+
+def write_item(v):
+  """
+    Write one item of a shoot statement followed by a space, as
+    print(v, end=" ") would, an array a chunk at a time.
+    """
+  write = sys.stdout.write
+  if type(v) is DragonArray:
+    for text in v.text():
+      write(text)
+  else:
+    write(str(v))
+  write(' ')
+
+
+def end_line():
+  """
+    End the line of a shoot statement.
+    """
+  sys.stdout.write('\n')
+
+
+class TailCall:
+  """
+    A call in tail position, handed back to the nearest call which is
+    not, to be run there instead of on top of its caller. fun and frame
+    are the callee and its new frame, keep tells whether the callee's
+    value becomes the caller's, and default is the caller's value if
+    it does not.
+    """
+  __slots__ = ('fun', 'frame', 'keep', 'default')
+
+  def __init__(self, fun, frame, keep):
+    self.fun = fun
+    self.frame = frame
+    self.keep = keep
+    self.default = None
+
+
+def tail_value(result, run):
+  """
+    Run the calls in tail position handed back as result one after the
+    other, each with run, and return the value of the function which
+    made the first one.
+    """
+  fixed = False
+  default = None
+  while type(result) is TailCall:
+    # a callee without a value leaves the innermost caller's value
+    if not fixed:
+      if result.default is not None:
+        default = result.default
+      fixed = not result.keep
+    result = run(result)
+  if fixed or result is None:
+    return default
+  return result
+
+
+class Builtin:
+  """
+    A function every program may call without defining it. A dragon of
+    the same name takes its place.
+    """
+  __slots__ = ('name', 'nparams', 'fn')
+
+  def __init__(self, name, nparams, fn):
+    self.name = name
+    self.nparams = nparams
+    self.fn = fn
+
+  def call(self, args, line):
+    try:
+      return self.fn(*args)
+    except (TypeError, ValueError) as e:
+      print(f"{e} in call to {self.name} on line {line}")
+      sys.exit(-1)
+
+
+BUILTINS = {'matmul': Builtin('matmul', 2, matmul)}
+
+
+def find_builtin(name, nargs, line):
+  """
+    Return the builtin called by a call to a name no dragon is bound
+    to, reporting the errors a call to a dragon does.
+    """
+  builtin = BUILTINS.get(name)
+  if builtin is None:
+    print(f"Call to undefined function {name} on line {line}")
+    sys.exit(-1)
+  if builtin.nparams != nargs:
+    print(f"Wrong number of parameters to function {name} on line {line}")
+    sys.exit(-1)
+  return builtin
@@ -0,0 +1,133 @@
+"""
+A sampling profiler for DragonsRCool programs.
+
+A timer thread wakes every interval, looks at the Python frames of the
+thread running the program and turns them into the DragonsRCool call
+stack: the dragons being run, outermost first, each with the line of
+the statement it is running. The engine supplies the function which
+reads that stack from the frames, so the interpreter itself does no
+extra work and the program only pays for the timer thread taking the
+GIL now and then.
+
+Samples go into a ring buffer which keeps the newest ones, and can be
+written as folded stacks, one line per distinct stack with the number
+of samples of it, for flamegraph tools, or as a Chrome trace_event
+file of the hatch spans the samples show.
+"""
+import sys
+import json
+import time
+import threading
+from collections import deque
+
+# the default time between samples in seconds, and samples kept
+DEFAULT_INTERVAL = 0.005
+DEFAULT_SIZE = 100000
+
+
+class Sampler:
+  """
+    Samples the DragonsRCool stack of the thread which calls start.
+    stack_of takes a Python frame and returns a tuple of (name, line,
+    call) triples, outermost first, where call tells apart the calls
+    running at the same time.
+    """
+
+  def __init__(self, stack_of, interval=DEFAULT_INTERVAL, size=DEFAULT_SIZE):
+    self.stack_of = stack_of
+    self.interval = interval
+    self.samples = deque(maxlen=size)
+    self.clock = time.perf_counter
+    self.start_time = None
+    self.ident = None
+    self.thread = None
+    self.stopped = threading.Event()
+
+  def start(self):
+    self.ident = threading.get_ident()
+    self.start_time = self.clock()
+    self.thread = threading.Thread(target=self.__run, name="dragon-sampler",
+                                   daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    """
+      Stop sampling and wait for the timer thread to finish.
+      """
+    self.stopped.set()
+    if self.thread is not None and self.thread is not threading.current_thread():
+      self.thread.join()
+
+  def __run(self):
+    while not self.stopped.wait(self.interval):
+      frame = sys._current_frames().get(self.ident)
+      if frame is None:
+        continue
+      stack = self.stack_of(frame)
+      del frame
+      if stack:
+        self.samples.append((self.clock() - self.start_time, stack))
+
+  def folded(self):
+    """
+      Return the number of samples of each stack, keyed by its folded
+      form: the frames, name:line, joined by semicolons.
+      """
+    counts = {}
+    for _, stack in self.samples:
+      key = ';'.join(f'{name}:{line}' for name, line, _ in stack)
+      counts[key] = counts.get(key, 0) + 1
+    return counts
+
+  def write_folded(self, path):
+    self.stop()
+    with open(path, 'w') as f:
+      for key, n in sorted(self.folded().items()):
+        f.write(f'{key} {n}\n')
+
+  def trace_events(self):
+    """
+      Return the hatch spans the samples show as Chrome trace_event
+      complete events, each with the line of its hatch. A span starts
+      with the first sample which shows the call and ends with the
+      first which does not, so calls shorter than the interval may be
+      missed.
+      """
+    events = []
+    spans = []
+    now = 0.0
+
+    def close(depth, end):
+      while len(spans) > depth:
+        name, site, start, _ = spans.pop()
+        events.append({
+          'name': name,
+          'cat': 'hatch',
+          'ph': 'X',
+          'ts': round(start * 1e6, 3),
+          'dur': round((end - start) * 1e6, 3),
+          'pid': 1,
+          'tid': 1,
+          'args': {'line': site}
+        })
+
+    for now, stack in self.samples:
+      depth = 0
+      while depth < len(spans) and depth < len(stack) and \
+            spans[depth][3] == stack[depth][2]:
+        depth += 1
+      close(depth, now)
+      # each span is labelled with the line of its hatch
+      for i in range(depth, len(stack)):
+        site = stack[i - 1][1] if i else None
+        spans.append((stack[i][0], site, now, stack[i][2]))
+    close(0, now + self.interval if self.samples else now)
+    events.sort(key=lambda e: (e['ts'], -e['dur']))
+    return events
+
+  def write_trace(self, path):
+    self.stop()
+    with open(path, 'w') as f:
+      json.dump({'traceEvents': self.trace_events(),
+                 'displayTimeUnit': 'ms'}, f)
+      f.write('\n')
@@ -0,0 +1,695 @@
+"""
+Swarm loops, burn loops whose iterations run in a process pool.
+
+A swarm is written just as a burn over an index is,
+
+    < swarm i eats n fire
+      < a(i) : ... $ >
+      < i : i + 1 $ >
+    extinguish >
+
+and promises that its iterations do not depend on each other. Every
+engine runs it to the same end as the burn it would be, the vm and
+python engines one iteration after the other. Before the program runs
+each swarm is checked to keep the promise, and one which does not is
+rejected with the reason:
+    - the condition is the index eats or eats_more a bound, which
+      reads nothing the loop changes.
+    - the body ends with < i : i + 1 $ > and nothing else changes i.
+    - the body does not shoot, consume, return, define a dragon or
+      create a big variable, and calls only pure dragons and builtins,
+      see Memo.
+    - the only variables it changes are small ones it creates on the
+      top level of its body, before it reads them.
+    - an array it did not create is written only at a(i) and, once
+      written, read only there. Any other element written is of an
+      array it created with small b(n), which it does not change as a
+      whole, so that b is never another name for an outside array.
+
+The tree and closure engines cut the index range into chunks and run
+them in a ProcessPoolExecutor of forked workers, each running the body
+compiled by the closure engine. The first time an array is handed to a worker
+its storage is moved into shared memory, where it stays, so the
+workers read it and write a(i) in place. A value which does not fit
+the array's storage is sent back and stored by the program once the
+loop is done, just as it would have been.
+
+The first iterations run in the program: those before every array
+written has a kind, see DragonArray, and those before the time they
+take shows that the rest is worth handing out. A swarm whose index or
+bound is not a number, or whose arrays hold anything but numbers or
+are bound to more than one name, runs there in order, as do all of
+them where processes cannot be forked.
+
+A program whose source never has the word swarm has no swarm loops,
+so has_swarm lets it skip building a Swarm and walking its tree.
+"""
+import io
+import os
+import re
+import sys
+import math
+import time
+import pickle
+import atexit
+import weakref
+import contextlib
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from Lexer import Token
+from Parser import ParseType, LazyBody
+from Runtime import DragonArray, INT_MIN, INT_MAX
+from Resolver import Scope, GlobalTable, UNSET
+from Closures import Function, Compiler, COMPARISONS
+from Memo import pure_functions, PURE_BUILTINS
+
+# chunks handed out per worker, to even out uneven iterations
+CHUNKS_PER_WORKER = 4
+
+# workers are forked, so they start with the program's modules loaded
+# and share its resource tracker with the shared memory they attach
+START_METHOD = 'fork'
+
+# the swarm keyword, or the word in a string or comment
+SWARM_RE = re.compile(r'(?<!\w)swarm(?!\w)')
+
+# the seconds the rest of a swarm must be expected to take for it to
+# be handed out rather than run in the program
+SPREAD_TIME = 0.05
+
+# statements a swarm may not contain, and why
+FORBIDDEN = {
+  ParseType.READ: "it consumes input",
+  ParseType.WRITE: "it shoots, which would come out of order",
+  ParseType.RETURN: "it returns",
+  ParseType.DEF: "it defines a dragon"
+}
+
+
+def has_swarm(src):
+  """
+    Whether the program src may have a swarm loop.
+    """
+  return SWARM_RE.search(src) is not None
+
+
+def walk(t):
+  """
+    Yield every node of t, parents before their children, each with
+    its parent.
+    """
+  stack = [(t, None)]
+  while stack:
+    n, parent = stack.pop()
+    if n is None or isinstance(n, (str, LazyBody)):
+      continue
+    yield n, parent
+    stack.extend((c, n) for c in reversed(n.children))
+
+
+def is_name(t, name=None):
+  """
+    Whether t reads a variable, the one called name if it is given.
+    """
+  return t is not None and t.node_type == ParseType.ATOMIC and \
+    t.token.token == Token.ID and (name is None or t.token.lexeme == name)
+
+
+def is_one(t):
+  return t is not None and t.node_type == ParseType.ATOMIC and \
+    t.token.token == Token.NUMBER and type(t.token.value) is int and t.token.value == 1
+
+
+def is_step(t, index):
+  """
+    Whether the statement t is < index : index + 1 $ >.
+    """
+  if t.node_type != ParseType.REASSIGN or not is_name(t.children[0], index):
+    return False
+  v = t.children[1]
+  return v is not None and v.node_type == ParseType.ADD and \
+    ((is_name(v.children[0], index) and is_one(v.children[1])) or
+     (is_one(v.children[0]) and is_name(v.children[1], index)))
+
+
+class SwarmLoop:
+  """
+    A swarm loop checked against the rules. reason says why it may not
+    run in parallel, or is None. funcs are the FUNCTION nodes of the
+    program by name and pure the names of the pure ones.
+    """
+
+  def __init__(self, t, funcs, pure):
+    self.line = t.token.line
+    self.body = t.children[1]
+    self.funcs = funcs
+    self.pure = pure
+
+    # the small variables and arrays the body creates, in order
+    self.temps = []
+
+    # the arrays written at the index
+    self.arrays = []
+
+    # every name the body reads which it did not create
+    self.reads = []
+
+    # the dragons the body calls
+    self.calls = set()
+    self.reason = self.__check(t)
+
+  def __call(self, n):
+    """
+      The reason the call n may not be made in a swarm, or None.
+      """
+    name = n.token.lexeme
+    if name in self.funcs:
+      if name not in self.pure:
+        return f"it calls {name}, which is not a pure dragon"
+      self.calls.add(name)
+    elif name not in PURE_BUILTINS:
+      return f"it calls {name}, which is not a pure builtin"
+    return None
+
+  def __check(self, t):
+    cond = t.children[0]
+    if cond is None or cond.node_type != ParseType.COMPARABLE or \
+       cond.token.lexeme not in ('eats', 'eats_more') or not is_name(cond.children[0]):
+      return "its condition must be an index eats or eats_more a bound"
+    index = self.index = cond.children[0].token.lexeme
+    self.op = cond.token.lexeme
+    stmts = self.body.children if self.body is not None else []
+    if not stmts or not is_step(stmts[-1], index):
+      return f"its body must end with < {index} : {index} + 1 $ >"
+
+    temps = set()
+    # the temps which are arrays the body created
+    made = set()
+    arrays = set()
+    reads = set()
+    # the arrays read other than at the index
+    whole = set()
+    for s in stmts[:-1]:
+      created = None
+      if s.node_type in (ParseType.CREATEVAR, ParseType.CREATEARRAY) \
+         and s.token.lexeme == "small":
+        created = s.children[0].token.lexeme
+
+      for n, parent in walk(s):
+        nt = n.node_type
+        if nt in FORBIDDEN:
+          return FORBIDDEN[nt]
+        elif nt in (ParseType.CREATEVAR, ParseType.CREATEARRAY):
+          name = n.children[0].token.lexeme
+          if n.token.lexeme == "big":
+            return f"it creates the big variable {name}"
+          if n is not s and name not in temps:
+            return f"it creates {name} inside a block, not on the top level of its body"
+        elif nt == ParseType.REASSIGN:
+          target = n.children[0]
+          if target.node_type == ParseType.INDEX:
+            a = target.children[0].token.lexeme
+            if a in temps:
+              if a not in made:
+                return f"it writes into {a}, which may be an array it did not create"
+            elif not is_name(target.children[1], index):
+              return f"it writes into {a} at an index other than {index}"
+            else:
+              arrays.add(a)
+          elif target.token.lexeme == index:
+            return f"it changes {index} before its last statement"
+          elif target.token.lexeme in made:
+            return f"it changes the array {target.token.lexeme} as a whole, " \
+              "so it may become an array it did not create"
+          elif target.token.lexeme not in temps:
+            return f"it changes {target.token.lexeme}, which it did not create"
+        elif nt == ParseType.CALL:
+          reason = self.__call(n)
+          if reason is not None:
+            return reason
+        elif is_name(n):
+          name = n.token.lexeme
+          if parent is not None and parent.children[0] is n and parent.node_type in \
+             (ParseType.CREATEVAR, ParseType.CREATEARRAY, ParseType.REASSIGN):
+            # the name written
+            continue
+          if name in temps:
+            continue
+          reads.add(name)
+          if not (parent is not None and parent.node_type == ParseType.INDEX and
+                  parent.children[0] is n and is_name(parent.children[1], index)):
+            whole.add(name)
+
+      if created is not None:
+        if created == index:
+          return f"it changes {index} before its last statement"
+        if created in reads or created in arrays:
+          return f"it uses {created} before creating it, so it could see another iteration's"
+        if created not in temps:
+          temps.add(created)
+          self.temps.append(created)
+        if s.node_type == ParseType.CREATEARRAY:
+          made.add(created)
+        else:
+          made.discard(created)
+
+    both = sorted(arrays & whole)
+    if both:
+      a = both[0]
+      return f"it reads {a} other than as {a}({index}), which other iterations write"
+
+    for n, _ in walk(cond.children[1]):
+      if n.node_type == ParseType.CALL:
+        reason = self.__call(n)
+        if reason is not None:
+          return reason
+      elif is_name(n):
+        name = n.token.lexeme
+        if name == index or name in temps or name in arrays:
+          return f"its bound reads {name}, which the loop changes"
+
+    self.arrays = sorted(arrays)
+    self.reads = sorted(reads | arrays | {index})
+    return None
+
+  def functions(self):
+    """
+      The FUNCTION nodes of the dragons the body calls and of every
+      dragon they call.
+      """
+    nodes = []
+    seen = set()
+    stack = sorted(self.calls)
+    while stack:
+      name = stack.pop()
+      if name in seen or name not in self.funcs:
+        continue
+      seen.add(name)
+      node = self.funcs[name]
+      nodes.append(node)
+      stack.extend(n.token.lexeme for n, _ in walk(node.children[1])
+                   if n.node_type == ParseType.CALL)
+    return nodes
+
+
+def loop_end(op, start, bound):
+  """
+    The index a loop from start while the index op bound ends with, or
+    None if start is not an int or bound not a finite number.
+    """
+  if type(start) is not int:
+    return None
+  if type(bound) is int:
+    end = bound if op == 'eats' else bound + 1
+  elif type(bound) is float and math.isfinite(bound):
+    end = math.ceil(bound) if op == 'eats' else math.floor(bound) + 1
+  else:
+    return None
+  return max(start, end)
+
+
+class Runner:
+  """
+    The body of a swarm compiled by the closure engine, as the body of
+    a dragon whose parameters are the names it reads.
+    """
+
+  def __init__(self, body, names, index, temps, functions):
+    self.names = names
+    table = GlobalTable()
+    for node in functions:
+      table[node.token.lexeme] = Function(node)
+    scope = Scope(names, body)
+    self.slots = dict(zip(names, scope.param_slots))
+    self.index = self.slots[index]
+    self.temps = [(name, scope.slot(name)) for name in temps]
+    self.empty = scope.new_frame() + [None]
+    self.code = Compiler(table, scope, names).compile(body)
+
+    # what workers keep it by, see Swarm.runner
+    self.key = None
+
+  def frame(self, values):
+    """
+      A frame for running the body with the values of the names read.
+      """
+    f = self.empty[:]
+    for name, v in values.items():
+      f[self.slots[name]] = v
+    return f
+
+  def created(self, f):
+    """
+      The values of the variables the body created in the frame f.
+      """
+    return {name: f[k] for name, k in self.temps if f[k] is not UNSET}
+
+
+class Segment(SharedMemory):
+  """
+    Shared memory which NumPy arrays may still be views of when it is
+    dropped, in which case it stays mapped until they are gone.
+    """
+
+  def __del__(self):
+    try:
+      self.close()
+    except (OSError, BufferError):
+      pass
+
+
+# the NumPy arrays of the program in shared memory, by id
+segments = {}
+
+
+def shared(x):
+  """
+    Return the NumPy array x if it is in shared memory, else a copy of
+    it which is.
+    """
+  e = segments.get(id(x))
+  if e is not None and e[0]() is x:
+    return x
+  shm = Segment(create=True, size=max(x.nbytes, 1))
+  y = np.ndarray(x.shape, x.dtype, buffer=shm.buf)
+  y[...] = x
+  segments[id(y)] = (weakref.ref(y), shm)
+  return y
+
+
+def sweep(everything=False):
+  """
+    Free the shared memory of the arrays which are gone, or all of it
+    when the program ends.
+    """
+  for key, (ref, shm) in list(segments.items()):
+    if everything or ref() is None:
+      del segments[key]
+      try:
+        shm.close()
+      except BufferError:
+        pass
+      shm.unlink()
+
+
+class Shared:
+  """
+    An array of the program as it is handed to a worker: its kind, its
+    length, the names of the shared memory holding its elements and
+    its mask of set elements, and whether the swarm writes it.
+    """
+  __slots__ = ('kind', 'size', 'data', 'set', 'written')
+
+  def __init__(self, a, written):
+    a.set = shared(a.set)
+    self.data = None
+    if a.data is not None:
+      a.data = shared(a.data)
+      self.data = segments[id(a.data)][1].name
+    self.set = segments[id(a.set)][1].name
+    self.kind = a.kind
+    self.size = len(a.set)
+    self.written = written
+
+  def array(self):
+    """
+      The array in the worker, reading and writing the shared memory.
+      """
+    mask = attach(self.set, np.bool_, self.size)
+    data = None
+    if self.data is not None:
+      data = attach(self.data, np.int64 if self.kind is int else np.float64, self.size)
+    if self.written:
+      return SharedArray(data, mask, self.kind)
+    a = DragonArray(0)
+    a.data = data
+    a.set = mask
+    a.kind = self.kind
+    return a
+
+
+class SharedArray:
+  """
+    An array written by a swarm, in a worker. Elements which fit its
+    storage are written there, the rest are kept to be sent back.
+    """
+  __slots__ = ('data', 'set', 'kind', 'rest')
+
+  def __init__(self, data, mask, kind):
+    self.data = data
+    self.set = mask
+    self.kind = kind
+    self.rest = {}
+
+  def __getitem__(self, i):
+    if i in self.rest:
+      return self.rest[i]
+    if self.set[i]:
+      return self.data[i].item()
+    return None
+
+  def __setitem__(self, i, value):
+    # the values DragonArray keeps in its storage
+    t = type(value)
+    if (t is int and self.kind is int and INT_MIN <= value <= INT_MAX) or \
+       (t is float and self.kind is float):
+      self.data[i] = value
+      self.set[i] = True
+      self.rest.pop(i, None)
+    else:
+      self.rest[i] = value
+
+  def __len__(self):
+    return len(self.set)
+
+
+class Passed:
+  """
+    A variable the body created which is bound to an array it was
+    given, by the name it was given as.
+    """
+  __slots__ = ('name',)
+
+  def __init__(self, name):
+    self.name = name
+
+
+# the shared memory attached by this worker, and the bodies it compiled
+attached = {}
+runners = {}
+
+
+def attach(name, dtype, size):
+  entry = attached.get(name)
+  if entry is None:
+    shm = Segment(name)
+    entry = attached[name] = (shm, np.ndarray(size, dtype, buffer=shm.buf))
+  return entry[1]
+
+
+def detach(keep):
+  """
+    Close the shared memory attached for earlier loops, other than the
+    names in keep.
+    """
+  for name in [name for name in attached if name not in keep]:
+    shm, _ = attached.pop(name)
+    try:
+      shm.close()
+    except BufferError:
+      pass
+
+
+def run_chunk(key, payload, start, stop, values, last):
+  """
+    Run the iterations from start to stop of a swarm in a worker.
+    Returns the writes which did not fit the arrays' storage, by array,
+    the variables the body created if last, and what was printed with
+    the exit code if the program was stopped.
+    """
+  out = io.StringIO()
+  try:
+    with contextlib.redirect_stdout(out):
+      runner = runners.get(key)
+      if runner is None:
+        runner = runners[key] = Runner(*pickle.loads(payload))
+      detach({name for v in values.values() if type(v) is Shared
+              for name in (v.data, v.set)})
+      values = {name: v.array() if type(v) is Shared else v
+                for name, v in values.items()}
+      f = runner.frame(values)
+      i = runner.index
+      code = runner.code
+      for k in range(start, stop):
+        f[i] = k
+        code(f)
+  except SystemExit as e:
+    return None, None, (out.getvalue(), e.code)
+
+  rest = {name: v.rest for name, v in values.items()
+          if type(v) is SharedArray and v.rest}
+  created = None
+  if last:
+    given = {id(v): name for name, v in values.items() if type(v) is DragonArray}
+    created = {name: Passed(given[id(v)]) if id(v) in given else v
+               for name, v in runner.created(f).items()}
+  return rest, created, None
+
+
+class Swarm:
+  """
+    The swarm loops of a program, checked when they are parsed, and
+    the process pool of workers they run in.
+    """
+
+  def __init__(self, program, workers=None):
+    self.workers = workers or os.cpu_count() or 1
+    if START_METHOD not in multiprocessing.get_all_start_methods():
+      self.workers = 1
+    self.program = program
+    self.funcs = {c.token.lexeme: c for c in program.children}
+    self.pure = None
+    self.loops = {}
+    self.runners = {}
+    self.payloads = {}
+    self.pool = None
+    for c in program.children:
+      body = c.children[1]
+      if type(body) is LazyBody:
+        body.transform = self.checked(body.transform)
+      else:
+        self.check(body)
+
+  def checked(self, transform):
+    """
+      A transform of a lazily parsed body which checks it once parsed,
+      after transform if there is one.
+      """
+    def check(body):
+      if transform is not None:
+        body = transform(body)
+      self.check(body)
+      return body
+    return check
+
+  def check(self, body):
+    """
+      Check the swarm loops in a body, stopping the program at the
+      first which may not run in parallel.
+      """
+    for n, _ in walk(body):
+      if n.node_type != ParseType.LOOP or n.token.lexeme != "swarm":
+        continue
+      if self.pure is None:
+        self.pure = pure_functions(self.program)
+      loop = SwarmLoop(n, self.funcs, self.pure)
+      if loop.reason is not None:
+        print(f"swarm on line {loop.line} cannot run in parallel: {loop.reason}")
+        sys.exit(-1)
+      self.loops[n] = loop
+
+  def loop(self, t):
+    return self.loops[t]
+
+  def runner(self, loop, names):
+    """
+      The Runner of loop given the values of names.
+      """
+    runner = self.runners.get((loop, names))
+    if runner is None:
+      runner = Runner(loop.body, names, loop.index, loop.temps, loop.functions())
+      runner.key = len(self.runners)
+      self.runners[(loop, names)] = runner
+    return runner
+
+  def separate(self, loop, values):
+    """
+      Whether every array the loop writes is an array of ints or floats
+      bound to no other name it reads.
+    """
+    written = [values.get(a) for a in loop.arrays]
+    if not all(type(a) is DragonArray and a.kind is not object for a in written):
+      return False
+    ids = {id(a) for a in written}
+    return sum(id(v) in ids for v in values.values()) == len(written)
+
+  def run(self, loop, start, bound, values):
+    """
+      Run a swarm from the index start while it eats or eats_more
+      bound, given the values of the names its body reads. Returns
+      the values the index and the variables the body created are
+      left with.
+      """
+    values[loop.index] = start
+    runner = self.runner(loop, tuple(values))
+    f = runner.frame(values)
+    i = runner.index
+    op = COMPARISONS[loop.op]
+    end = loop_end(loop.op, start, bound)
+    if end is not None and self.workers > 1 and self.separate(loop, values):
+      # an array takes the kind of the first element stored in it, and
+      # the time the iterations take tells if the rest is worth handing
+      # out
+      arrays = [values[a] for a in loop.arrays]
+      begin = f[i]
+      clock = time.perf_counter
+      t = clock()
+      while f[i] < end and (f[i] == begin or any(a.kind is None for a in arrays) or
+                            (clock() - t) * (end - f[i]) < SPREAD_TIME * (f[i] - begin)):
+        runner.code(f)
+      if end - f[i] > 1 and all(a.kind is not object for a in arrays):
+        created = self.spread(loop, runner, values, f[i], end)
+        created[loop.index] = end
+        return created
+
+    while op(f[i], bound):
+      runner.code(f)
+    created = runner.created(f)
+    created[loop.index] = f[i]
+    return created
+
+  def spread(self, loop, runner, values, start, end):
+    """
+      Run the iterations from start to end over the process pool.
+      """
+    sweep()
+    given = {name: Shared(v, name in loop.arrays)
+             if type(v) is DragonArray and v.kind is not object else v
+             for name, v in values.items()}
+    key = runner.key
+    if key not in self.payloads:
+      self.payloads[key] = pickle.dumps((loop.body, runner.names, loop.index,
+                                         loop.temps, loop.functions()))
+    payload = self.payloads[key]
+
+    if self.pool is None:
+      # the workers would write out whatever is still buffered
+      sys.stdout.flush()
+      self.pool = ProcessPoolExecutor(
+        self.workers, mp_context=multiprocessing.get_context(START_METHOD))
+      atexit.register(sweep, True)
+    n = min(end - start, self.workers * CHUNKS_PER_WORKER)
+    bounds = [start + (end - start) * k // n for k in range(n + 1)]
+    futures = [self.pool.submit(run_chunk, key, payload, a, b, given, b == end)
+               for a, b in zip(bounds, bounds[1:])]
+    results = [future.result() for future in futures]
+
+    # the first iteration to stop the program stops it here
+    for _, _, stopped in results:
+      if stopped is not None:
+        text, code = stopped
+        print(text, end='')
+        sys.exit(code)
+
+    for rest, _, _ in results:
+      for name, writes in rest.items():
+        a = values[name]
+        for k, v in writes.items():
+          a[k] = v
+    created = results[-1][1]
+    for name, v in created.items():
+      if type(v) is Passed:
+        created[name] = values[v.name]
+    return created
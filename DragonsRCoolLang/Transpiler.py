@@ -0,0 +1,452 @@
+"""
+A transpiler from DragonsRCool to Python source.
+
+Every dragon becomes a Python function which CPython compiles like
+any other module. small variables, parameters and everything written
+by consume or reassignment become Python locals named v_<name>; a
+local which has not been written yet holds UNSET, and reads fall back
+to the globals dictionary G, which holds the functions and every big
+variable. burn becomes while, path becomes if/else, also and either
+become and/or, and arrays stay NumPy arrays.
+
+Reads and writes whose order could be seen, and any check which may
+fail with one of the interpreter's errors, go through the small
+helpers below so the generated code reports the same messages, with
+the same line numbers, as the tree walker. A call to a dragon which no
+big variable can replace, with the right number of arguments, is a
+direct Python call.
+
+Python limits how deeply blocks may nest, so a program which CPython
+refuses to compile is run with the closure engine instead.
+
+With --memo each pure dragon's function looks its arguments up in its
+cache, cache_<name>, when it starts and keeps the value it returns.
+The caches are put into the module once it is loaded. A wrapper would
+cost a Python frame per call, and with it half the recursion depth.
+"""
+import sys
+import math
+from Lexer import Token
+from Parser import ParseType, LazyBody
+from Resolver import local_names, UNSET, UNDEFINED
+from Runtime import is_zero, find_builtin
+import Closures
+
+COMPARISONS = {
+  'is': '==',
+  'not': '!=',
+  'eats': '<',
+  'eats_more': '<=',
+  'spits': '>',
+  'spits_more': '>='
+}
+
+ARITHMETIC = {
+  ParseType.ADD: '+',
+  ParseType.SUB: '-',
+  ParseType.MUL: '*',
+  ParseType.POW: '**'
+}
+
+
+class Function:
+  """
+    A dragon as stored in G: its Python function and parameter count,
+    None if it has no parameter list.
+    """
+  __slots__ = ('fn', 'nparams')
+
+  def __init__(self, fn, nparams):
+    self.fn = fn
+    self.nparams = nparams
+
+
+def load(glob, name, line):
+  """
+    Read a global variable, reporting the errors eval_atomic does.
+    """
+  v = glob.get(name, UNDEFINED)
+  if v is UNDEFINED:
+    print(f"Undefined variable {name} on line {line}")
+    sys.exit(-1)
+  elif type(v) is Function:
+    print(f"{name} on line {line} is not a variable.")
+    sys.exit(-1)
+  return v
+
+
+def find(glob, name, nargs, line):
+  """
+    Return the Python function to call for a dragon, reporting the
+    errors eval_call does.
+    """
+  fun = glob.get(name, UNDEFINED)
+  if fun is UNDEFINED:
+    builtin = find_builtin(name, nargs, line)
+    return lambda *args: builtin.call(args, line)
+  elif type(fun) is not Function:
+    print(f"Call to non-function {name} on line {line}")
+    sys.exit(-1)
+  if fun.nparams != nargs:
+    print(f"Wrong number of parameters to function {name} on line {line}")
+    sys.exit(-1)
+  return fun.fn
+
+
+def find_local(value, glob, name, nargs, line):
+  """
+    find for a name which is also a local of the caller. Locals are
+    never functions.
+    """
+  if value is not UNSET:
+    print(f"Call to non-function {name} on line {line}")
+    sys.exit(-1)
+  return find(glob, name, nargs, line)
+
+
+def div(left, right, line):
+  if is_zero(right):
+    print(f"Division by 0 on line {line}")
+    sys.exit(-1)
+  return left / right
+
+
+def store_index(array, value, idx):
+  """
+    array[idx] = value, with the operands evaluated in the
+    interpreter's order.
+    """
+  array[idx] = value
+
+
+def missing():
+  """
+    A node the parser left out, which fails as the interpreter does.
+    """
+  return None.node_type
+
+
+def literal(value):
+  """
+    Python source for a number or string constant.
+    """
+  if isinstance(value, float) and not math.isfinite(value):
+    return f"float('{value}')"
+  elif isinstance(value, str):
+    return repr(value)
+  # a negative literal binds looser than **
+  return repr(value) if value >= 0 else f"({value!r})"
+
+
+class Transpiler:
+  """
+    Writes the Python module for a program.
+    """
+
+  def __init__(self, program, memo=None):
+    # parse every lazily parsed body, the whole program is translated
+    for c in program.children:
+      if type(c.children[1]) is LazyBody:
+        c.children[1] = c.children[1].parse()
+    self.program = program
+
+    # the dragons which look their calls up in a cache
+    self.memoized = set(memo.caches) if memo is not None else set()
+
+    # Python names of the dragons; the last one of a name is the one
+    # in G
+    last = {c.token.lexeme: i for i, c in enumerate(program.children)}
+    self.def_names = [
+      f"dragon_{c.token.lexeme}" if last[c.token.lexeme] == i else
+      f"dragon_{c.token.lexeme}_{i}" for i, c in enumerate(program.children)
+    ]
+    self.direct = {
+      name: (self.def_names[i], self.__nparams(program.children[i]))
+      for name, i in last.items()
+    }
+
+    # a dragon replaced by a big variable is never called directly
+    stack = [program]
+    while stack:
+      t = stack.pop()
+      if t is None or isinstance(t, str):
+        continue
+      if t.node_type in (ParseType.CREATEVAR, ParseType.CREATEARRAY) \
+         and t.token.lexeme == "big":
+        self.direct.pop(t.children[0].token.lexeme, None)
+      stack.extend(t.children)
+
+  def __nparams(self, t):
+    return None if t.children[0] is None else len(t.children[0].children)
+
+  def source(self, filename=None):
+    """
+      Return the text of the Python module.
+      """
+    lines = []
+    if filename:
+      lines.append(f"# {filename}, transpiled from DragonsRCool")
+    else:
+      lines.append("# transpiled from DragonsRCool")
+    lines.append("from Transpiler import Function, UNSET, load, find, "
+                 "find_local, div, store_index, missing")
+    lines.append("from Runtime import read_value, new_array, write_item, end_line")
+    if self.memoized:
+      lines.append("from Memo import MISS, memo_key")
+    lines.append("")
+    lines.append("G = {}")
+    for i, c in enumerate(self.program.children):
+      lines.append("")
+      lines.append("")
+      lines.extend(self.function(c, self.def_names[i]))
+    lines.append("")
+    lines.append("")
+    for i, c in enumerate(self.program.children):
+      lines.append(f"G[{c.token.lexeme!r}] = "
+                   f"Function({self.def_names[i]}, {self.__nparams(c)})")
+    lines.append("")
+    lines.append("")
+    lines.append("def run():")
+    if self.program.children:
+      lines.append(f"  return {self.def_names[0]}()")
+    else:
+      lines.append("  return None")
+    lines.append("")
+    lines.append("")
+    lines.append('if __name__ == "__main__":')
+    lines.append("  run()")
+    return "\n".join(lines) + "\n"
+
+  def function(self, t, def_name):
+    """
+      Return the lines of the Python function for the dragon t.
+      """
+    params = [p.token.lexeme for p in t.children[0].children] \
+      if t.children[0] is not None else []
+    body = t.children[1]
+    self.locals = set(local_names(body, list(params)))
+    self.lines = []
+
+    # a repeated parameter keeps the last argument given for it
+    args = [
+      f"_p{i}" if p in params[i + 1:] else f"v_{p}"
+      for i, p in enumerate(params)
+    ]
+    self.lines.append(f"def {def_name}({', '.join(args)}):")
+
+    # only the dragon of a name which is in G is memoized
+    name = t.token.lexeme
+    self.cache = None
+    if name in self.memoized and def_name == f"dragon_{name}":
+      self.cache = f"cache_{name}"
+      self.lines.append(f"  _key = memo_key([{', '.join(args)}])")
+      self.lines.append("  if _key is not None:")
+      self.lines.append(f"    _r = {self.cache}.get(_key)")
+      self.lines.append("    if _r is not MISS: return _r")
+    unset = sorted(self.locals - set(params))
+    if unset:
+      self.lines.append(
+        "  " + " = ".join(f"v_{name}" for name in unset) + " = UNSET")
+    self.has_last = any(c.node_type == ParseType.CALL for c in body.children)
+    if self.has_last:
+      self.lines.append("  _last = None")
+    self.body(body, 1, set(params), True)
+    self.emit(1, self.returns("_last" if self.has_last else "None"))
+    return self.lines
+
+  def emit(self, depth, text):
+    self.lines.append("  " * depth + text)
+
+  def returns(self, value):
+    """
+      The statement returning value, keeping it in the cache of a
+      memoized dragon.
+      """
+    if self.cache is not None:
+      return f"return {self.cache}.keep(_key, {value})"
+    return f"return {value}"
+
+  def body(self, t, depth, bound, top=False):
+    """
+      Emit the statements of t. bound holds the locals which are
+      surely written by the time each statement runs.
+      """
+    start = len(self.lines)
+    for c in t.children:
+      self.statement(c, depth, bound, top)
+    if len(self.lines) == start:
+      self.emit(depth, "pass")
+
+  def statement(self, t, depth, bound, top):
+    nt = t.node_type
+    if nt == ParseType.CREATEVAR or nt == ParseType.CREATEARRAY:
+      name = t.children[0].token.lexeme
+      if nt == ParseType.CREATEARRAY:
+        value = f"new_array({self.expr(t.children[1], bound)})"
+      elif t.children[1] is not None:
+        value = self.expr(t.children[1], bound)
+      else:
+        value = "None"
+      if t.token.lexeme == "big":
+        self.emit(depth, f"G[{name!r}] = {value}")
+      else:
+        self.emit(depth, f"v_{name} = {value}")
+        bound.add(name)
+    elif nt == ParseType.REASSIGN:
+      target = t.children[0]
+      if target.node_type == ParseType.INDEX:
+        self.store(target, self.expr(t.children[1], bound), depth, bound)
+      else:
+        # the name must already be bound, the new value is always local
+        name = target.token.lexeme
+        if name not in bound:
+          self.emit(depth, f"if v_{name} is UNSET: "
+                    f"load(G, {name!r}, {target.token.line})")
+        self.emit(depth, f"v_{name} = {self.expr(t.children[1], bound)}")
+        bound.add(name)
+    elif nt == ParseType.READ:
+      target = t.children[0]
+      if target.node_type == ParseType.INDEX:
+        self.store(target, "read_value()", depth, bound)
+      else:
+        self.emit(depth, f"v_{target.token.lexeme} = read_value()")
+        bound.add(target.token.lexeme)
+    elif nt == ParseType.WRITE:
+      for c in t.children[0].children:
+        self.emit(depth, f"write_item({self.expr(c, bound)})")
+      self.emit(depth, "end_line()")
+    elif nt == ParseType.PATH:
+      self.emit(depth, f"if {self.expr(t.children[0], bound)}:")
+      self.body(t.children[1], depth + 1, set(bound))
+      if t.children[2] is not None:
+        self.emit(depth, "else:")
+        self.body(t.children[2], depth + 1, set(bound))
+    elif nt == ParseType.LOOP:
+      self.emit(depth, f"while {self.expr(t.children[0], bound)}:")
+      self.body(t.children[1], depth + 1, set(bound))
+    elif nt == ParseType.CALL:
+      if top:
+        self.emit(depth, f"_r = {self.expr(t, bound)}")
+        self.emit(depth, "if _r is not None: _last = _r")
+      else:
+        self.emit(depth, self.expr(t, bound))
+    elif nt == ParseType.RETURN:
+      value = t.children[0]
+      if value is not None and value.node_type == ParseType.ATOMIC \
+         and value.token.token in (Token.NUMBER, Token.STRING):
+        self.emit(depth, self.returns(literal(value.token.value)))
+      else:
+        # returning None does nothing
+        self.emit(depth, f"_r = {self.expr(value, bound)}")
+        self.emit(depth, f"if _r is not None: {self.returns('_r')}")
+
+  def store(self, target, value, depth, bound):
+    """
+      Store value into the element target names. The array is
+      evaluated first, then the value, then the index.
+      """
+    array = self.expr(target.children[0], bound)
+    idx = self.expr(target.children[1], bound)
+    if self.simple(target.children[0], bound) \
+       and self.simple(target.children[1], bound):
+      self.emit(depth, f"{array}[{idx}] = {value}")
+    else:
+      self.emit(depth, f"store_index({array}, {value}, {idx})")
+
+  def simple(self, t, bound):
+    """
+      True if evaluating t can neither fail nor be seen.
+      """
+    if t is None or t.node_type != ParseType.ATOMIC:
+      return False
+    return t.token.token in (Token.NUMBER, Token.STRING) \
+      or t.token.lexeme in bound
+
+  def expr(self, t, bound):
+    """
+      Return the Python expression for t.
+      """
+    if t is None:
+      return "missing()"
+    nt = t.node_type
+    if nt == ParseType.ATOMIC:
+      tok = t.token
+      if tok.token in (Token.NUMBER, Token.STRING):
+        return literal(tok.value)
+      name = tok.lexeme
+      if name in bound:
+        return f"v_{name}"
+      elif name in self.locals:
+        return f"(v_{name} if v_{name} is not UNSET " \
+               f"else load(G, {name!r}, {tok.line}))"
+      return f"load(G, {name!r}, {tok.line})"
+    elif nt in ARITHMETIC:
+      left = self.expr(t.children[0], bound)
+      right = self.expr(t.children[1], bound)
+      return f"({left} {ARITHMETIC[nt]} {right})"
+    elif nt == ParseType.DIV:
+      left = self.expr(t.children[0], bound)
+      right = t.children[1]
+      if right is not None and right.node_type == ParseType.ATOMIC \
+         and right.token.token == Token.NUMBER and right.token.value != 0:
+        return f"({left} / {literal(right.token.value)})"
+      right = self.expr(right, bound)
+      return f"div({left}, {right}, {t.token.line})"
+    elif nt == ParseType.NEGATION:
+      return f"(-{self.expr(t.children[0], bound)})"
+    elif nt == ParseType.INDEX:
+      array = self.expr(t.children[0], bound)
+      return f"{array}[{self.expr(t.children[1], bound)}]"
+    elif nt == ParseType.COMPARABLE:
+      left = self.expr(t.children[0], bound)
+      right = self.expr(t.children[1], bound)
+      return f"({left} {COMPARISONS[t.token.lexeme]} {right})"
+    elif nt == ParseType.CONDITION:
+      op = "and" if t.token.lexeme == "also" else "or"
+      left = self.expr(t.children[0], bound)
+      right = self.expr(t.children[1], bound)
+      return f"({left} {op} {right})"
+    elif nt == ParseType.CALL:
+      name = t.token.lexeme
+      line = t.token.line
+      args = t.children[0].children if t.children[0] is not None else None
+      nargs = None if args is None else len(args)
+      values = ", ".join(self.expr(c, bound) for c in args or ())
+      if name in self.locals:
+        fun = f"find_local(v_{name}, G, {name!r}, {nargs}, {line})"
+      elif name in self.direct and self.direct[name][1] == nargs:
+        fun = self.direct[name][0]
+      else:
+        fun = f"find(G, {name!r}, {nargs}, {line})"
+      return f"{fun}({values})"
+    elif nt == ParseType.SAVE:
+      return f"(v_{t.token.lexeme} := {self.expr(t.children[0], bound)})"
+    elif nt == ParseType.LOAD:
+      return f"v_{t.token.lexeme}"
+
+
+def transpile(program, filename=None, memo=None):
+  """
+    Return the Python source for the program, memoizing the dragons
+    which have a cache in memo if it is given.
+    """
+  return Transpiler(program, memo).source(filename)
+
+
+def run_program(program, filename=None, memo=None):
+  """
+    Transpile the program, compile it with CPython and run it,
+    memoizing the pure dragons in memo if it is given.
+    """
+  source = transpile(program, filename, memo)
+  try:
+    code = compile(source, f"<{filename or 'dragon'}>", "exec")
+  except (SyntaxError, RecursionError, MemoryError):
+    # nested too deeply for CPython
+    return Closures.run_program(program, memo)
+  namespace = {"__name__": "dragon"}
+  if memo is not None:
+    for name, cache in memo.caches.items():
+      namespace[f"cache_{name}"] = cache
+  exec(code, namespace)
+  return namespace["run"]()
@@ -0,0 +1,250 @@
+"""
+Tests of whole-array arithmetic and matmul on DragonArray.
+
+Every operation is checked against the same operation done element by
+element on Python numbers, which is what the interpreter computed
+before arrays had typed storage.
+"""
+import io
+import os
+import sys
+import random
+import operator
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Runtime import DragonArray, new_array, matmul, find_builtin, INT_MAX
+
+OPS = (operator.add, operator.sub, operator.mul, operator.truediv,
+       operator.pow)
+
+
+def array(values):
+  """
+    An array holding values, stored as the program would store them.
+    """
+  a = new_array(len(values))
+  for i, v in enumerate(values):
+    a[i] = v
+  return a
+
+
+def rows(values):
+  """
+    A matrix: an array whose elements are arrays of the rows.
+    """
+  return array([array(r) for r in values])
+
+
+def elements(a):
+  return [a[i] for i in range(len(a))]
+
+
+def exact(values):
+  """
+    The values with their types, so 1 and 1.0 tell apart.
+    """
+  return [(type(v), v) for v in values]
+
+
+class TypedArithmeticTest(unittest.TestCase):
+  """
+    Arrays of ints or floats computed on in their NumPy storage.
+    """
+
+  def check(self, op, a, b, kind):
+    xs = elements(a) if type(a) is DragonArray else [a] * len(b)
+    ys = elements(b) if type(b) is DragonArray else [b] * len(a)
+    result = op(a, b)
+    self.assertIs(result.kind, kind)
+    self.assertEqual(exact(elements(result)),
+                     exact([op(x, y) for x, y in zip(xs, ys)]))
+
+  def test_ints_stay_ints(self):
+    a = array([3, -4, 5])
+    b = array([7, 2, -1])
+    for op in (operator.add, operator.sub, operator.mul):
+      self.check(op, a, b, int)
+      self.check(op, a, 10, int)
+      self.check(op, 10, a, int)
+    self.check(operator.pow, a, 3, int)
+    self.check(operator.pow, 2, array([0, 1, 62]), int)
+
+  def test_division_gives_floats(self):
+    self.check(operator.truediv, array([1, 2, 3]), 2, float)
+    self.check(operator.truediv, array([1, 2, 3]), array([4, -5, 6]), float)
+    self.check(operator.truediv, 1, array([4, 8, -16]), float)
+
+  def test_ints_and_floats(self):
+    a = array([1, 2, 3])
+    f = array([0.5, -1.25, 3.0])
+    for op in (operator.add, operator.sub, operator.mul, operator.truediv):
+      self.check(op, a, f, float)
+      self.check(op, f, a, float)
+      self.check(op, a, 0.5, float)
+    self.check(operator.mul, f, 2, float)
+
+  def test_chain_stays_typed(self):
+    a = array(list(range(1, 6)))
+    result = a * 2 + a / 4 - 1
+    self.assertIs(result.kind, float)
+    self.assertEqual(elements(result), [x * 2 + x / 4 - 1 for x in range(1, 6)])
+
+  def test_negation(self):
+    self.assertEqual(exact(elements(-array([1, -2]))), exact([-1, 2]))
+    self.assertEqual(exact(elements(-array([1.5]))), exact([-1.5]))
+
+  def test_random_operands_match_python(self):
+    rnd = random.Random(18)
+    for _ in range(200):
+      n = rnd.randrange(1, 6)
+      if rnd.random() < 0.5:
+        xs = [rnd.randrange(-1000, 1000) for _ in range(n)]
+      else:
+        xs = [rnd.uniform(-100, 100) for _ in range(n)]
+      ys = [rnd.randrange(1, 50) for _ in range(n)]
+      op = rnd.choice(OPS)
+      if op is operator.pow:
+        ys = [y % 4 for y in ys]
+      result = op(array(xs), array(ys))
+      self.assertEqual(exact(elements(result)),
+                       exact([op(x, y) for x, y in zip(xs, ys)]))
+
+
+class FallbackTest(unittest.TestCase):
+  """
+    Operations NumPy could get wrong are done on Python values.
+    """
+
+  def test_int_overflow_is_exact(self):
+    big = array([2**62, -2**62, 1])
+    total = big + big
+    self.assertIs(total.kind, object)
+    self.assertEqual(elements(total), [2**63, -2**63, 2])
+    product = big * array([4, 4, 4])
+    self.assertEqual(elements(product), [2**64, -2**64, 4])
+    self.assertEqual(elements(array([3, 2]) ** 40), [3**40, 2**40])
+    self.assertEqual(elements(array([INT_MAX]) + 1), [INT_MAX + 1])
+
+  def test_big_ints_meet_floats_as_python_does(self):
+    big = array([2**60 + 1, 3])
+    total = big + array([0.5, 1.5])
+    self.assertIs(total.kind, object)
+    self.assertEqual(exact(elements(total)),
+                     exact([2**60 + 1 + 0.5, 4.5]))
+    self.assertEqual(exact(elements(big / 3)), exact([(2**60 + 1) / 3, 1.0]))
+
+  def test_ints_too_big_for_storage(self):
+    a = array([2**70, 1])
+    self.assertIs(a.kind, object)
+    self.assertEqual(elements(a * 2), [2**71, 2])
+
+  def test_negative_and_float_powers(self):
+    self.assertEqual(exact(elements(array([2, 4]) ** -1)), exact([0.5, 0.25]))
+    self.assertEqual(exact(elements(array([4.0, 9.0]) ** 0.5)),
+                     exact([2.0, 3.0]))
+
+  def test_division_by_zero(self):
+    with self.assertRaises(ZeroDivisionError):
+      array([1, 2]) / 0
+    with self.assertRaises(ZeroDivisionError):
+      array([1, 2]) / array([1, 0])
+    self.assertTrue(array([1, 0]).has_zero())
+    self.assertFalse(array([1.5, 2]).has_zero())
+
+  def test_mixed_types(self):
+    a = array([1, 2.5])
+    self.assertIs(a.kind, object)
+    self.assertEqual(exact(elements(a + 1)), exact([2, 3.5]))
+    words = array(['dragon', 'fire'])
+    self.assertEqual(elements(words + 's'), ['dragons', 'fires'])
+    with self.assertRaises(TypeError):
+      array([1, 'x']) + 1
+
+  def test_unset_elements(self):
+    a = new_array(2)
+    a[0] = 1
+    self.assertIsNone(a[1])
+    with self.assertRaises(TypeError):
+      a + 1
+
+
+class IndexTest(unittest.TestCase):
+
+  def test_out_of_range(self):
+    for a in (array([1, 2, 3]), array([1.5, 2.5, 3.5]), array(['a', 'b', 'c']),
+              new_array(3)):
+      with self.assertRaises(IndexError):
+        a[3]
+      with self.assertRaises(IndexError):
+        a[3] = 1
+      with self.assertRaises(IndexError):
+        a[-4]
+
+  def test_negative_index_reads_from_the_end(self):
+    self.assertEqual(array([1, 2, 3])[-1], 3)
+
+  def test_storage_changes_kind(self):
+    a = array([1, 2])
+    self.assertIs(a.kind, int)
+    a[0] = 2**64
+    self.assertIs(a.kind, object)
+    self.assertEqual(elements(a), [2**64, 2])
+
+
+class MatmulTest(unittest.TestCase):
+
+  def product(self, a, b):
+    return [[sum(x * y for x, y in zip(r, c)) for c in zip(*b)] for r in a]
+
+  def values(self, m):
+    return [elements(r) for r in elements(m)]
+
+  def test_ints(self):
+    a = [[1, 2, 3], [4, 5, 6]]
+    b = [[7, 8], [9, 10], [11, 12]]
+    result = matmul(rows(a), rows(b))
+    self.assertEqual(self.values(result), self.product(a, b))
+    self.assertIs(elements(result)[0].kind, int)
+
+  def test_floats(self):
+    a = [[0.5, 1.5], [2.0, -1.0]]
+    b = [[1, 2], [3, 4]]
+    result = matmul(rows(a), rows(b))
+    self.assertEqual(self.values(result), self.product(a, b))
+    self.assertIs(elements(result)[0].kind, float)
+
+  def test_vectors(self):
+    m = [[1, 2], [3, 4], [5, 6]]
+    self.assertEqual(elements(matmul(array([1, 1, 1]), rows(m))), [9, 12])
+    self.assertEqual(elements(matmul(rows(m), array([1, -1]))), [-1, -1, -1])
+    self.assertEqual(matmul(array([1, 2]), array([3, 4])), 11)
+
+  def test_int_overflow_is_exact(self):
+    a = [[2**40, 2**40]]
+    b = [[2**40], [2**40]]
+    self.assertEqual(self.values(matmul(rows(a), rows(b))), [[2**81]])
+
+  def test_shape_errors(self):
+    with self.assertRaisesRegex(ValueError, 'Cannot multiply shapes'):
+      matmul(rows([[1, 2], [3, 4]]), rows([[1, 2, 3]]))
+    with self.assertRaisesRegex(ValueError, 'Cannot multiply shapes'):
+      matmul(array([1, 2, 3]), array([1, 2]))
+    with self.assertRaisesRegex(ValueError, 'same length'):
+      matmul(rows([[1, 2], [3]]), rows([[1], [2]]))
+    with self.assertRaisesRegex(TypeError, 'Cannot multiply int'):
+      matmul(3, rows([[1]]))
+
+  def test_builtin_reports_the_line(self):
+    builtin = find_builtin('matmul', 2, 7)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), self.assertRaises(SystemExit):
+      builtin.call([array([1, 2]), array([1])], 7)
+    self.assertEqual(out.getvalue(),
+                     'Cannot multiply shapes (2,) and (1,) in call to matmul on line 7\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
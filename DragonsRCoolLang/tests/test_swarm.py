@@ -0,0 +1,294 @@
+"""
+Tests of swarm loops run over the process pool.
+
+Every program is run by the tree and closure engines with two workers
+and checked against the same program with its swarms written as burn
+loops, which run one iteration after the other. SPREAD_TIME is taken
+to nothing so that even these short swarms are handed out.
+"""
+import io
+import os
+import sys
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Swarm
+import Closures
+import DragonsRCool
+from Lexer import Lexer
+from Parser import Parser
+
+WORKERS = 2
+
+# int and float writes into an array of ints, which the workers cannot
+# store and send back
+KINDS = '''
+dragon main fire
+  < small n : 64 $ >
+  < small a(n) $ >
+  < small f(n) $ >
+  < small i : 0 $ >
+  < burn i eats n fire < f(i) : i / 4 $ > < i : i + 1 $ > extinguish >
+  < i : 0 $ >
+  < swarm i eats n fire
+    < a(i) : i * 3 $ >
+    < path 40 eats i here < a(i) : i / 2 $ > here >
+    < f(i) : f(i) * 2 $ >
+    < path 50 eats i here < f(i) : i $ > here >
+    < i : i + 1 $ >
+  extinguish >
+  < shoot a, f, i $ >
+extinguish
+end
+'''
+
+# ints too big for the storage, sent back through rest
+REST = '''
+dragon main fire
+  < small n : 40 $ >
+  < small b(n) $ >
+  < small i : 0 $ >
+  < swarm i eats_more n - 1 fire
+    < b(i) : i * 4611686018427387904 $ >
+    < i : i + 1 $ >
+  extinguish >
+  < shoot b, i $ >
+extinguish
+end
+'''
+
+# the variables the body creates are read once it is done, row bound
+# to the array r itself
+TEMPS = '''
+dragon main fire
+  < small n : 48 $ >
+  < small r(n) $ >
+  < small b(n) $ >
+  < small i : 0 $ >
+  < burn i eats n fire < r(i) : i - 7 $ > < i : i + 1 $ > extinguish >
+  < i : 0 $ >
+  < swarm i eats n fire
+    < small t : r(i) * 3 $ >
+    < small row : r $ >
+    < small w(2) $ >
+    < w(0) : t $ >
+    < w(1) : hatch sq[row(i)] $ >
+    < b(i) : w(0) + w(1) $ >
+    < i : i + 1 $ >
+  extinguish >
+  < shoot t, i, w, b $ >
+  < r(0) : 99 $ >
+  < shoot row(0) $ >
+extinguish
+dragon sq x fire
+  < return x * x >
+extinguish
+end
+'''
+
+# a division by zero in an iteration a worker runs
+ERROR = '''
+dragon main fire
+  < small n : 64 $ >
+  < small a(n) $ >
+  < small i : 0 $ >
+  < swarm i eats n fire
+    < a(i) : 60 / {i - 30} $ >
+    < i : i + 1 $ >
+  extinguish >
+  < shoot a $ >
+extinguish
+end
+'''
+
+# a swarm in a dragon, whose bound is a float
+CALLED = '''
+dragon main fire
+  < small n : 30 $ >
+  < small a(n) $ >
+  < small i : 0 $ >
+  < burn i eats n fire < a(i) : i * i $ > < i : i + 1 $ > extinguish >
+  < small m : n - 0.5 $ >
+  < small o : hatch twice[a, m] $ >
+  < shoot o $ >
+extinguish
+dragon twice a m fire
+  < small o(30) $ >
+  < small i : 0 $ >
+  < swarm i eats m fire
+    < o(i) : a(i) * 2 + 0.5 $ >
+    < i : i + 1 $ >
+  extinguish >
+  < return o >
+extinguish
+end
+'''
+
+REJECTED = '''
+dragon main fire
+  < small n : 4 $ >
+  < small a(n) $ >
+  < small b(n) $ >
+  < small s : 0 $ >
+  < small i : 0 $ >
+  < swarm {loop} extinguish >
+  < shoot a $ >
+extinguish
+dragon sq x fire
+  < return x * x >
+extinguish
+dragon noisy x fire
+  < shoot x $ >
+  < return x >
+extinguish
+end
+'''
+
+# swarm loops which break a rule, with the reason they are rejected
+REASONS = [
+  ("i spits n fire < a(i) : 1 $ > < i : i + 1 $ >",
+   "its condition must be an index eats or eats_more a bound"),
+  ("i eats n fire < a(i) : 1 $ >",
+   "its body must end with < i : i + 1 $ >"),
+  ("i eats n fire < i : i + 2 $ > < i : i + 1 $ >",
+   "it changes i before its last statement"),
+  ("i eats n fire < small i : 0 $ > < i : i + 1 $ >",
+   "it changes i before its last statement"),
+  ("i eats n fire < shoot i $ > < i : i + 1 $ >",
+   "it shoots, which would come out of order"),
+  ("i eats n fire < consume s $ > < i : i + 1 $ >",
+   "it consumes input"),
+  ("i eats n fire < return 1 > < i : i + 1 $ >",
+   "it returns"),
+  ("i eats n fire < big g : 1 $ > < i : i + 1 $ >",
+   "it creates the big variable g"),
+  ("i eats n fire < path i is 1 here < small t : 1 $ > here > < i : i + 1 $ >",
+   "it creates t inside a block, not on the top level of its body"),
+  ("i eats n fire < s : s + i $ > < i : i + 1 $ >",
+   "it changes s, which it did not create"),
+  ("i eats n fire < a(i + 1) : 1 $ > < i : i + 1 $ >",
+   "it writes into a at an index other than i"),
+  ("i eats n fire < a(i) : 1 $ > < b(i) : a(0) $ > < i : i + 1 $ >",
+   "it reads a other than as a(i), which other iterations write"),
+  ("i eats n fire < a(i) : 1 $ > < b(i) : hatch sq[a] $ > < i : i + 1 $ >",
+   "it reads a other than as a(i), which other iterations write"),
+  ("i eats n fire < a(i) : hatch noisy[i] $ > < i : i + 1 $ >",
+   "it calls noisy, which is not a pure dragon"),
+  ("i eats n fire < a(i) : hatch shout[i] $ > < i : i + 1 $ >",
+   "it calls shout, which is not a pure builtin"),
+  ("i eats n fire < small t : t + 1 $ > < a(i) : t $ > < i : i + 1 $ >",
+   "it uses t before creating it, so it could see another iteration's"),
+  ("i eats a(0) fire < a(i) : 1 $ > < i : i + 1 $ >",
+   "its bound reads a, which the loop changes"),
+  ("i eats n fire < small c : a $ > < c(0) : i $ > < i : i + 1 $ >",
+   "it writes into c, which may be an array it did not create"),
+  ("i eats n fire < small c(2) $ > < small c : a $ > < c(i) : 1 $ > < i : i + 1 $ >",
+   "it writes into c, which may be an array it did not create"),
+  ("i eats n fire < small c(2) $ > < c : a $ > < c(0) : i $ > < i : i + 1 $ >",
+   "it changes the array c as a whole, so it may become an array it did not create"),
+]
+
+
+def parse(src):
+  return Parser(Lexer(io.StringIO(src))).parse()
+
+
+def run(src, engine, workers=None):
+  """
+    Run the program src on engine, its swarms over a pool of workers if
+    it is given. Returns what it printed, the exit code if it was
+    stopped, and its Swarm.
+    """
+  pt = parse(src)
+  swarm = Swarm.Swarm(pt, workers) if workers else None
+  out = io.StringIO()
+  code = None
+  try:
+    with contextlib.redirect_stdout(out):
+      if engine == "closure":
+        Closures.run_program(pt, None, None, swarm)
+      else:
+        DragonsRCool.swarm = swarm
+        DragonsRCool.eval_parse_tree(pt, DragonsRCool.RefEnv(), None)
+  except SystemExit as e:
+    code = e.code
+  finally:
+    DragonsRCool.swarm = None
+    if swarm is not None and swarm.pool is not None:
+      swarm.pool.shutdown()
+  return out.getvalue(), code, swarm
+
+
+def as_burn(src):
+  return src.replace("< swarm ", "< burn ")
+
+
+class SwarmTest(unittest.TestCase):
+
+  def setUp(self):
+    self.spread_time = Swarm.SPREAD_TIME
+    Swarm.SPREAD_TIME = 0
+
+  def tearDown(self):
+    Swarm.SPREAD_TIME = self.spread_time
+
+  def check(self, src):
+    """
+      Check src runs over the pool as it does in order, on both
+      engines which use the pool.
+      """
+    expected = run(as_burn(src), "tree")[:2]
+    for engine in ("tree", "closure"):
+      with self.subTest(engine=engine):
+        out, code, swarm = run(src, engine, WORKERS)
+        self.assertIsNotNone(swarm.pool, "the swarm was not handed out")
+        self.assertEqual((out, code), expected)
+    return expected
+
+  def test_kind_changes(self):
+    out, _ = self.check(KINDS)
+    self.assertIn("20.5", out)
+
+  def test_writes_sent_back(self):
+    out, _ = self.check(REST)
+    self.assertIn(str(39 * 4611686018427387904), out)
+
+  def test_temps_read_after(self):
+    out, _ = self.check(TEMPS)
+    self.assertTrue(out.endswith("99 \n"))
+
+  def test_error_in_worker(self):
+    out, code = self.check(ERROR)
+    self.assertEqual(code, -1)
+    self.assertNotIn("[", out)
+
+  def test_swarm_in_dragon(self):
+    self.check(CALLED)
+
+  def test_one_worker_runs_in_order(self):
+    out, code, swarm = run(REST, "closure", 1)
+    self.assertIsNone(swarm.pool)
+    self.assertEqual((out, code), run(as_burn(REST), "closure")[:2])
+
+
+class RejectTest(unittest.TestCase):
+
+  def test_reasons(self):
+    for loop, reason in REASONS:
+      with self.subTest(loop=loop):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), self.assertRaises(SystemExit):
+          Swarm.Swarm(parse(REJECTED.format(loop=loop)), WORKERS)
+        self.assertEqual(out.getvalue(),
+                         f"swarm on line 8 cannot run in parallel: {reason}\n")
+
+  def test_alias_read_only(self):
+    loop = "i eats n fire < small c : a $ > < b(i) : c(i) * 2 $ > < i : i + 1 $ >"
+    swarm = Swarm.Swarm(parse(REJECTED.format(loop=loop)), WORKERS)
+    self.assertEqual(len(swarm.loops), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()